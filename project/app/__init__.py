@@ -45,7 +45,11 @@ def create_app(config_class=Config):
 
     sess.init_app(app)
 
-    socketio.init_app(app, async_mode='eventlet')
+    # Celery workers only publish events to redis, they're delivered by the web tier.
+    is_web_process = os.getenv("REDIS_PROCESS_TYPE") != "celery"
+    if is_web_process:
+        socketio.init_app(app, async_mode='eventlet',
+                          message_queue=app.config["SOCKETIO_MESSAGE_QUEUE"])
 
     celery_init_app(app)
 
@@ -55,6 +59,13 @@ def create_app(config_class=Config):
     from app.api import bp as hou_api_bp
     app.register_blueprint(hou_api_bp, url_prefix='/api')
 
+    from app.api import metrics
+    metrics.init_app(app)
+
+    if is_web_process and app.config["RENDER_EVENT_RELAY"]:
+        from app.api import event_relay
+        event_relay.RenderEventRelay.start()
+
     ensure_upload_folder(app)
 
     return app
@@ -2,4 +2,5 @@ from flask import Blueprint
 
 bp = Blueprint('api', __name__)
 
-from app.api import hou_api
+# Importing socket_update registers its Socket.IO event handlers.
+from app.api import hou_api, socket_update
@@ -1,18 +1,20 @@
 import os
-import math
-import json
+import time
 import uuid
 import logging
 from pathlib import Path
 
 import hou
+import numpy as np
 
-from app.api import progress_filter
+from app.api import (progress_filter, scene_cache, sequence_archive, glb_optimizer,
+                     preview_raster, camera_framing, render_events, metrics, render_trace)
 from app import redis_client, constants as cnst
 
 
-def generate_render_path(original_render_path, out_node, file_uuid, force_png=False):
-    render_id = str(uuid.uuid4())
+def generate_render_path(original_render_path, out_node, file_uuid, force_png=False, render_id=None):
+    if render_id is None:
+        render_id = str(uuid.uuid4())
     path = Path(original_render_path)
     original_file_name = path.stem + path.suffix
 
@@ -34,8 +36,35 @@ def generate_render_path(original_render_path, out_node, file_uuid, force_png=Fa
     return target_path, render_id
 
 
-def render_rop(render_data, hip_path, force_png=False):
-    hou.hipFile.load(hip_path, suppress_save_prompt=True, ignore_load_warnings=True)
+def split_frame_range(start, end, step, shard_size):
+    """Split the inclusive frame range into consecutive shards of at most
+    `shard_size` frames. A `shard_size` of 0 disables sharding.
+    """
+    step = step or 1
+    if not shard_size:
+        return [(start, end)]
+
+    shards = []
+    shard_start = start
+    while shard_start <= end:
+        shard_end = min(shard_start + (shard_size - 1) * step, end)
+        shards.append((shard_start, shard_end))
+        shard_start = shard_end + step
+    return shards
+
+
+def render_rop(render_data, hip_path, force_png=False, render_id=None,
+               frame_range=None, shard_index=None):
+    """Render the ROP's outputs into `USER_RENDER_DIR/<render_id>`.
+
+    When rendering a shard of a larger sequence the caller passes the shared
+    `render_id`, the shard's `frame_range` and `shard_index`. Shards report
+    progress towards the whole sequence and leave the completion
+    notification to `complete_rop_shard` once every shard has finished.
+
+    :returns: The expanded output path, or None if nothing was rendered.
+    """
+    load_render_scene(render_data, hip_path, shard=shard_index)
     out_node_path = render_data["node_path"]
     out_node = hou.node(out_node_path)
 
@@ -49,12 +78,13 @@ def render_rop(render_data, hip_path, force_png=False):
             logging.info("Rendering to: {0}".format(out_path))
 
     if not out_path:
-        return
+        return None
 
     updated_render_path, render_id = generate_render_path(out_path, out_node,
                                                           render_data["file_uuid"],
-                                                          force_png=force_png)
-    frame_range_tuple = (render_data["start"], render_data["end"])
+                                                          force_png=force_png,
+                                                          render_id=render_id)
+    frame_range_tuple = frame_range or (render_data["start"], render_data["end"])
 
     if force_png:
         render_data["thumbnail_path"] = hou.text.expandString(updated_render_path)
@@ -62,13 +92,23 @@ def render_rop(render_data, hip_path, force_png=False):
         out_node.setCachedUserData("rop_data", render_data)
         frame_range_tuple = (render_data["start"], render_data["start"])
 
-    redis_instance = redis_client.get_client_instance()
+    progress_transform = None
+    if shard_index is not None:
+        def progress_transform(progress):
+            return redis_client.update_rop_shard_progress(render_id, shard_index, progress)
+
     stream_filter = progress_filter.ProgressFilter(
-        redis_instance, render_data["socket_id"], out_node_path,
-        channel=cnst.PublishChannels.glb_progress
+        render_data["socket_id"], out_node_path,
+        emit_progress=render_events.emit_render_progress,
+        progress_transform=progress_transform
     )
+    render_type = cnst.BackgroundRenderType.rop_render
+    if force_png:
+        render_type = cnst.BackgroundRenderType.thumbnail
+    category = metrics.get_category_label(out_node)
+    expanded_render_path = None
     try:
-        with stream_filter:
+        with stream_filter, metrics.EXPORT_SECONDS.time(render_type=render_type, category=category):
             out_node.render(
                 frame_range_tuple,
                 output_file=updated_render_path,
@@ -76,15 +116,16 @@ def render_rop(render_data, hip_path, force_png=False):
                 output_progress=True)
     except hou.OperationFailed as exc:
         logging.error(exc)
+        metrics.RENDERS_TOTAL.inc(render_type=render_type, category=category, status="failed")
+        render_trace.record(render_data.get("trace_id"), cnst.TraceStages.failed,
+                            render_type=render_type, shard=shard_index)
     else:
-        if not force_png:
-            on_completion_notification(out_node_path,
-                                       hou.text.expandString(updated_render_path),
-                                       cnst.BackgroundRenderType.rop_render,
-                                       render_id,
-                                       (render_data["start"], render_data["end"]),
-                                       socket_id=render_data["socket_id"],
-                                       rop_uuid_prefix=render_id)
+        metrics.RENDERS_TOTAL.inc(render_type=render_type, category=category, status="succeeded")
+        render_trace.record(render_data.get("trace_id"), cnst.TraceStages.exported,
+                            render_type=render_type, shard=shard_index)
+        expanded_render_path = hou.text.expandString(updated_render_path)
+        if not force_png and shard_index is None:
+            complete_rop_render(render_data, render_id, expanded_render_path)
     finally:
         if force_png:
             out_node.removeRenderEventCallback(update_progress)
@@ -92,9 +133,76 @@ def render_rop(render_data, hip_path, force_png=False):
         out_node.destroyCachedUserData("rop_render", must_exist=False)
         out_node.destroyCachedUserData("rop_data", must_exist=False)
 
+    return expanded_render_path
+
+
+def complete_rop_render(render_data, render_id, render_path):
+    # Archive the sequence before notifying, the client downloads it straight away.
+    sequence_archive.build_sequence_archive(render_id)
+    on_completion_notification(render_data["node_path"],
+                               render_path,
+                               cnst.BackgroundRenderType.rop_render,
+                               render_id,
+                               (render_data["start"], render_data["end"]),
+                               socket_id=render_data["socket_id"],
+                               rop_uuid_prefix=render_id,
+                               trace_id=render_data.get("trace_id"),
+                               hip_file_uuid=render_data["file_uuid"],
+                               user_uuid=render_data.get("user_uuid"))
+
+
+def complete_rop_shard(render_data, render_id, shard_index, render_path):
+    """Record a finished shard of a sequence, the last shard to finish
+    completes the whole sequence.
+
+    :param render_path: The shard's output path, None if it failed.
+    """
+    shard_paths = redis_client.record_rop_shard_output(render_id, shard_index, render_path)
+    if shard_paths is None:
+        return
+
+    if not all(shard_paths):
+        logging.error("Not every shard of render {0} produced output.".format(render_id))
+        render_trace.record(render_data.get("trace_id"), cnst.TraceStages.failed,
+                            render_type=cnst.BackgroundRenderType.rop_render)
+        render_events.emit_rop_failure(render_id,
+                                       render_data["node_path"],
+                                       render_data["socket_id"],
+                                       trace_id=render_data.get("trace_id"),
+                                       hip_file_uuid=render_data["file_uuid"],
+                                       user_uuid=render_data.get("user_uuid"))
+        return
+
+    complete_rop_render(render_data, render_id, shard_paths[-1])
+
+
+def load_render_scene(render_data, hip_path, **trace_fields):
+    """Load the task's .hip, reusing the resident scene where possible, and
+    record the `scene_loaded` stage of the render's trace.
+    """
+    reused = scene_cache.load_hip(hip_path, file_uuid=render_data["file_uuid"])
+    render_trace.record(render_data.get("trace_id"), cnst.TraceStages.scene_loaded,
+                        reused=int(reused), **trace_fields)
+
 
-def render_glb(render_data, hip_path):
-    hou.hipFile.load(hip_path, suppress_save_prompt=True, ignore_load_warnings=True)
+def render_glb_with_thumbnail(render_data, hip_path):
+    """Export the GLB and render its thumbnail from a single scene load.
+
+    The thumbnail is rendered at the frame the scene was loaded on, reusing
+    the target's cooked geometry when the export starts at that frame.
+    """
+    load_render_scene(render_data, hip_path)
+    current_frame = hou.frame()
+
+    render_glb(render_data, hip_path, load=False)
+
+    hou.setFrame(current_frame)
+    generate_thumbnail(render_data, hip_path, load=False)
+
+
+def render_glb(render_data, hip_path, load=True):
+    if load:
+        load_render_scene(render_data, hip_path)
 
     node_path = render_data["node_path"]
     glb_path = render_data["glb_path"]
@@ -120,23 +228,37 @@ def render_glb(render_data, hip_path):
         if out_node is None:
             out_node = hou.node("/out").createNode("gltf")
             out_node.setName(cnst.GLB_ROP)
+        else:
+            reset_owned_rop(out_node)
     else:
         out_node = render_node
 
-    # Set up the GLTF ROP Node.
+    render_type = cnst.BackgroundRenderType.glb_file
+    trace_id = render_data.get("trace_id")
+    if cook_render_target(render_node, render_data["start"]):
+        render_trace.record(trace_id, cnst.TraceStages.cooked, render_type=render_type)
+
     category = render_node.type().category()
+    export_settings = render_data["export_settings"] or {}
+    if export_settings.get(cnst.GLB_PROXY_SETTING) and not is_manager and \
+            category != hou.ropNodeTypeCategory():
+        # Let the client display something while the full model exports.
+        render_glb_proxy(out_node, render_node, render_data)
+
+    # Set up the GLTF ROP Node.
     prepare_gltf_rop(out_node, category, is_manager, render_data, render_path, glb_path)
 
     # Bake any CHOP data on object level transforms
+    baked = False
     if render_node.type().isManager():
         for node in render_node.children():
-            bake_object_transforms(node, render_data)
+            baked |= bake_object_transforms(node, render_data)
     else:
-        bake_object_transforms(render_node, render_data)
+        baked |= bake_object_transforms(render_node, render_data)
 
     # Object-level transforms when overridden by CHOP track, will not be processed.
     # Bake them here to ensure the transform information is passed to GLTF ROP.
-    bake_object_transforms(render_node, render_data)
+    baked |= bake_object_transforms(render_node, render_data)
 
     # Store the redis socket ID for retrieval in callback.
     out_node.setCachedUserData("socket_id", render_data["socket_id"])
@@ -144,23 +266,131 @@ def render_glb(render_data, hip_path):
 
     out_node.addRenderEventCallback(update_progress)
 
+    category_label = metrics.get_category_label(render_node)
     try:
-        out_node.render()
+        with metrics.EXPORT_SECONDS.time(render_type=render_type, category=category_label):
+            out_node.render()
     except hou.OperationFailed as exc:
         logging.error(exc)
+        metrics.RENDERS_TOTAL.inc(render_type=render_type, category=category_label, status="failed")
+        render_trace.record(trace_id, cnst.TraceStages.failed, render_type=render_type)
     else:
+        metrics.RENDERS_TOTAL.inc(render_type=render_type, category=category_label, status="succeeded")
+        if export_settings.get(cnst.GLB_OPTIMIZE_SETTING):
+            glb_optimizer.optimize_glb(glb_path)
+        render_trace.record(trace_id, cnst.TraceStages.exported, render_type=render_type)
+
         on_completion_notification(node_path,
                                    glb_path,
                                    cnst.BackgroundRenderType.glb_file,
                                    render_data["file_uuid"],
                                    (render_data["start"], render_data["end"]),
-                                   socket_id=render_data["socket_id"])
+                                   socket_id=render_data["socket_id"],
+                                   lod=cnst.RenderLod.full,
+                                   trace_id=trace_id,
+                                   user_uuid=render_data.get("user_uuid"))
     finally:
         out_node.removeRenderEventCallback(update_progress)
         out_node.destroyCachedUserData("socket_id", must_exist=False)
+        # Baked keyframes and a user ROP set up for this export are edits to
+        # the user's own nodes, the next task has to start from the file.
+        if baked or out_node is render_node:
+            scene_cache.invalidate()
+
+
+def cook_render_target(render_node, frame):
+    """Cook the geometry the export starts from at its first `frame`, so
+    cooking and exporting can be timed apart. The export's first frame
+    reuses the result rather than cooking again.
+
+    :returns: Whether anything was cooked.
+    """
+    if render_node.type().isManager() or \
+            render_node.type().category() == hou.ropNodeTypeCategory():
+        return False
+
+    if render_node.type().category() != hou.sopNodeTypeCategory():
+        render_node = render_node.renderNode()
+
+    hou.setFrame(frame)
+    try:
+        render_node.cook()
+    except hou.OperationFailed as exc:
+        # Leave reporting the failure to the export.
+        logging.error("Cook failed for {0}: {1}".format(render_node.path(), exc))
+        return False
+    return True
+
+
+def get_proxy_path(render_path):
+    root, ext = os.path.splitext(render_path)
+    return root + cnst.PROXY_SUFFIX + ext
+
+
+def render_glb_proxy(out_node, render_node, render_data):
+    """Export a PolyReduced, single frame proxy of the target next to the
+    full resolution GLB, under the same render UUID.
+
+    The target is already cooked at this point, so the proxy only costs the
+    reduction and a small export. Targets below `GLB_PROXY_MIN_PRIMS`
+    primitives download quickly enough on their own and are skipped.
+
+    :returns: The proxy's path, or None if no proxy was exported.
+    """
+    is_sop = render_node.type().category() == hou.sopNodeTypeCategory()
+    source_node = render_node if is_sop else render_node.renderNode()
+    if source_node is None:
+        return None
+
+    try:
+        prim_count = source_node.geometry().intrinsicValue("primitivecount")
+    except (hou.OperationFailed, AttributeError):
+        return None
+    if prim_count < cnst.GLB_PROXY_MIN_PRIMS:
+        return None
+
+    proxy_path = get_proxy_path(render_data["glb_path"])
+    proxy_data = dict(render_data, end=render_data["start"])
+
+    reduce_node = source_node.parent().createNode("polyreduce", cnst.GLB_PROXY_NODE)
+    reduce_node.setInput(0, source_node)
+    reduce_node.parm("percentage").set(cnst.GLB_PROXY_PERCENTAGE)
+
+    try:
+        if is_sop:
+            prepare_gltf_rop(out_node, hou.sopNodeTypeCategory(), False, proxy_data,
+                             reduce_node.path(), proxy_path)
+            out_node.render()
+        else:
+            # Export through the object so its transform matches the full model.
+            with RenderContextManager(reduce_node):
+                prepare_gltf_rop(out_node, hou.objNodeTypeCategory(), False, proxy_data,
+                                 render_node.path(), proxy_path)
+                out_node.render()
+    except hou.OperationFailed as exc:
+        logging.error("Proxy export failed for {0}: {1}".format(render_node.path(), exc))
+        return None
+    finally:
+        reduce_node.destroy()
+
+    if (render_data["export_settings"] or {}).get(cnst.GLB_OPTIMIZE_SETTING):
+        glb_optimizer.optimize_glb(proxy_path)
+
+    on_completion_notification(render_data["node_path"],
+                               proxy_path,
+                               cnst.BackgroundRenderType.glb_file,
+                               render_data["file_uuid"],
+                               (render_data["start"], render_data["end"]),
+                               socket_id=render_data["socket_id"],
+                               lod=cnst.RenderLod.proxy,
+                               trace_id=render_data.get("trace_id"),
+                               user_uuid=render_data.get("user_uuid"))
+    return proxy_path
 
 
 def bake_object_transforms(node, render_data):
+    """:returns: Whether any keyframes were baked onto `node`."""
+    baked = False
     rotation_parm = node.parmTuple("r")
     translate_parm = node.parmTuple("t")
     scale_parm = node.parmTuple("s")
@@ -183,6 +413,16 @@ def bake_object_transforms(node, render_data):
                     render_data["start"], render_data["end"],
                     hou.parmBakeChop.KeepExportFlag  # Keep CHOP export flag, but baked animation is present.
                 )
+                baked = True
+    return baked
+
+
+def reset_owned_rop(out_node):
+    """ROPs created by the renderer outlive the task in a resident scene,
+    drop whatever an earlier task set on them.
+    """
+    for parm_tuple in out_node.parmTuples():
+        parm_tuple.revertToDefaults()
 
 
 def prepare_gltf_rop(out_node, category, is_manager, render_data, render_path, glb_path):
@@ -207,8 +447,11 @@ def prepare_gltf_rop(out_node, category, is_manager, render_data, render_path, g
     # Useful to query "f2" to determine progress in callback.
     _set_frame_data(out_node, render_data)
 
-    export_settings = render_data["export_settings"]
+    export_settings = render_data["export_settings"] or {}
     for parmName, value in export_settings.items():
+        # Post-export settings are handled after the ROP has written the file.
+        if parmName in cnst.POST_EXPORT_SETTINGS:
+            continue
         try:
             out_node.parm(parmName.lower()).set(value)
         except Exception as e:
@@ -228,7 +471,9 @@ def update_progress(rop_node, render_event_type, time):
                     cnst.BackgroundRenderType.thumbnail,
                     rop_data["file_uuid"],
                     None,
-                    socket_id=rop_data["socket_id"])
+                    socket_id=rop_data["socket_id"],
+                    trace_id=rop_data.get("trace_id"),
+                    user_uuid=rop_data.get("user_uuid"))
             return
 
         else:
@@ -242,15 +487,7 @@ def update_progress(rop_node, render_event_type, time):
 
         socket_id = rop_node.cachedUserData("socket_id")
         if socket_id is not None:
-            render_update_data = {
-                "render_node_path": render_node_path,
-                "socket_id": socket_id,
-                "progress": progress
-            }
-            render_update_json = json.dumps(render_update_data)
-            redis_instance = redis_client.get_client_instance()
-            redis_instance.publish(cnst.PublishChannels.glb_progress,
-                                   render_update_json)
+            render_events.emit_render_progress(render_node_path, progress, socket_id)
 
 
 def render_thumbnail_with_karma(node_path, camera_path, thumbnail_path,
@@ -260,21 +497,25 @@ def render_thumbnail_with_karma(node_path, camera_path, thumbnail_path,
         out_node = hou.node("/out").createNode("karma")
         out_node.setName(cnst.THUMBNAIL_ROP)
 
-        out_node.parm("resolutionx").set(cnst.DEFAULT_RES)
-        out_node.parm("resolutiony").set(cnst.DEFAULT_RES)
-
-        out_node.parm("camera").set(camera_path)
-        out_node.parm("samplesperpixel").set(6)
-        out_node.parm("enablemblur").set(False)
-
         # Simple lighting setup.
         env_light = hou.node("/obj").createNode("envlight")
         env_light.parm("env_map").set(
             "$HFS/houdini/pic/hdri/HDRIHaven_lenong_1_2k.rat")
+    else:
+        reset_owned_rop(out_node)
+
+    out_node.parm("resolutionx").set(cnst.DEFAULT_RES)
+    out_node.parm("resolutiony").set(cnst.DEFAULT_RES)
+
+    out_node.parm("camera").set(camera_path)
+    out_node.parm("samplesperpixel").set(6)
+    out_node.parm("enablemblur").set(False)
 
     # Only render the specified node.
-    if hou.node(node_path).type().isManager():
+    render_node = hou.node(node_path)
+    if render_node.type().isManager():
         out_node.parm("candobjects").set("{0}/*".format(node_path))
+        out_node.parm("objects").set("")
     else:
         out_node.parm("candobjects").set(node_path)
         out_node.parm("objects").set(node_path)
@@ -290,21 +531,19 @@ def render_thumbnail_with_karma(node_path, camera_path, thumbnail_path,
     # For >= 20.0 hou version
     out_node.parm("alfprogress").set(True)
 
-    redis_instance = redis_client.get_client_instance()
-    stream_filter = progress_filter.ProgressFilter(redis_instance, socket_id,
-                                                   out_node.path())
-    with stream_filter:
+    stream_filter = progress_filter.ProgressFilter(socket_id, out_node.path())
+    with stream_filter, metrics.KARMA_SECONDS.time(category=metrics.get_category_label(render_node)):
         out_node.render(verbose=True, output_progress=True)
 
 
-def generate_thumbnail(render_data, hip_path, generate_for_rop=False):
+def generate_thumbnail(render_data, hip_path, generate_for_rop=False, load=True):
     """OpenGL isn't available with current Docker setup (no GPU).
 
     Instead, render via Karma CPU in separate celery Task.
     """
-    # Suppress hou.LoadWarning exceptions.
-    hou.hipFile.load(
-        hip_path, suppress_save_prompt=True, ignore_load_warnings=True)
+    if load:
+        # Reuses the resident scene when this worker already loaded the file.
+        load_render_scene(render_data, hip_path)
 
     # Create and position a camera
     out_camera = hou.node("/obj/{0}".format(cnst.THUMBNAIL_CAM))
@@ -337,112 +576,173 @@ def generate_thumbnail(render_data, hip_path, generate_for_rop=False):
                       "Invalid render object specified.".format(render_data["node_path"]))
 
     with RenderContextManager(render_obj):
-        # Need a SOP node to calculate the OBJ's bbox.
-        if render_obj.type().isManager():
-            default_bbox = hou.BoundingBox()
-            for node in render_obj.children():
-                # Just take into account geometry object nodes.
-                # Not great, but covers most scenarios.
-                if node.type().name() == "geo":
-                    try:
-                        bbox = node.renderNode().geometry().boundingBox()
-                        bbox *= node.worldTransform()
-                        default_bbox.enlargeToContain(bbox)
-                    except AttributeError:
-                        continue
-            frame_selected_bbox(render_obj, out_camera, bbox=default_bbox)
-        else:
-            if render_obj.type().category().name() == 'Sop':
-                sop_geo = render_obj.geometry().freeze()
-                render_obj = render_obj.parent()
-            else:
-                sop_geo = render_obj.displayNode().geometry().freeze()
+        target_node = render_obj
+        if render_obj.type().category() == hou.sopNodeTypeCategory():
+            render_obj = render_obj.parent()
 
-            # UI is not available, can't use hou.GeometryViewport.frameSelected() :(
-            frame_selected_bbox(render_obj, out_camera, sop_geo)
+        # UI is not available, can't use hou.GeometryViewport.frameSelected() :(
+        bbox = get_framing_bbox(target_node, render_data["file_uuid"])
+        frame_selected_bbox(render_obj, out_camera, bbox)
 
         thumbnail_path = render_data["thumbnail_path"]
         socket_id = render_data["socket_id"]
 
+        # Karma takes a while, show a rasterized preview in the meantime.
+        render_preview_thumbnail(render_data, out_camera, target_node)
+
         render_thumbnail_with_karma(render_obj.path(),
                                     out_camera.path(), thumbnail_path,
                                     socket_id)
+        render_trace.record(render_data.get("trace_id"), cnst.TraceStages.exported,
+                            render_type=cnst.BackgroundRenderType.thumbnail)
 
         on_completion_notification(render_data["node_path"],
                                    thumbnail_path,
                                    cnst.BackgroundRenderType.thumbnail,
                                    render_data["file_uuid"],
                                    None,
-                                   socket_id=socket_id)
-
-
-def frame_selected_bbox(render_obj, camera, sop_geo=None, bbox=None):
-    # Calculates w/r/t SOP context.
-    if bbox is None:
-        bbox = sop_geo.boundingBox()
-
-    try:
-        obj_origin = render_obj.origin()
-    except AttributeError:
-        obj_origin = hou.Vector3(0, 0, 0)
-
-    # Scale up our bbox for a bit of padding.
-    scale_factor = 1.50
-    center = bbox.center()
-    new_size_x = (bbox.sizevec()[0] * scale_factor) / 2
-    new_size_y = (bbox.sizevec()[1] * scale_factor) / 2
-    new_size_z = (bbox.sizevec()[2] * scale_factor) / 2
-
-    # Set the new min and max vectors based on the scaled size
-    new_min = hou.Vector3(center[0] - new_size_x, center[1] - new_size_y, center[2] - new_size_z)
-    new_max = hou.Vector3(center[0] + new_size_x, center[1] + new_size_y, center[2] + new_size_z)
-
-    # Create a new bounding box with the enlarged size
-    enlarged_bbox = hou.BoundingBox(new_min[0], new_min[1], new_min[2], new_max[0], new_max[1], new_max[2])
-    bbox = enlarged_bbox
-
-    bbox_center = bbox.center() + obj_origin
+                                   socket_id=socket_id,
+                                   trace_id=render_data.get("trace_id"),
+                                   user_uuid=render_data.get("user_uuid"))
 
-    adjust_height = hou.Vector3(bbox_center.x(), bbox_center.y(),
-                                bbox_center.z() + 115.0)
-    transform = hou.hmath.buildTranslate(adjust_height)
-    camera.setWorldTransform(transform)
 
-    look_at_cube = hou.node("/obj").createNode("geo")
-    look_at_cube.setWorldTransform(hou.hmath.buildTranslate(bbox_center))
-    look_at_mtx = camera.buildLookatRotation(look_at_cube)
+def render_preview_thumbnail(render_data, camera, node):
+    """Point splat the cooked geometry of `node` through `camera` into a
+    low fidelity PNG next to the thumbnail and publish it as a proxy.
 
-    rotation_mtx = look_at_mtx.extractRotationMatrix3()
-    rotation_tuples = rotation_mtx.asTupleOfTuples()
+    Best effort: failures are logged and the Karma render proceeds.
 
-    # Direction vector is already normalized by `buildLookAtRotation`
-    # Get the negative z-axis from the look-at-mtx.
-    direction_vector = -hou.Vector3(
-        rotation_tuples[2][0], rotation_tuples[2][1], rotation_tuples[2][2])
-    camera.setWorldTransform(look_at_mtx)
-
-    apx = camera.parm("aperture").evalAsFloat()
-    focal = camera.parm("focal").evalAsFloat()
-    resx = camera.parm("resx").evalAsInt()
-    resy = camera.parm("resy").evalAsInt()
-    asp = camera.parm("aspect").evalAsFloat()
+    :returns: The preview's path, or None if no preview was written.
+    """
+    start_time = time.monotonic()
+    preview_path = get_proxy_path(render_data["thumbnail_path"])
+    try:
+        points = []
+        colors = []
+        for geometry, transform in collect_preview_geometries(node):
+            positions = np.frombuffer(geometry.pointFloatAttribValuesAsString("P"),
+                                      dtype=np.float32).reshape(-1, 3)
+            matrix = np.array(transform.asTuple(), dtype=np.float32).reshape(4, 4)
+            points.append(positions @ matrix[:3, :3] + matrix[3, :3])
+
+            if geometry.findPointAttrib("Cd") is not None:
+                colors.append(np.frombuffer(geometry.pointFloatAttribValuesAsString("Cd"),
+                                            dtype=np.float32).reshape(-1, 3))
+            else:
+                colors.append(np.full_like(positions, 0.8))
 
-    fovx = 2 * math.atan((apx / 2) / focal)
-    apy = (resy * apx) / (resx * asp)
-    fovy = 2 * math.atan((apy / 2) / focal)
+        if not points:
+            return None
 
-    bbox_size = bbox.sizevec()
-    distance_width = (bbox_size[0] / 2.0) / math.tan(fovx / 2.0)
-    distance_height = (bbox_size[1] / 2.0) / math.tan(fovy / 2.0)
-    required_distance = max(distance_width, distance_height) + .5
+        world_to_camera = camera.worldTransform().inverted().asTuple()
+        image = preview_raster.rasterize_points(
+            np.concatenate(points), world_to_camera,
+            camera.parm("focal").evalAsFloat(),
+            camera.parm("aperture").evalAsFloat(),
+            (camera.parm("resx").evalAsInt(), camera.parm("resy").evalAsInt()),
+            colors=np.concatenate(colors))
+        preview_raster.write_png(image, preview_path)
+    except Exception as exc:
+        logging.error("Preview thumbnail failed for {0}: {1}".format(
+            render_data["node_path"], exc))
+        return None
+
+    logging.info("Preview thumbnail written in {0:.3f}s: {1}".format(
+        time.monotonic() - start_time, preview_path))
+    on_completion_notification(render_data["node_path"],
+                               preview_path,
+                               cnst.BackgroundRenderType.thumbnail,
+                               render_data["file_uuid"],
+                               None,
+                               socket_id=render_data["socket_id"],
+                               lod=cnst.RenderLod.proxy,
+                               trace_id=render_data.get("trace_id"),
+                               user_uuid=render_data.get("user_uuid"))
+    return preview_path
+
+
+def get_framing_bbox(node, file_uuid):
+    """Bounding box framed by the thumbnail camera as (min, max) tuples.
+
+    SOP and OBJ bounds are in the object's space, manager bounds in world
+    space. Results are cached per (hip hash, node, frame), so repeated
+    thumbnails of a file skip the cook entirely.
+    """
+    hip_hash = redis_client.get_file_hash_from_uuid(file_uuid)
+    frame = hou.frame()
+    if hip_hash is not None:
+        cached_bbox = redis_client.get_cached_bbox(hip_hash, node.path(), frame)
+        if cached_bbox is not None:
+            return cached_bbox
+
+    bbox = compute_bbox(node)
+    if hip_hash is not None:
+        redis_client.store_bbox(hip_hash, node.path(), frame, bbox)
+    return bbox
+
+
+def compute_bbox(node):
+    # Bounding boxes are read off the cooked geometry, which is never copied.
+    if node.type().isManager():
+        bboxes = []
+        for child in node.children():
+            # Just take into account geometry object nodes.
+            # Not great, but covers most scenarios.
+            if child.type().name() != "geo":
+                continue
+            try:
+                bounds = child.renderNode().geometry().boundingBox()
+            except AttributeError:
+                continue
+            bboxes.append(camera_framing.transform_bbox(
+                _bbox_to_tuple(bounds), child.worldTransform().asTupleOfTuples()))
+        return camera_framing.union_bbox(bboxes) or ((0.0, 0.0, 0.0), (0.0, 0.0, 0.0))
+
+    if node.type().category() == hou.sopNodeTypeCategory():
+        geometry = node.geometry()
+    else:
+        geometry = node.displayNode().geometry()
+    return _bbox_to_tuple(geometry.boundingBox())
+
+
+def collect_preview_geometries(node):
+    """Cooked geometry and world transform pairs making up `node`."""
+    if node.type().isManager():
+        geometries = []
+        for child in node.children():
+            if child.type().name() != "geo":
+                continue
+            try:
+                geometries.append((child.renderNode().geometry(), child.worldTransform()))
+            except AttributeError:
+                continue
+        return geometries
+
+    if node.type().category() == hou.sopNodeTypeCategory():
+        return [(node.geometry(), node.parent().worldTransform())]
+    return [(node.displayNode().geometry(), node.worldTransform())]
+
+
+def frame_selected_bbox(render_obj, camera, bbox):
+    """Place `camera` to frame `bbox`, see `camera_framing.frame_bbox`."""
+    try:
+        obj_origin = tuple(render_obj.origin())
+    except AttributeError:
+        obj_origin = (0.0, 0.0, 0.0)
 
-    new_camera_position = bbox_center - (direction_vector * required_distance)
+    transform = camera_framing.frame_bbox(
+        bbox,
+        focal=camera.parm("focal").evalAsFloat(),
+        aperture=camera.parm("aperture").evalAsFloat(),
+        resx=camera.parm("resx").evalAsInt(),
+        resy=camera.parm("resy").evalAsInt(),
+        aspect=camera.parm("aspect").evalAsFloat(),
+        origin=obj_origin)
+    camera.setWorldTransform(hou.Matrix4(transform))
 
-    result = hou.hmath.identityTransform()
-    result *= hou.hmath.buildRotate(look_at_mtx.extractRotates())
-    result *= hou.hmath.buildTranslate(new_camera_position)
 
-    camera.setWorldTransform(result)
+def _bbox_to_tuple(bounding_box):
+    return tuple(bounding_box.minvec()), tuple(bounding_box.maxvec())
 
 
 def on_completion_notification(node_path,
@@ -451,7 +751,11 @@ def on_completion_notification(node_path,
                                file_uuid,
                                frames,
                                socket_id=None,
-                               rop_uuid_prefix=None):
+                               rop_uuid_prefix=None,
+                               lod=None,
+                               trace_id=None,
+                               hip_file_uuid=None,
+                               user_uuid=None):
     if socket_id is None:
         completed_render_node = hou.node(node_path)
         if completed_render_node is None:
@@ -461,24 +765,25 @@ def on_completion_notification(node_path,
             return None
         socket_id = completed_render_node.cachedUserData("socket_id")
 
-    render_completion_data = {
-        "file_uuid": file_uuid,
-        "render_file_path": render_path,
-        "render_node_path": node_path,
-        "render_type": render_type,
-        "socket_id": socket_id,
-        "frame_info": frames
-    }
-
-    if rop_uuid_prefix:
-        render_completion_data["rop_uuid"] = rop_uuid_prefix
-
-    render_update_json = json.dumps(render_completion_data)
-    logging.info("Render Completion Published: {0}".format(render_update_json))
-
-    redis_instance = redis_client.get_client_instance()
-    redis_instance.publish(cnst.PublishChannels.render_completion,
-                           render_update_json)
+    if render_type != cnst.BackgroundRenderType.rop_render:
+        lod = lod or cnst.RenderLod.full
+
+    # Recorded first, the client's delivery acknowledgement may beat the emit back.
+    render_trace.record(trace_id, cnst.TraceStages.notified, render_type=render_type, lod=lod)
+
+    # Delivered to the submitting socket by the web tier's event relay.
+    with metrics.NOTIFY_SECONDS.time(render_type=render_type):
+        render_events.emit_render_completion(file_uuid,
+                                             render_path,
+                                             render_type,
+                                             node_path,
+                                             frames,
+                                             socket_id,
+                                             rop_uuid=rop_uuid_prefix,
+                                             lod=lod,
+                                             trace_id=trace_id,
+                                             hip_file_uuid=hip_file_uuid,
+                                             user_uuid=user_uuid)
 
 
 def _set_frame_data(out_node, render_data):
@@ -0,0 +1,140 @@
+"""Analytic camera framing, free of `hou` so it can run (and be tested)
+outside of Houdini.
+
+Matrices follow Houdini's row-vector convention: a point is transformed as
+`p * M`, the first three rows hold the camera's X, Y and Z axes and the
+last row its translation. Cameras look down their local -Z axis.
+
+Bounding boxes are passed as (min, max) tuples of 3-tuples.
+"""
+import math
+
+# Padding applied to bounding boxes so the framed object doesn't touch the frame edges.
+BBOX_PADDING = 1.5
+
+# Extra distance added to the fitted camera distance.
+DISTANCE_PADDING = 0.5
+
+# Thumbnails look at the object head on, down the world -Z axis.
+DEFAULT_VIEW_DIRECTION = (0.0, 0.0, -1.0)
+DEFAULT_UP = (0.0, 1.0, 0.0)
+
+
+def frame_bbox(bbox, focal, aperture, resx, resy, aspect=1.0, origin=(0.0, 0.0, 0.0),
+               view_direction=DEFAULT_VIEW_DIRECTION):
+    """Compute the world transform of a camera framing `bbox`.
+
+    :param bbox: (min, max) of the object in its own space, `origin` being
+        the object's world position.
+    :returns: 4x4 tuple of tuples, suitable for `hou.Matrix4`.
+    """
+    bbox_min, bbox_max = enlarge_bbox(bbox, BBOX_PADDING)
+    center = _add(bbox_center((bbox_min, bbox_max)), origin)
+    size = _sub(bbox_max, bbox_min)
+
+    fov_x, fov_y = field_of_view(focal, aperture, resx, resy, aspect)
+    distance = fit_distance(size, fov_x, fov_y)
+
+    direction = _normalize(view_direction)
+    eye = _sub(center, _scale(direction, distance))
+    rotation = look_at_rotation(eye, center)
+    return (rotation[0] + (0.0,),
+            rotation[1] + (0.0,),
+            rotation[2] + (0.0,),
+            eye + (1.0,))
+
+
+def look_at_rotation(eye, target, up=DEFAULT_UP):
+    """Rotation pointing a camera at `eye` towards `target`.
+
+    :returns: 3x3 tuple of tuples holding the camera's X, Y and Z axes.
+    """
+    z_axis = _normalize(_sub(eye, target))
+    if abs(_dot(z_axis, _normalize(up))) > 0.999:
+        # Looking straight up or down, any perpendicular up vector will do.
+        up = (0.0, 0.0, 1.0) if abs(z_axis[2]) < 0.999 else (1.0, 0.0, 0.0)
+    x_axis = _normalize(_cross(up, z_axis))
+    y_axis = _cross(z_axis, x_axis)
+    return x_axis, y_axis, z_axis
+
+
+def field_of_view(focal, aperture, resx, resy, aspect=1.0):
+    """Horizontal and vertical field of view, in radians."""
+    fov_x = 2 * math.atan((aperture / 2) / focal)
+    aperture_y = (resy * aperture) / (resx * aspect)
+    fov_y = 2 * math.atan((aperture_y / 2) / focal)
+    return fov_x, fov_y
+
+
+def fit_distance(size, fov_x, fov_y, padding=DISTANCE_PADDING):
+    """Distance at which a box of `size` fills the narrower field of view."""
+    distance_width = (size[0] / 2.0) / math.tan(fov_x / 2.0)
+    distance_height = (size[1] / 2.0) / math.tan(fov_y / 2.0)
+    return max(distance_width, distance_height) + padding
+
+
+def enlarge_bbox(bbox, scale):
+    bbox_min, bbox_max = bbox
+    center = bbox_center(bbox)
+    half_size = _scale(_sub(bbox_max, bbox_min), scale / 2.0)
+    return _sub(center, half_size), _add(center, half_size)
+
+
+def bbox_center(bbox):
+    bbox_min, bbox_max = bbox
+    return _scale(_add(bbox_min, bbox_max), 0.5)
+
+
+def transform_bbox(bbox, matrix):
+    """Axis aligned bounds of `bbox` after transforming its eight corners."""
+    bbox_min, bbox_max = bbox
+    corners = [(x, y, z)
+               for x in (bbox_min[0], bbox_max[0])
+               for y in (bbox_min[1], bbox_max[1])
+               for z in (bbox_min[2], bbox_max[2])]
+    transformed = [_transform_point(corner, matrix) for corner in corners]
+    return (tuple(min(point[i] for point in transformed) for i in range(3)),
+            tuple(max(point[i] for point in transformed) for i in range(3)))
+
+
+def union_bbox(bboxes):
+    """Bounds containing every bbox, or None if there are none."""
+    bboxes = list(bboxes)
+    if not bboxes:
+        return None
+    return (tuple(min(bbox[0][i] for bbox in bboxes) for i in range(3)),
+            tuple(max(bbox[1][i] for bbox in bboxes) for i in range(3)))
+
+
+def _transform_point(point, matrix):
+    return tuple(point[0] * matrix[0][i] + point[1] * matrix[1][i] +
+                 point[2] * matrix[2][i] + matrix[3][i] for i in range(3))
+
+
+def _add(a, b):
+    return tuple(x + y for x, y in zip(a, b))
+
+
+def _sub(a, b):
+    return tuple(x - y for x, y in zip(a, b))
+
+
+def _scale(a, factor):
+    return tuple(x * factor for x in a)
+
+
+def _dot(a, b):
+    return sum(x * y for x, y in zip(a, b))
+
+
+def _cross(a, b):
+    return (a[1] * b[2] - a[2] * b[1],
+            a[2] * b[0] - a[0] * b[2],
+            a[0] * b[1] - a[1] * b[0])
+
+
+def _normalize(a):
+    length = math.sqrt(_dot(a, a))
+    if length == 0:
+        raise ValueError("Cannot normalize a zero length vector.")
+    return _scale(a, 1.0 / length)
@@ -0,0 +1,135 @@
+import json
+import time
+import logging
+import contextlib
+
+import hou
+import redis
+
+from app import redis_client, constants as cnst
+
+# `PerfMonProfile.stats()` reports cook events under "cookStats" as a tree
+# of objects, each with its path, its own figures and its children. Only the
+# exclusive figures are read: a parent's totals already include its children,
+# which are counted from their own entries.
+_COOK_STATS_KEY = "cookStats"
+_SELF_TIME_KEY = "selfCookTime"
+_COOK_COUNT_KEY = "cookCount"
+_SELF_MEMORY_KEY = "selfMemory"
+
+
+def should_profile(render_data):
+    export_settings = render_data.get("export_settings") or {}
+    return cnst.PROFILE_RENDER_COOKS or bool(export_settings.get(cnst.PROFILE_COOK_SETTING))
+
+
+@contextlib.contextmanager
+def profile_cooks(render_data):
+    """Record per-node cook times and memory of everything cooked inside
+    the block with `hou.perfMon`, then store them against the .hip.
+
+    Profiling is best effort, it never fails the wrapped render.
+    """
+    profile = None
+    if should_profile(render_data):
+        profile = _start_profile("webrender {0}".format(render_data["node_path"]))
+
+    try:
+        yield
+    finally:
+        if profile is not None:
+            _finish_profile(profile, render_data)
+
+
+def get_hip_key(file_uuid):
+    # Files uploaded before hashes were recorded fall back to their UUID.
+    return redis_client.get_file_hash_from_uuid(file_uuid) or file_uuid
+
+
+def extract_node_stats(stats):
+    """Sum self cook time and count cooks per node path across the cook
+    statistics of a profile. Memory keeps the largest sample.
+
+    Entries that aren't nodes (e.g. unassigned work) are skipped.
+
+    :param stats: The decoded JSON of `PerfMonProfile.stats()`.
+    :returns: Dict of node path to {"cook_ms", "cooks", "memory"}.
+    """
+    node_stats = {}
+    cook_stats = stats.get(_COOK_STATS_KEY) if isinstance(stats, dict) else None
+    if not isinstance(cook_stats, dict):
+        return node_stats
+
+    for entry in _walk_objects(cook_stats.get("objects")):
+        node_path = entry.get("path")
+        figures = entry.get("stats")
+        if not isinstance(node_path, str) or not node_path.startswith("/") or \
+                not isinstance(figures, dict):
+            continue
+        cook_ms = figures.get(_SELF_TIME_KEY)
+        if not isinstance(cook_ms, (int, float)):
+            continue
+
+        node_entry = node_stats.setdefault(node_path, {"cook_ms": 0.0, "cooks": 0, "memory": 0})
+        node_entry["cook_ms"] += float(cook_ms)
+        node_entry["cooks"] += int(figures.get(_COOK_COUNT_KEY) or 0)
+
+        memory = figures.get(_SELF_MEMORY_KEY)
+        if isinstance(memory, (int, float)):
+            node_entry["memory"] = max(node_entry["memory"], int(memory))
+    return node_stats
+
+
+def _start_profile(title):
+    try:
+        try:
+            options = hou.PerfMonRecordOptions(
+                cook_stats=True, solve_stats=False, draw_stats=False,
+                gpu_draw_stats=False, viewport_stats=False, script_stats=False,
+                render_stats=False, thread_stats=False, frame_stats=False,
+                memory_stats=True, errors=False)
+        except TypeError:
+            # Older builds don't accept every category, record the defaults.
+            options = hou.PerfMonRecordOptions()
+        return hou.perfMon.startProfile(title, options)
+    except hou.Error as exc:
+        logging.error("Unable to start cook profile: {0}".format(exc))
+        return None
+
+
+def _finish_profile(profile, render_data):
+    try:
+        profile.stop()
+        stats = profile.stats()
+        if isinstance(stats, str):
+            stats = json.loads(stats)
+        node_stats = extract_node_stats(stats)
+    except (hou.Error, ValueError) as exc:
+        logging.error("Unable to read cook profile for {0}: {1}".format(
+            render_data["node_path"], exc))
+        return
+
+    if not node_stats:
+        return
+
+    profiled_at = time.time()
+    for node_entry in node_stats.values():
+        node_entry["profiled_at"] = profiled_at
+        node_entry["frame_range"] = [render_data["start"], render_data["end"]]
+
+    try:
+        redis_client.store_cook_stats(get_hip_key(render_data["file_uuid"]), node_stats)
+    except redis.RedisError as exc:
+        logging.error("Unable to store cook stats: {0}".format(exc))
+        return
+    logging.info("Stored cook stats of {0} nodes for {1}".format(
+        len(node_stats), render_data["node_path"]))
+
+
+def _walk_objects(objects):
+    pending = list(objects or [])
+    while pending:
+        entry = pending.pop()
+        if isinstance(entry, dict):
+            yield entry
+            pending.extend(entry.get("children") or [])
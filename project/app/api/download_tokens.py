@@ -0,0 +1,36 @@
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+
+from app import constants as cnst
+
+_SALT = "download-link"
+
+
+class InvalidDownloadToken(Exception):
+    """Raised for tampered, malformed or expired download tokens."""
+
+
+def generate_token(secret_key, filename, ext):
+    """Sign the download request into a self-contained, URL-safe token.
+
+    The token carries the filename, extension and issue time, all covered
+    by an HMAC over the app's secret key, so no server-side state is kept
+    and any worker can verify it.
+    """
+    return _get_serializer(secret_key).dumps([filename, ext])
+
+
+def verify_token(secret_key, token, max_age=cnst.DOWNLOAD_LINK_TTL):
+    """:returns: Tuple of the signed filename and extension.
+    :raises InvalidDownloadToken: If the signature doesn't match or expired.
+    """
+    try:
+        filename, ext = _get_serializer(secret_key).loads(token, max_age=max_age)
+    except SignatureExpired:
+        raise InvalidDownloadToken("Download link expired!")
+    except (BadSignature, ValueError, TypeError):
+        raise InvalidDownloadToken("Invalid download link provided.")
+    return filename, ext
+
+
+def _get_serializer(secret_key):
+    return URLSafeTimedSerializer(secret_key, salt=_SALT)
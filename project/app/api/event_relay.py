@@ -0,0 +1,117 @@
+import os
+import time
+import socket
+import logging
+
+import redis
+
+from app import socketio, redis_client, constants as cnst
+
+# Seconds a relay backs off after losing its redis connection.
+_RETRY_DELAY = 1.0
+
+# Events read or claimed per round trip.
+_BATCH_SIZE = 100
+
+# Most .hip files a single resync may replay.
+_MAX_RESYNC_FILES = 64
+
+
+class RenderEventRelay:
+    """Delivers published render events to the sockets they target.
+
+    Every web worker runs one relay in the shared consumer group, so each
+    event is emitted once, through the Socket.IO message queue, whichever
+    worker owns its socket. Events are only acknowledged once emitted, and
+    the pending events of a relay that died are claimed by the others.
+    """
+
+    _instance = None
+
+    def __init__(self):
+        self.consumer = "{0}-{1}".format(socket.gethostname(), os.getpid())
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    @classmethod
+    def start(cls):
+        relay = cls.get_instance()
+        socketio.start_background_task(relay.run)
+        return relay
+
+    def run(self):
+        logging.info("Render event relay {0} started.".format(self.consumer))
+        claim_interval = cnst.RENDER_EVENT_CLAIM_IDLE_MS / 1000.0
+        next_claim = 0
+        group_ready = False
+        while True:
+            try:
+                if not group_ready:
+                    redis_client.ensure_render_event_group()
+                    group_ready = True
+
+                if time.monotonic() >= next_claim:
+                    events = redis_client.claim_stale_render_events(self.consumer, count=_BATCH_SIZE)
+                    # Keep claiming while full batches come back.
+                    if len(events) < _BATCH_SIZE:
+                        next_claim = time.monotonic() + claim_interval
+                else:
+                    events = redis_client.read_render_events(self.consumer, count=_BATCH_SIZE)
+                self.deliver(events)
+            except redis.RedisError as exc:
+                logging.error("Render event relay {0} failed: {1}".format(self.consumer, exc))
+                # Redis may have restarted without the stream.
+                group_ready = False
+                socketio.sleep(_RETRY_DELAY)
+
+    def deliver(self, events):
+        for entry_id, fields in events:
+            # Events without a socket are only kept for replay.
+            if fields is not None and fields.get("socket_id"):
+                data = fields["data"]
+                if fields.get("event_id"):
+                    data["eventId"] = fields["event_id"]
+                socketio.emit(fields["event"], data, room=fields["socket_id"])
+        redis_client.ack_render_events([entry_id for entry_id, _ in events])
+
+
+def replay(cursors, socket_id, user_uuid):
+    """Re-emit the events `user_uuid`'s renders of each .hip recorded after
+    its cursor's event ID.
+
+    Cursors without an event ID are only positioned at the latest event,
+    nothing is replayed for them.
+
+    :param cursors: List of {"file", "lastEventId"} dicts.
+    :returns: Dict of .hip UUID to its new cursor.
+    """
+    positions = {}
+    for cursor in cursors[:_MAX_RESYNC_FILES]:
+        file_uuid = cursor.get("file")
+        last_event_id = cursor.get("lastEventId")
+        if not isinstance(file_uuid, str) or not file_uuid:
+            continue
+
+        if not is_valid_event_id(last_event_id):
+            positions[file_uuid] = redis_client.get_render_event_tip(user_uuid, file_uuid)
+            continue
+
+        positions[file_uuid] = last_event_id
+        history = redis_client.get_render_event_history(user_uuid, file_uuid, last_event_id)
+        for event_id, event, data in history:
+            data["eventId"] = event_id
+            socketio.emit(event, data, room=socket_id)
+            positions[file_uuid] = event_id
+    return positions
+
+
+def is_valid_event_id(event_id):
+    # Stream entry IDs are `<milliseconds>-<sequence>`.
+    if not isinstance(event_id, str):
+        return False
+    parts = event_id.split("-")
+    return len(parts) == 2 and all(part.isdigit() for part in parts)
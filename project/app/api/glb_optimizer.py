@@ -0,0 +1,378 @@
+import os
+import json
+import struct
+import logging
+import tempfile
+
+import numpy as np
+
+_GLB_MAGIC = 0x46546C67
+_JSON_CHUNK = 0x4E4F534A
+_BIN_CHUNK = 0x004E4942
+
+_ARRAY_BUFFER = 34962
+_ELEMENT_ARRAY_BUFFER = 34963
+_TRIANGLES = 4
+
+_COMPONENT_DTYPES = {
+    5120: np.int8,
+    5121: np.uint8,
+    5122: np.int16,
+    5123: np.uint16,
+    5125: np.uint32,
+    5126: np.float32,
+}
+_COMPONENT_TYPES = {np.dtype(dtype): component for component, dtype in _COMPONENT_DTYPES.items()}
+_TYPE_SIZES = {"SCALAR": 1, "VEC2": 2, "VEC3": 3, "VEC4": 4}
+_SIZE_TYPES = {size: name for name, size in _TYPE_SIZES.items()}
+
+# Extensions that don't reference accessors or buffer views, so the buffer
+# can be rebuilt without understanding them.
+_SAFE_EXTENSION_PREFIXES = ("KHR_materials_", "KHR_texture_transform", "KHR_lights_punctual",
+                            "KHR_mesh_quantization")
+
+
+class UnsupportedGLB(Exception):
+    """Raised for GLB layouts the optimizer leaves untouched."""
+
+
+def optimize_glb(glb_path, weld=True, quantize=True, strip=True):
+    """Rewrite the GLB at `glb_path` in place with smaller vertex data.
+
+    - strip: drop texture coordinates and tangents no material samples.
+    - quantize: store normals as normalized bytes (KHR_mesh_quantization)
+      and [0, 1] texture coordinates and colors as normalized shorts.
+    - weld: merge vertices whose attributes are identical after quantizing.
+
+    Files using features the optimizer doesn't understand (sparse accessors,
+    morph targets, external buffers, unknown extensions) are left as-is.
+
+    :returns: Dictionary with the byte size before and after optimizing.
+    :rtype: dict
+    """
+    size_before = os.path.getsize(glb_path)
+    try:
+        with open(glb_path, "rb") as glb_file:
+            gltf, bin_chunk = _read_glb(glb_file.read())
+
+        _optimize(gltf, bin_chunk, weld=weld, quantize=quantize, strip=strip)
+        _write_glb_atomic(glb_path, gltf)
+    except UnsupportedGLB as exc:
+        logging.info("Skipping GLB optimization for {0}: {1}".format(glb_path, exc))
+    except Exception as exc:
+        logging.error("GLB optimization failed for {0}: {1}".format(glb_path, exc))
+
+    size_after = os.path.getsize(glb_path)
+    logging.info("Optimized {0}: {1} -> {2} bytes".format(glb_path, size_before, size_after))
+    return {"size_before": size_before, "size_after": size_after}
+
+
+def _read_glb(data):
+    magic, version, _ = struct.unpack_from("<III", data, 0)
+    if magic != _GLB_MAGIC or version != 2:
+        raise UnsupportedGLB("Not a glTF 2.0 binary.")
+
+    gltf = None
+    bin_chunk = b""
+    offset = 12
+    while offset < len(data):
+        chunk_length, chunk_type = struct.unpack_from("<II", data, offset)
+        chunk_data = data[offset + 8:offset + 8 + chunk_length]
+        if chunk_type == _JSON_CHUNK:
+            gltf = json.loads(chunk_data.decode("utf-8"))
+        elif chunk_type == _BIN_CHUNK:
+            bin_chunk = chunk_data
+        offset += 8 + chunk_length
+
+    if gltf is None:
+        raise UnsupportedGLB("Missing JSON chunk.")
+    return gltf, bin_chunk
+
+
+def _optimize(gltf, bin_chunk, weld, quantize, strip):
+    buffers = gltf.get("buffers", [])
+    if len(buffers) > 1 or any("uri" in buffer for buffer in buffers):
+        raise UnsupportedGLB("External or multiple buffers.")
+
+    for extension in gltf.get("extensionsUsed", []):
+        if not extension.startswith(_SAFE_EXTENSION_PREFIXES):
+            raise UnsupportedGLB("Unsupported extension {0}.".format(extension))
+
+    builder = _BufferBuilder()
+    new_accessors = set()
+    uses_quantization = False
+    materials = gltf.get("materials", [])
+
+    for mesh in gltf.get("meshes", []):
+        for primitive in mesh.get("primitives", []):
+            if primitive.get("mode", _TRIANGLES) != _TRIANGLES or "targets" in primitive:
+                continue
+
+            material = None
+            if "material" in primitive:
+                material = materials[primitive["material"]]
+
+            attributes = {name: _read_accessor(gltf, bin_chunk, index)
+                          for name, index in primitive["attributes"].items()}
+            if "indices" in primitive:
+                indices = _read_accessor(gltf, bin_chunk, primitive["indices"])[0].reshape(-1)
+            else:
+                indices = np.arange(len(attributes["POSITION"][0]), dtype=np.uint32)
+
+            if strip:
+                attributes = _strip_attributes(attributes, material)
+            if quantize:
+                attributes, quantized_normals = _quantize_attributes(attributes)
+                uses_quantization = uses_quantization or quantized_normals
+            if weld:
+                attributes, indices = _weld_vertices(attributes, indices)
+
+            primitive["attributes"] = {}
+            for name, (data, normalized) in attributes.items():
+                accessor_index = _add_accessor(gltf, builder, data, normalized,
+                                               _ARRAY_BUFFER, with_bounds=name == "POSITION")
+                primitive["attributes"][name] = accessor_index
+                new_accessors.add(accessor_index)
+
+            index_dtype = np.uint16 if len(attributes["POSITION"][0]) < 65535 else np.uint32
+            index_data = indices.astype(index_dtype).reshape(-1, 1)
+            primitive["indices"] = _add_accessor(gltf, builder, index_data, False, _ELEMENT_ARRAY_BUFFER)
+            new_accessors.add(primitive["indices"])
+
+    _compact(gltf, bin_chunk, builder, new_accessors)
+
+    if uses_quantization:
+        for key in ("extensionsUsed", "extensionsRequired"):
+            extensions = gltf.setdefault(key, [])
+            if "KHR_mesh_quantization" not in extensions:
+                extensions.append("KHR_mesh_quantization")
+
+
+def _read_accessor(gltf, bin_chunk, index):
+    accessor = gltf["accessors"][index]
+    if "sparse" in accessor or "bufferView" not in accessor:
+        raise UnsupportedGLB("Sparse or empty accessor.")
+    if accessor["type"] not in _TYPE_SIZES:
+        raise UnsupportedGLB("Unsupported accessor type {0}.".format(accessor["type"]))
+
+    view = gltf["bufferViews"][accessor["bufferView"]]
+    dtype = np.dtype(_COMPONENT_DTYPES[accessor["componentType"]])
+    components = _TYPE_SIZES[accessor["type"]]
+    element_size = dtype.itemsize * components
+    stride = view.get("byteStride", element_size)
+    start = view.get("byteOffset", 0) + accessor.get("byteOffset", 0)
+    count = accessor["count"]
+
+    if count == 0:
+        return np.zeros((0, components), dtype=dtype), accessor.get("normalized", False)
+
+    raw = np.frombuffer(bin_chunk, dtype=np.uint8, count=stride * (count - 1) + element_size, offset=start)
+    rows = np.lib.stride_tricks.as_strided(raw, shape=(count, element_size), strides=(stride, 1))
+    data = np.ascontiguousarray(rows).view(dtype).reshape(count, components)
+    return data, accessor.get("normalized", False)
+
+
+def _strip_attributes(attributes, material):
+    used_texcoords = set()
+    has_normal_texture = False
+    if material is not None:
+        used_texcoords = _collect_texcoords(material)
+        has_normal_texture = "normalTexture" in material
+
+    stripped = {}
+    for name, attribute in attributes.items():
+        if name.startswith("TEXCOORD_") and int(name.split("_")[1]) not in used_texcoords:
+            continue
+        if name == "TANGENT" and not has_normal_texture:
+            continue
+        stripped[name] = attribute
+    return stripped
+
+
+def _collect_texcoords(value):
+    """Gather the texture coordinate sets referenced by a material's textures."""
+    texcoords = set()
+    if isinstance(value, dict):
+        if "index" in value:
+            texcoords.add(value.get("texCoord", 0))
+            transform = value.get("extensions", {}).get("KHR_texture_transform", {})
+            if "texCoord" in transform:
+                texcoords.add(transform["texCoord"])
+        for child in value.values():
+            texcoords |= _collect_texcoords(child)
+    elif isinstance(value, list):
+        for child in value:
+            texcoords |= _collect_texcoords(child)
+    return texcoords
+
+
+def _quantize_attributes(attributes):
+    quantized = {}
+    quantized_normals = False
+    for name, (data, normalized) in attributes.items():
+        if data.dtype == np.float32 and name == "NORMAL":
+            data = np.round(np.clip(data, -1.0, 1.0) * 127.0).astype(np.int8)
+            normalized = True
+            quantized_normals = True
+        elif data.dtype == np.float32 and name.startswith(("TEXCOORD_", "COLOR_")) and \
+                data.size and data.min() >= 0.0 and data.max() <= 1.0:
+            data = np.round(data * 65535.0).astype(np.uint16)
+            normalized = True
+        quantized[name] = (data, normalized)
+    return quantized, quantized_normals
+
+
+def _weld_vertices(attributes, indices):
+    names = list(attributes)
+    vertex_count = len(attributes[names[0]][0])
+    vertex_bytes = np.concatenate(
+        [attributes[name][0].view(np.uint8).reshape(vertex_count, -1) for name in names], axis=1)
+
+    _, first_index, inverse = np.unique(vertex_bytes, axis=0, return_index=True, return_inverse=True)
+
+    # Keep welded vertices in their original order for cache locality.
+    order = np.argsort(first_index)
+    remap = np.empty_like(order)
+    remap[order] = np.arange(len(order))
+    kept_vertices = first_index[order]
+
+    welded = {name: (attributes[name][0][kept_vertices], attributes[name][1]) for name in names}
+    return welded, remap[inverse.reshape(-1)][indices]
+
+
+def _add_accessor(gltf, builder, data, normalized, target, with_bounds=False):
+    components = data.shape[1]
+    view_index = builder.add_view(data, target)
+    accessor = {
+        "bufferView": view_index,
+        "componentType": _COMPONENT_TYPES[data.dtype],
+        "count": len(data),
+        "type": _SIZE_TYPES[components],
+    }
+    if normalized:
+        accessor["normalized"] = True
+    if with_bounds and len(data):
+        accessor["min"] = data.min(axis=0).tolist()
+        accessor["max"] = data.max(axis=0).tolist()
+
+    gltf["accessors"].append(accessor)
+    return len(gltf["accessors"]) - 1
+
+
+def _compact(gltf, bin_chunk, builder, new_accessors):
+    """Drop accessors and buffer views nothing references anymore, copying
+    the surviving original views into the rebuilt buffer.
+    """
+    referenced = set()
+    for mesh in gltf.get("meshes", []):
+        for primitive in mesh.get("primitives", []):
+            referenced.update(primitive["attributes"].values())
+            if "indices" in primitive:
+                referenced.add(primitive["indices"])
+            for target in primitive.get("targets", []):
+                referenced.update(target.values())
+    for skin in gltf.get("skins", []):
+        if "inverseBindMatrices" in skin:
+            referenced.add(skin["inverseBindMatrices"])
+    for animation in gltf.get("animations", []):
+        for sampler in animation.get("samplers", []):
+            referenced.update((sampler["input"], sampler["output"]))
+
+    view_mapping = {}
+    accessors = []
+    accessor_mapping = {}
+    for index, accessor in enumerate(gltf["accessors"]):
+        if index not in referenced:
+            continue
+        if index not in new_accessors and "bufferView" in accessor:
+            accessor["bufferView"] = _copy_view(gltf, bin_chunk, builder, view_mapping,
+                                                accessor["bufferView"])
+        accessor_mapping[index] = len(accessors)
+        accessors.append(accessor)
+
+    for image in gltf.get("images", []):
+        if "bufferView" in image:
+            image["bufferView"] = _copy_view(gltf, bin_chunk, builder, view_mapping, image["bufferView"])
+
+    for mesh in gltf.get("meshes", []):
+        for primitive in mesh.get("primitives", []):
+            primitive["attributes"] = {name: accessor_mapping[index]
+                                       for name, index in primitive["attributes"].items()}
+            if "indices" in primitive:
+                primitive["indices"] = accessor_mapping[primitive["indices"]]
+            primitive["targets"] = [{name: accessor_mapping[index] for name, index in target.items()}
+                                    for target in primitive.get("targets", [])] or None
+            if primitive["targets"] is None:
+                del primitive["targets"]
+    for skin in gltf.get("skins", []):
+        if "inverseBindMatrices" in skin:
+            skin["inverseBindMatrices"] = accessor_mapping[skin["inverseBindMatrices"]]
+    for animation in gltf.get("animations", []):
+        for sampler in animation.get("samplers", []):
+            sampler["input"] = accessor_mapping[sampler["input"]]
+            sampler["output"] = accessor_mapping[sampler["output"]]
+
+    gltf["accessors"] = accessors
+    gltf["bufferViews"] = builder.views
+    gltf["buffers"] = [{"byteLength": len(builder.data)}]
+    gltf["_bin"] = bytes(builder.data)
+
+
+def _copy_view(gltf, bin_chunk, builder, view_mapping, view_index):
+    if view_index not in view_mapping:
+        view = dict(gltf["bufferViews"][view_index])
+        start = view.get("byteOffset", 0)
+        view_mapping[view_index] = builder.add_raw(bin_chunk[start:start + view["byteLength"]], view)
+    return view_mapping[view_index]
+
+
+def _write_glb_atomic(glb_path, gltf):
+    bin_data = gltf.pop("_bin")
+    json_data = json.dumps(gltf, separators=(",", ":")).encode("utf-8")
+    json_data += b" " * (-len(json_data) % 4)
+    bin_data += b"\x00" * (-len(bin_data) % 4)
+
+    total_length = 12 + 8 + len(json_data) + (8 + len(bin_data) if bin_data else 0)
+
+    fd, temp_path = tempfile.mkstemp(suffix=".glb", dir=os.path.dirname(glb_path))
+    try:
+        with os.fdopen(fd, "wb") as glb_file:
+            glb_file.write(struct.pack("<III", _GLB_MAGIC, 2, total_length))
+            glb_file.write(struct.pack("<II", len(json_data), _JSON_CHUNK))
+            glb_file.write(json_data)
+            if bin_data:
+                glb_file.write(struct.pack("<II", len(bin_data), _BIN_CHUNK))
+                glb_file.write(bin_data)
+        os.replace(temp_path, glb_path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+
+class _BufferBuilder:
+    """Accumulates the rebuilt binary chunk, keeping every view 4-byte aligned."""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.views = []
+
+    def add_view(self, data, target):
+        # Vertex attribute elements must start on 4-byte boundaries.
+        row_bytes = data.dtype.itemsize * data.shape[1]
+        view = {"buffer": 0, "target": target}
+        if target == _ARRAY_BUFFER and row_bytes % 4:
+            padded_size = row_bytes + (-row_bytes % 4)
+            padded = np.zeros((len(data), padded_size), dtype=np.uint8)
+            padded[:, :row_bytes] = data.view(np.uint8).reshape(len(data), row_bytes)
+            view["byteStride"] = padded_size
+            raw = padded.tobytes()
+        else:
+            raw = np.ascontiguousarray(data).tobytes()
+        return self.add_raw(raw, view)
+
+    def add_raw(self, raw, view):
+        self.data += b"\x00" * (-len(self.data) % 4)
+        view = dict(view, buffer=0, byteOffset=len(self.data), byteLength=len(raw))
+        self.data += raw
+        self.views.append(view)
+        return len(self.views) - 1
@@ -18,34 +18,77 @@ def enable_hou_module():
 
 
 enable_hou_module()
+import time
+
 import hou
 
-import os
-import zipfile
-import threading
-import urllib.parse
+from flask import current_app, url_for
+
+from app import tasks, redis_client, constants as cnst
+from app.api import scene_cache, icon_index, metrics
+
+
+def scan_and_display_nodes(parent_node, hip_file=None, cursor=0, limit=None, lazy_cook=False,
+                           hip_key=None):
+    # Redis I/O yields to other greenlets, which may load a different .hip
+    # into this process. Finish it before loading, the scan must not yield.
+    cook_stats = redis_client.get_cook_stats(hip_key) if hip_key is not None else {}
+
+    load_seconds = ensure_hip_loaded(hip_file)
+
+    root_node = hou.node(parent_node)
+    node_dict = None
+    if root_node is not None:
+        node_dict = process_hip_for_node_structure(root_node, cursor=cursor, limit=limit,
+                                                   lazy_cook=lazy_cook, cook_stats=cook_stats)
+    observe_hip_load(load_seconds)
+    return node_dict
+
 
-from app import tasks, constants as cnst
-from app.api import socket_update
+def ensure_hip_loaded(hip_file):
+    """Load `hip_file` unless this process already has it open.
 
-_icon_mapping = {}
-_redis_thread = None
+    Each web worker holds its own hou session, so consult hou rather than
+    the user's session to decide whether a load is needed.
 
+    Recording the metric writes to redis, which yields to other greenlets
+    that may load another .hip. Callers pass the returned duration to
+    `observe_hip_load` once they are done reading the scene.
 
-def scan_and_display_nodes(parent_node, load=True, hip_file=None):
-    if load:
-        # Avoid cooking the file, only need to retrieve node graph.
-        hou.setUpdateMode(hou.updateMode.Manual)
+    :returns: Seconds spent loading, or None if no load was needed.
+    """
+    if hip_file is None or hou.hipFile.path() == hip_file:
+        return None
+
+    # Avoid cooking the file, only need to retrieve node graph.
+    hou.setUpdateMode(hou.updateMode.Manual)
+    start_time = time.perf_counter()
+    try:
         hou.hipFile.load(hip_file,
                          suppress_save_prompt=True,
                          ignore_load_warnings=True)
-    obj_dict = process_hip_for_node_structure(hou.node(parent_node))
-    return obj_dict
+    except Exception:
+        observe_hip_load(time.perf_counter() - start_time)
+        raise
+    return time.perf_counter() - start_time
+
 
+def observe_hip_load(load_seconds):
+    if load_seconds is not None:
+        metrics.HIP_LOAD_SECONDS.observe(load_seconds, process=metrics.get_process_type())
 
-def process_hip_for_node_structure(root_node):
+
+def process_hip_for_node_structure(root_node, cursor=0, limit=None, lazy_cook=False,
+                                   cook_stats=None):
+    """:param cook_stats: Profiled cook stats of the .hip by node path,
+        returned with each node (see cook_profiler), if given.
+    """
+    cook_stats = cook_stats or {}
     category_name = root_node.childTypeCategory().name()
     start, end = hou.playbar.playbackRange()
+
+    children = root_node.children()
+    page_end = len(children) if limit is None else min(cursor + limit, len(children))
     node_dict = {
         "elements": [],
         "start": start,
@@ -53,142 +96,160 @@ def process_hip_for_node_structure(root_node):
         "category": category_name,
         "parent_icons": {},
         "can_cook_all": _current_context_cookable(root_node),
+        "total": len(children),
+        "next_cursor": page_end if page_end < len(children) else None,
     }
 
-    icon_zip_path = hou.text.expandString(cnst.ICON_ZIP_PATH)
-    with zipfile.ZipFile(icon_zip_path) as zip_file:
-        contents = zip_file.namelist()
-
-        # Store the parent icon for use in the top context bar.
-        current_node = root_node
-        while current_node.parent():
-            locate_and_store_icon(contents,
-                                  current_node.name(),
-                                  current_node.type().icon(),
-                                  zip_file,
-                                  node_dict,
-                                  parent=True)
-            current_node = current_node.parent()
-
-        for default_context in cnst.DEFAULT_PARENT_CONTEXTS:
-            if default_context not in node_dict["parent_icons"]:
-                out_node = hou.node(default_context)
-                if out_node is not None:
-                    locate_and_store_icon(contents,
-                                          out_node.name(),
-                                          out_node.type().icon(),
-                                          zip_file,
-                                          node_dict,
-                                          parent=True)
-
-        for node in root_node.children():
-            node_info = {
-                "data": {
-                    "id": node.name(),
-                    "path": node.path(),
-                    "node_type": node.type().name(),
-                    "category": str(node.type().nameWithCategory()).lower(),
-                    "color": convert_rgb01_to_rgb255(node.color().rgb()),
-                    "cooktime": get_last_cooktime(node),
-                    "can_enter": can_enter_node(node),
-                    "can_cook": list(is_node_cookable(node, root_node.childTypeCategory()))
-                }
+    # Store the parent icon for use in the top context bar.
+    current_node = root_node
+    while current_node.parent():
+        locate_and_store_icon(current_node.name(),
+                              current_node.type().icon(),
+                              node_dict,
+                              parent=True)
+        current_node = current_node.parent()
+
+    for default_context in cnst.DEFAULT_PARENT_CONTEXTS:
+        if default_context not in node_dict["parent_icons"]:
+            out_node = hou.node(default_context)
+            if out_node is not None:
+                locate_and_store_icon(out_node.name(),
+                                      out_node.type().icon(),
+                                      node_dict,
+                                      parent=True)
+
+    for node in children[cursor:page_end]:
+        node_info = {
+            "data": {
+                "id": node.name(),
+                "path": node.path(),
+                "node_type": node.type().name(),
+                "category": str(node.type().nameWithCategory()).lower(),
+                "color": convert_rgb01_to_rgb255(node.color().rgb()),
+                "cooktime": get_last_cooktime(node, cook_stats),
+                "cook_stats": cook_stats.get(node.path()),
+                "can_enter": can_enter_node(node),
+                "can_cook": None
             }
+        }
+
+        if not lazy_cook:
+            node_info["data"]["can_cook"] = list(
+                is_node_cookable(node, root_node.childTypeCategory()))
 
-            # Sometimes this node_type folder convention doesn't hold.
-            # IconMapping file displays mapping for name -> file location.
-            # (e.g.) SOP_null := COMMON_null
-            node_icon = node.type().icon()
-            locate_and_store_icon(contents, "", node_icon, zip_file, node_info)
-
-            node_dict["elements"].append(node_info)
-            for output in node.outputs():
-                edge_info = {
-                    "data": {
-                        "id": "{0}-{1}".format(node.name(), output.name()),
-                        "source": node.name(),
-                        "target": output.name()
-                    }
+        locate_and_store_icon("", node.type().icon(), node_info)
+
+        node_dict["elements"].append(node_info)
+        for output in node.outputs():
+            edge_info = {
+                "data": {
+                    "id": "{0}-{1}".format(node.name(), output.name()),
+                    "source": node.name(),
+                    "target": output.name()
                 }
-                node_dict["elements"].append(edge_info)
+            }
+            node_dict["elements"].append(edge_info)
     return node_dict
 
 
-def locate_and_store_icon(contents,
-                          node_name,
-                          node_icon,
-                          zip_file,
-                          node_dict,
-                          parent=False):
-    global _icon_mapping
-
-    node_type_folder, svg_name = node_icon.split("_", 1)
-    icon_path = os.path.join(node_type_folder, svg_name + '.svg')
-
-    if icon_path not in contents:
-        if not _icon_mapping:
-            load_icon_mappings(zip_file)
-        mapped_name = _icon_mapping.get(node_icon)
-        if mapped_name:
-            node_type_folder, new_name = mapped_name.split("_", 1)
-            icon_path = os.path.join(node_type_folder, new_name + '.svg')
-        else:
-            # Some icons are missing from the SideFX provided icon mapping :(
-            # (e.g. measure 2.0 node indicates SOP_measure-2.0, but that doesn't exist.
-            # Attempt to strip node version number and check directly for base version.
-            if "-" in icon_path:
-                base_icon_name = icon_path.split("-")[0]
-                potential_paths = [name for name in contents if name.startswith(base_icon_name)]
-                if base_icon_name in potential_paths:
-                    icon_path = base_icon_name + ".svg"
-                elif potential_paths:
-                    icon_path = potential_paths[0]
-
-    if icon_path in contents:
-        with zip_file.open(icon_path) as icon:
-            icon_content = icon.read()
-            escaped_content = urllib.parse.quote(icon_content, safe="")
-            svg_xml = "data:image/svg+xml;utf8,{0}".format(escaped_content)
-            if not parent:
-                node_dict["data"]["icon"] = svg_xml
-            else:
-                node_dict["parent_icons"][node_name] = svg_xml
-
-
-def submit_node_for_render(render_struct):
-    global _redis_thread
-    if not _redis_thread:
-        _redis_thread = threading.Thread(
-            target=socket_update.listen_to_celery_workers)
-        _redis_thread.start()
+def locate_and_store_icon(node_name, node_icon, node_dict, parent=False):
+    icon_path = icon_index.get_icon_index().resolve(node_icon)
+    if icon_path is None:
+        return
+
+    icon_ref = get_icon_reference(icon_path)
+    if icon_ref is None:
+        return
+
+    if not parent:
+        node_dict["data"]["icon"] = icon_ref
+    else:
+        node_dict["parent_icons"][node_name] = icon_ref
+
+
+def get_icon_reference(icon_path):
+    """By default icons are referenced by URL so the browser caches each
+    one once, rather than inlining the SVG into every graph payload.
+    """
+    if current_app.config["INLINE_NODE_ICONS"]:
+        return icon_index.get_icon_index().data_uri(icon_path)
+    return url_for("main.get_node_icon", icon_path=icon_path)
 
+
+def get_icon_content(icon_path):
+    return icon_index.get_icon_index().read(icon_path)
+
+
+def submit_node_for_render(render_struct, user_key=None):
     hip_path = hou.hipFile.path()
 
     # Celery automatically serializes arguments via JSON.
     # Ensure we first convert the RenderStruct to dictionary.
 
     render_node = hou.node(render_struct.node_path)
-    if render_node.type().category() == hou.ropNodeTypeCategory() and \
-            render_node.type().name() != "gltf":
+    render_args = (render_struct._asdict(), hip_path)
+    user_key = user_key or render_struct.socket_id
+
+    if is_rop_render(render_node):
         # Execute the render ROP in a background process.
         if rop_can_generate_thumbnail(render_struct):
-            tasks.execute_render_rop.delay(render_struct._asdict(), hip_path, generate_thumbnail=True)
+            queue_render_task(tasks.execute_render_rop, cnst.CeleryQueues.batch, user_key,
+                              render_struct, render_args, {"generate_thumbnail": True})
         else:
-            tasks.execute_render_rop.delay(render_struct._asdict(), hip_path)
+            queue_render_task(tasks.execute_render_rop, cnst.CeleryQueues.batch, user_key,
+                              render_struct, render_args)
 
             # This ROP can't generate a thumbnail on its own. (Not a 2D image ROP)
             # Create a new thumbnail task to handle that for us.
-            tasks.run_thumbnail_task.delay(render_struct._asdict(), hip_path, generate_for_rop=True)
+            queue_render_task(tasks.run_thumbnail_task, cnst.CeleryQueues.interactive, user_key,
+                              render_struct, render_args, {"generate_for_rop": True})
     else:
-        # Run the .glb render background process.
-        tasks.run_render_task.delay(render_struct._asdict(), hip_path)
-
-        # Run the thumbnail background process.
-        tasks.run_thumbnail_task.delay(render_struct._asdict(), hip_path)
+        # Export the .glb and render its thumbnail from a single scene load.
+        queue_render_task(tasks.run_render_pipeline_task, cnst.CeleryQueues.interactive, user_key,
+                          render_struct, render_args)
 
     return True
 
 
+def queue_render_task(task, queue, user_key, render_struct, args, kwargs=None):
+    """Queue `task` on `queue` in fair-share order across users."""
+    redis_client.enqueue_fair_share_job(queue, user_key, {
+        "task": task.name,
+        "file_uuid": render_struct.file_uuid,
+        "args": args,
+        "kwargs": kwargs or {}
+    })
+
+    # Prefer the worker which already has this .hip resident. Batch jobs
+    # always go through their queue so they can't land on a worker
+    # reserved for interactive work.
+    routing_options = {"queue": queue}
+    dispatch_args = (queue,)
+    if queue == cnst.CeleryQueues.interactive and current_app.config["SCENE_AFFINITY_ROUTING"]:
+        affinity_options = scene_cache.task_routing_options(render_struct.file_uuid)
+        if affinity_options:
+            routing_options.update(affinity_options)
+            dispatch_args = (queue, user_key, render_struct.file_uuid)
+
+    tasks.dispatch_fair_share_job.apply_async(dispatch_args, **routing_options)
+
+
+def get_render_type(node_path):
+    render_node = hou.node(node_path)
+    if render_node is None:
+        return None
+
+    if is_rop_render(render_node):
+        return cnst.BackgroundRenderType.rop_render
+    return cnst.BackgroundRenderType.glb_file
+
+
+def is_rop_render(render_node):
+    """Non-glTF ROPs render their own outputs rather than a .glb preview."""
+    return render_node.type().category() == hou.ropNodeTypeCategory() and \
+        render_node.type().name() != "gltf"
+
+
 def rop_can_generate_thumbnail(render_struct):
     test_node = hou.node(render_struct.node_path)
     for parm_name in cnst.ROP_THUMBNAIL_REQUIRED_PARMS:
@@ -198,22 +259,6 @@ def rop_can_generate_thumbnail(render_struct):
     return False
 
 
-def load_icon_mappings(zip_file):
-    global _icon_mapping
-    with zip_file.open("IconMapping") as mapping:
-        for line in mapping:
-            decoded_line = line.decode('utf-8').rstrip('\n')
-            if not decoded_line:
-                continue
-            mapping_line = [
-                x.strip(" \t\n\r;") for x in decoded_line.split(":=")
-                if not x.startswith("#")
-            ]
-            if len(mapping_line) == 2:
-                from_name, to_name = mapping_line
-                _icon_mapping[from_name] = to_name
-
-
 def convert_rgb01_to_rgb255(color):
     r, g, b = color
     red = round(r * 255)
@@ -227,12 +272,23 @@ def can_enter_node(node):
     return len(node.children()) > 0
 
 
-def get_last_cooktime(node):
+def get_last_cooktime(node, cook_stats=None):
+    """Milliseconds the node spent cooking during its last profiled render."""
+    node_stats = (cook_stats or {}).get(node.path())
+    if node_stats is not None:
+        return node_stats["cook_ms"]
+
     cached_data = node.cachedUserDataDict()
     return cached_data.get("cook_time", None)
 
 
-def is_node_cookable(node, parent_category_name):
+def is_node_cookable(node, parent_category_name, validate_geometry=False):
+    """Determine whether `node` can be submitted for rendering.
+
+    By default only node types, flags and the presence of a render node
+    are inspected so browsing the graph never cooks geometry. Pass
+    `validate_geometry` to also cook the render node and check its output.
+    """
     if parent_category_name == hou.sopNodeTypeCategory():
         # Possible that no valid render geometry is found
         # but let the users render anyway.
@@ -249,21 +305,25 @@ def is_node_cookable(node, parent_category_name):
             error_msg = "Unable to render manager node type {0}.".format(node_type_name.capitalize())
             return False, error_msg
 
+        error_msg = "{0} is an uncookable node type.".format(node_type_name.capitalize())
+        for uncookable_type in cnst.UNCOOKABLE_NODE_TYPES:
+            if uncookable_type in node_type_name:
+                return False, error_msg
+
         render_node = node.renderNode()
         if render_node is None:
             error_msg = "{0} does not contain a valid render node.".format(node.name())
             return False, error_msg
 
-        if render_node.geometry() is None:
+        if render_node.isBypassed():
+            error_msg = "{0} has a bypassed render node.".format(node.name())
+            return False, error_msg
+
+        if validate_geometry and render_node.geometry() is None:
             error_msg = ("{0} does not contain a render node "
                          "with valid geometry.").format(node.name())
             return False, error_msg
 
-        error_msg = "{0} is an uncookable node type.".format(node_type_name.capitalize())
-        for uncookable_type in cnst.UNCOOKABLE_NODE_TYPES:
-            if uncookable_type in node_type_name:
-                return False, error_msg
-
         return True, ''
 
     # Only OBJ, SOP, and ROP's are supported at the moment.
@@ -271,6 +331,31 @@ def is_node_cookable(node, parent_category_name):
     return False, error_msg
 
 
+def evaluate_node_cookable(node_path, hip_file, file_uuid):
+    """Fully validate a single node, cooking its render geometry.
+
+    Results are cached against the .hip contents so each node is only
+    cooked once per unique file.
+    """
+    hip_key = redis_client.get_file_hash_from_uuid(file_uuid) or file_uuid
+    cached_result = redis_client.get_cached_cookability(hip_key, node_path)
+    if cached_result is not None:
+        return cached_result
+
+    load_seconds = ensure_hip_loaded(hip_file)
+
+    node = hou.node(node_path)
+    if node is None or node.parent() is None:
+        observe_hip_load(load_seconds)
+        return None
+
+    can_cook = is_node_cookable(node, node.parent().childTypeCategory(),
+                                validate_geometry=True)
+    observe_hip_load(load_seconds)
+    redis_client.store_cookability(hip_key, node_path, can_cook)
+    return can_cook
+
+
 def _current_context_cookable(context_node):
     """Resolves if the node is a viable target for the 'Render Context' button.
     """
@@ -0,0 +1,123 @@
+import os
+import bisect
+import zipfile
+import threading
+import urllib.parse
+
+import hou
+
+from app import constants as cnst
+
+
+class IconIndex:
+    """Process-wide index of the SideFX icons.zip.
+
+    The archive listing and IconMapping are read once, icon lookups resolve
+    through a set and a sorted name list (for versioned node fallbacks), and
+    resolved paths, SVG bytes and data URIs are memoized per icon.
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = cls(hou.text.expandString(cnst.ICON_ZIP_PATH))
+        return cls._instance
+
+    def __init__(self, zip_path):
+        self._zip_path = zip_path
+        with zipfile.ZipFile(zip_path) as zip_file:
+            names = zip_file.namelist()
+            self._icon_mapping = _read_icon_mappings(zip_file)
+
+        self._names = set(names)
+        self._sorted_names = sorted(names)
+
+        self._resolved_paths = {}
+        self._contents = {}
+        self._data_uris = {}
+
+    def resolve(self, node_icon):
+        """Map a node type icon name (e.g. SOP_null) to its path in the zip."""
+        if node_icon not in self._resolved_paths:
+            self._resolved_paths[node_icon] = self._resolve(node_icon)
+        return self._resolved_paths[node_icon]
+
+    def read(self, icon_path):
+        if icon_path not in self._names:
+            return None
+
+        if icon_path not in self._contents:
+            with zipfile.ZipFile(self._zip_path) as zip_file:
+                with zip_file.open(icon_path) as icon:
+                    self._contents[icon_path] = icon.read()
+        return self._contents[icon_path]
+
+    def data_uri(self, icon_path):
+        if icon_path not in self._data_uris:
+            icon_content = self.read(icon_path)
+            if icon_content is None:
+                return None
+            escaped_content = urllib.parse.quote(icon_content, safe="")
+            self._data_uris[icon_path] = "data:image/svg+xml;utf8,{0}".format(escaped_content)
+        return self._data_uris[icon_path]
+
+    def _resolve(self, node_icon):
+        if "_" not in node_icon:
+            return None
+
+        node_type_folder, svg_name = node_icon.split("_", 1)
+        icon_path = os.path.join(node_type_folder, svg_name + '.svg')
+        if icon_path in self._names:
+            return icon_path
+
+        # Sometimes this node_type folder convention doesn't hold.
+        # IconMapping file displays mapping for name -> file location.
+        # (e.g.) SOP_null := COMMON_null
+        mapped_name = self._icon_mapping.get(node_icon)
+        if mapped_name:
+            node_type_folder, new_name = mapped_name.split("_", 1)
+            icon_path = os.path.join(node_type_folder, new_name + '.svg')
+            return icon_path if icon_path in self._names else None
+
+        # Some icons are missing from the SideFX provided icon mapping :(
+        # (e.g. measure 2.0 node indicates SOP_measure-2.0, but that doesn't exist.
+        # Attempt to strip node version number and check directly for base version.
+        if "-" in icon_path:
+            base_icon_name = icon_path.split("-")[0]
+            if base_icon_name + ".svg" in self._names:
+                return base_icon_name + ".svg"
+            return self._first_with_prefix(base_icon_name)
+
+        return None
+
+    def _first_with_prefix(self, prefix):
+        index = bisect.bisect_left(self._sorted_names, prefix)
+        if index < len(self._sorted_names) and self._sorted_names[index].startswith(prefix):
+            return self._sorted_names[index]
+        return None
+
+
+def get_icon_index():
+    return IconIndex.get_instance()
+
+
+def _read_icon_mappings(zip_file):
+    icon_mapping = {}
+    with zip_file.open("IconMapping") as mapping:
+        for line in mapping:
+            decoded_line = line.decode('utf-8').rstrip('\n')
+            if not decoded_line:
+                continue
+            mapping_line = [
+                x.strip(" \t\n\r;") for x in decoded_line.split(":=")
+                if not x.startswith("#")
+            ]
+            if len(mapping_line) == 2:
+                from_name, to_name = mapping_line
+                icon_mapping[from_name] = to_name
+    return icon_mapping
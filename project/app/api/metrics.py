@@ -0,0 +1,198 @@
+import os
+import time
+import bisect
+import logging
+import contextlib
+
+import redis
+
+from app import redis_client, constants as cnst
+
+_HISTOGRAMS = {}
+_COUNTERS = {}
+
+
+class Histogram:
+    """Latency histogram aggregated across processes through redis.
+
+    Each observation lands in one bucket, buckets are only made cumulative
+    when exposed, so recording costs a single pipelined round-trip.
+    """
+
+    def __init__(self, name, documentation, label_names=(), buckets=cnst.METRICS_LATENCY_BUCKETS):
+        self.name = "{0}_{1}".format(cnst.METRICS_NAMESPACE, name)
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        _HISTOGRAMS[self.name] = self
+
+    def observe(self, value, **labels):
+        index = bisect.bisect_left(self.buckets, value)
+        bucket = _format_bound(self.buckets[index]) if index < len(self.buckets) else "+Inf"
+        _record(redis_client.observe_histogram, self.name,
+                _format_labels(self.label_names, labels), bucket, value)
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observe the duration of the block, including when it raises."""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, **labels)
+
+    def expose(self, samples):
+        series = {}
+        for field, value in samples.items():
+            labels, _, suffix = field.rpartition("|")
+            series.setdefault(labels, {})[suffix] = value
+
+        lines = _header(self.name, self.documentation, "histogram")
+        for labels, values in sorted(series.items()):
+            cumulative = 0
+            for bound in [_format_bound(bound) for bound in self.buckets] + ["+Inf"]:
+                cumulative += int(values.get(bound, 0))
+                lines.append("{0}_bucket{1} {2}".format(
+                    self.name, _join_labels(labels, 'le="{0}"'.format(bound)), cumulative))
+            lines.append("{0}_sum{1} {2}".format(self.name, _join_labels(labels),
+                                                 values.get("sum", 0)))
+            lines.append("{0}_count{1} {2}".format(self.name, _join_labels(labels),
+                                                   values.get("count", 0)))
+        return lines
+
+
+class Counter:
+    def __init__(self, name, documentation, label_names=()):
+        self.name = "{0}_{1}".format(cnst.METRICS_NAMESPACE, name)
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        _COUNTERS[self.name] = self
+
+    def inc(self, amount=1, **labels):
+        _record(redis_client.increment_counter, self.name,
+                _format_labels(self.label_names, labels), amount)
+
+    def expose(self, samples):
+        lines = _header(self.name, self.documentation, "counter")
+        for labels, value in sorted(samples.items()):
+            lines.append("{0}{1} {2}".format(self.name, _join_labels(labels), value))
+        return lines
+
+
+HIP_LOAD_SECONDS = Histogram(
+    "hip_load_seconds", "Time spent in hou.hipFile.load.", ["process"])
+EXPORT_SECONDS = Histogram(
+    "export_seconds", "Time spent cooking and writing ROP outputs in out_node.render.",
+    ["render_type", "category"])
+KARMA_SECONDS = Histogram(
+    "karma_seconds", "Time spent rendering thumbnails with Karma.", ["category"])
+NOTIFY_SECONDS = Histogram(
+    "notify_seconds", "Time spent recording and emitting render completions.", ["render_type"])
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_seconds", "Flask request latency.", ["endpoint", "method", "status"])
+RENDERS_TOTAL = Counter(
+    "renders_total", "Renders finished by the Celery workers.",
+    ["render_type", "category", "status"])
+PROGRESS_UPDATES_TOTAL = Counter(
+    "progress_updates_total", "Render progress updates parsed from ROP output, by whether they "
+    "were published, coalesced into a later update or dropped.", ["outcome"])
+STORAGE_GC_BYTES_TOTAL = Counter(
+    "storage_gc_bytes_total", "Bytes of uploads and renders deleted by the storage collector.",
+    ["reason"])
+
+
+def get_process_type():
+    return os.getenv("REDIS_PROCESS_TYPE", "web")
+
+
+def get_category_label(node):
+    return node.type().category().name().lower()
+
+
+def init_app(app):
+    """Time every Flask request, labelled by endpoint rather than URL to
+    keep the number of series bounded.
+    """
+    from flask import g, request
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start_time = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        start_time = g.pop("request_start_time", None)
+        if start_time is not None:
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start_time,
+                                         endpoint=request.endpoint or "unmatched",
+                                         method=request.method,
+                                         status=response.status_code)
+        return response
+
+
+def generate_latest():
+    """Render every metric in the Prometheus text exposition format."""
+    histogram_samples, counter_samples = redis_client.get_metric_samples(
+        list(_HISTOGRAMS), list(_COUNTERS))
+
+    lines = []
+    for name, histogram in _HISTOGRAMS.items():
+        lines.extend(histogram.expose(histogram_samples[name]))
+    for name, counter in _COUNTERS.items():
+        lines.extend(counter.expose(counter_samples[name]))
+
+    # Gauges are read off the live state rather than recorded.
+    queues = [cnst.CeleryQueues.interactive, cnst.CeleryQueues.batch]
+    queue_depths = redis_client.get_queue_depths(queues)
+    pending_name = "{0}_queue_pending_jobs".format(cnst.METRICS_NAMESPACE)
+    lines.extend(_header(pending_name, "Render jobs waiting for a worker.", "gauge"))
+    for queue, (pending_jobs, _) in queue_depths.items():
+        lines.append('{0}{{queue="{1}"}} {2}'.format(pending_name, queue, pending_jobs))
+
+    broker_name = "{0}_queue_broker_messages".format(cnst.METRICS_NAMESPACE)
+    lines.extend(_header(broker_name, "Messages waiting in the Celery broker.", "gauge"))
+    for queue, (_, broker_messages) in queue_depths.items():
+        lines.append('{0}{{queue="{1}"}} {2}'.format(broker_name, queue, broker_messages))
+
+    scene_cache_name = "{0}_scene_cache_total".format(cnst.METRICS_NAMESPACE)
+    lines.extend(_header(scene_cache_name, "Resident scene reuses and reloads.", "counter"))
+    for result, count in sorted(redis_client.get_scene_cache_metrics().items()):
+        lines.append('{0}{{result="{1}"}} {2}'.format(scene_cache_name, result, count))
+
+    storage_name = "{0}_storage_bytes".format(cnst.METRICS_NAMESPACE)
+    lines.extend(_header(storage_name, "Bytes stored as of the last storage sweep of each bucket.",
+                         "gauge"))
+    lines.append("{0} {1}".format(storage_name, redis_client.get_storage_bytes()))
+
+    return "\n".join(lines) + "\n"
+
+
+def _record(record_func, *args):
+    # Metrics are best effort, a redis hiccup must never fail a render.
+    try:
+        record_func(*args)
+    except redis.RedisError as exc:
+        logging.warning("Unable to record metric {0}: {1}".format(args[0], exc))
+
+
+def _header(name, documentation, metric_type):
+    return ["# HELP {0} {1}".format(name, documentation),
+            "# TYPE {0} {1}".format(name, metric_type)]
+
+
+def _format_labels(label_names, labels):
+    return ",".join('{0}="{1}"'.format(name, _escape_label(labels.get(name, "")))
+                    for name in label_names)
+
+
+def _join_labels(*label_strings):
+    labels = ",".join(label_string for label_string in label_strings if label_string)
+    return "{{{0}}}".format(labels) if labels else ""
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_bound(bound):
+    return "{0:g}".format(bound)
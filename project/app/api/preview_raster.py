@@ -0,0 +1,123 @@
+import zlib
+import struct
+
+import numpy as np
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Splatted points are drawn at 1/_SPLAT_SIZE resolution and upscaled, which
+# both fills the gaps between sparse points and keeps the z-buffer small.
+_SPLAT_SIZE = 2
+
+_BACKGROUND = (51, 51, 76, 255)
+_BASE_COLOR = (0.8, 0.8, 0.8)
+
+
+def rasterize_points(points, world_to_camera, focal, aperture, resolution,
+                     colors=None, max_points=2000000):
+    """Depth-shaded point splat of `points` seen through a perspective camera.
+
+    Follows Houdini's camera conventions: row vectors, the camera looking
+    down its -Z axis and `aperture` being the horizontal film width in the
+    same units as `focal`.
+
+    :param points: (N, 3) world space positions.
+    :param world_to_camera: (4, 4) row-vector matrix, i.e. the inverted
+        camera world transform.
+    :param resolution: (width, height) of the image in pixels.
+    :param colors: Optional (N, 3) colors in [0, 1].
+    :returns: (height, width, 4) uint8 RGBA image.
+    """
+    res_x, res_y = resolution
+    image = np.empty((res_y, res_x, 4), dtype=np.uint8)
+    image[...] = _BACKGROUND
+
+    points = np.asarray(points, dtype=np.float32).reshape(-1, 3)
+    if colors is not None:
+        colors = np.asarray(colors, dtype=np.float32).reshape(-1, 3)
+
+    if len(points) > max_points:
+        # A preview gains nothing from every point, a strided subset suffices.
+        stride = int(np.ceil(len(points) / max_points))
+        points = points[::stride]
+        if colors is not None:
+            colors = colors[::stride]
+
+    if not len(points):
+        return image
+
+    matrix = np.asarray(world_to_camera, dtype=np.float32).reshape(4, 4)
+    camera_points = points @ matrix[:3, :3] + matrix[3, :3]
+
+    depth = -camera_points[:, 2]
+    in_front = depth > 1e-6
+    camera_points = camera_points[in_front]
+    depth = depth[in_front]
+    if colors is not None:
+        colors = colors[in_front]
+
+    splat_x = max(res_x // _SPLAT_SIZE, 1)
+    splat_y = max(res_y // _SPLAT_SIZE, 1)
+    aperture_y = aperture * res_y / res_x
+
+    ndc_x = camera_points[:, 0] * focal / (depth * aperture / 2.0)
+    ndc_y = camera_points[:, 1] * focal / (depth * aperture_y / 2.0)
+    pixel_x = ((ndc_x + 1.0) * 0.5 * splat_x).astype(np.int64)
+    pixel_y = ((1.0 - ndc_y) * 0.5 * splat_y).astype(np.int64)
+
+    on_screen = (pixel_x >= 0) & (pixel_x < splat_x) & (pixel_y >= 0) & (pixel_y < splat_y)
+    if not on_screen.any():
+        return image
+
+    pixel_index = pixel_y[on_screen] * splat_x + pixel_x[on_screen]
+    depth = depth[on_screen]
+    colors = colors[on_screen] if colors is not None else None
+
+    # Z-buffer: keep the nearest point landing on each pixel.
+    z_buffer = np.full(splat_x * splat_y, np.inf, dtype=np.float32)
+    np.minimum.at(z_buffer, pixel_index, depth)
+    nearest = depth <= z_buffer[pixel_index]
+    pixel_index = pixel_index[nearest]
+    depth = depth[nearest]
+
+    # Nearer surfaces are brighter, standing in for proper lighting.
+    near, far = depth.min(), depth.max()
+    shade = 1.0 - 0.6 * (depth - near) / max(far - near, 1e-6)
+    base = colors[nearest] if colors is not None else np.array(_BASE_COLOR, dtype=np.float32)
+    rgb = np.clip(base * shade[:, None] * 255.0, 0, 255).astype(np.uint8)
+
+    splat = np.empty((splat_x * splat_y, 4), dtype=np.uint8)
+    splat[:] = _BACKGROUND
+    splat[pixel_index, :3] = rgb
+    splat = splat.reshape(splat_y, splat_x, 4)
+
+    upscaled = splat.repeat(_SPLAT_SIZE, axis=0).repeat(_SPLAT_SIZE, axis=1)
+    image[:upscaled.shape[0], :upscaled.shape[1]] = upscaled[:res_y, :res_x]
+    return image
+
+
+def encode_png(image):
+    """Encode an (height, width, 4) uint8 RGBA image as PNG bytes."""
+    height, width = image.shape[:2]
+
+    # Every scanline is prefixed by its filter type, 0 (None).
+    scanlines = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    scanlines[:, 1:] = image.reshape(height, width * 4)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+    return b"".join((
+        _PNG_SIGNATURE,
+        _png_chunk(b"IHDR", header),
+        _png_chunk(b"IDAT", zlib.compress(scanlines.tobytes(), 1)),
+        _png_chunk(b"IEND", b""),
+    ))
+
+
+def write_png(image, png_path):
+    with open(png_path, "wb") as png_file:
+        png_file.write(encode_png(image))
+
+
+def _png_chunk(chunk_type, data):
+    crc = zlib.crc32(chunk_type + data) & 0xFFFFFFFF
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", crc)
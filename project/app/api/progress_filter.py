@@ -1,33 +1,47 @@
 import os
 import re
 import sys
-import json
 import time
+import select
 import logging
 import threading
 
 from app import constants as cnst
+from app.api import metrics, render_events
 
 
 class ProgressFilter:
-    """Redirects the ALF_PROGRESS updates to a redis client to update the 
-    front end's render progress.
+    """Redirects the ALF_PROGRESS updates to the submitting socket to update
+    the front end's render progress.
 
     sys.stdout is overriden inside Houdini and requires sys.__stdout__.
 
-    C shared library output is redirected from stdout fd to our pipe_in, 
-    filtered, and then sent to redis for updating.
+    C shared library output is redirected from stdout fd to our pipe_in,
+    filtered, and then emitted through `emit_progress`, one of the
+    `render_events` progress emitters.
+
+    The pipe is read in large chunks and progress updates are coalesced so
+    at most `max_rate` updates per second are published. Only the latest
+    progress is kept while waiting, superseded updates are counted in
+    `coalesced_count` and failed publishes in `dropped_count`. The counts
+    are added to the `progress_updates_total` metric once the filter stops.
+
+    `progress_transform` maps the parsed percentage before publishing, e.g.
+    to report a shard's progress towards its whole sequence.
     """
 
-    _escape_char = "\b"
+    _escape_char = b"\b"
+    _read_size = 65536
 
-    def __init__(self, redis_client, socket_id, node_path, stream=None, channel=cnst.PublishChannels.thumb_progress):
+    def __init__(self, socket_id, node_path, stream=None,
+                 emit_progress=render_events.emit_thumb_progress,
+                 max_rate=cnst.PROGRESS_PUBLISH_RATE, progress_transform=None):
         self._orig_stream = stream
-        self._redis_client = redis_client
         self._socket_id = socket_id
         self._node_path = node_path
-        self._channel = channel
-        self._regex = re.compile(r'ALF_PROGRESS (\d+)%')
+        self._emit_progress = emit_progress
+        self._progress_transform = progress_transform
+        self._regex = re.compile(rb'ALF_PROGRESS (\d+)%')
         if not self._orig_stream:
             self._orig_stream = sys.__stdout__
 
@@ -38,6 +52,14 @@ class ProgressFilter:
         self._worker_thread = None
         self.debug_mode = False
 
+        self._publish_interval = 1.0 / max_rate if max_rate else 0.0
+        self._last_publish_time = 0.0
+        self._pending_match = None
+
+        self.published_count = 0
+        self.coalesced_count = 0
+        self.dropped_count = 0
+
     def __enter__(self):
         self.start()
         return self
@@ -60,7 +82,7 @@ class ProgressFilter:
         time.sleep(0.01)
 
     def stop(self):
-        self._orig_stream.write(self._escape_char)
+        self._orig_stream.write(self._escape_char.decode())
         self._orig_stream.flush()
         self._worker_thread.join()
         os.close(self.pipe_in)
@@ -68,51 +90,108 @@ class ProgressFilter:
         os.dup2(self._stream_fd, self._orig_stream_fd)
         os.close(self._stream_fd)
 
-    def read_line(self, pipe):
-        char = ""
-        line = ""
-        while char != self._escape_char and char != "\n":
-            char = os.read(pipe, 1).decode(self._orig_stream.encoding)
-            line += char
-        return line
-
-    def filter_output(self):
+        logging.info("Progress for {0}: {1} published, {2} coalesced, {3} dropped.".format(
+            self._node_path, self.published_count, self.coalesced_count, self.dropped_count))
+        for outcome, count in self.stats().items():
+            if count:
+                metrics.PROGRESS_UPDATES_TOTAL.inc(count, outcome=outcome)
+
+    def stats(self):
+        return {
+            "published": self.published_count,
+            "coalesced": self.coalesced_count,
+            "dropped": self.dropped_count,
+        }
+
+    def read_lines(self, pipe):
+        """Yield complete lines from the pipe, reading it in large chunks.
+
+        Stops once the escape character written by `stop` is encountered.
+        """
+        buffer = b""
         while True:
-            line = self.read_line(self.pipe_out)
-            if not line or self._escape_char in line:
-                break
+            ready, _, _ = select.select([pipe], [], [], self._time_until_flush())
+            if not ready:
+                # Nothing new arrived, publish any progress held back by the rate limit.
+                self.flush_pending()
+                continue
+
+            chunk = os.read(pipe, self._read_size)
+            if not chunk:
+                if buffer:
+                    yield buffer
+                return
+
+            buffer += chunk
+            escape_index = buffer.find(self._escape_char)
+            if escape_index != -1:
+                buffer = buffer[:escape_index]
+
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                yield line + b"\n"
+
+            if escape_index != -1:
+                if buffer:
+                    yield buffer
+                return
 
+    def filter_output(self):
+        for line in self.read_lines(self.pipe_out):
             match_obj = self._regex.search(line)
             if match_obj is not None:
-                if self._redis_client and not self.debug_mode:
-                    self.update_redis_client(match_obj)
+                if self._emit_progress and not self.debug_mode:
+                    self.queue_update(match_obj)
                 else:
                     os.write(self._stream_fd, convert_message(match_obj))
             else:
-                os.write(self._stream_fd, line.encode("utf-8"))
+                os.write(self._stream_fd, line)
 
-    def update_redis_client(self, match_obj):
+        # Always deliver the final progress value.
+        self.flush_pending()
+
+    def queue_update(self, match_obj):
+        if self._pending_match is not None:
+            self.coalesced_count += 1
+        self._pending_match = match_obj
+
+        if time.monotonic() - self._last_publish_time >= self._publish_interval:
+            self.flush_pending()
+
+    def flush_pending(self):
+        if self._pending_match is None:
+            return
+
+        match_obj, self._pending_match = self._pending_match, None
+        self._last_publish_time = time.monotonic()
+        if self.publish_update(match_obj):
+            self.published_count += 1
+        else:
+            self.dropped_count += 1
+
+    def publish_update(self, match_obj):
         try:
-            progress = match_obj.group(1)
+            progress = match_obj.group(1).decode("utf-8")
             if not progress.isdigit():
                 raise ValueError("Invalid progress data")
 
-            json_data = {
-                "progress": match_obj.group(1),
-                "socket_id": self._socket_id,
-                "nodePath": self._node_path
-            }
-
-            # Conform the json data to match the desired fields.
-            if self._channel != cnst.PublishChannels.thumb_progress:
-                json_data["render_node_path"] = self._node_path
+            if self._progress_transform is not None:
+                progress = str(round(self._progress_transform(int(progress)), 2))
 
-            self._redis_client.publish(self._channel, json.dumps(json_data))
+            self._emit_progress(self._node_path, progress, self._socket_id)
+            return True
         except Exception as e:
-            logging.error("Error in update_redis_client: {0}".format(e))
+            logging.error("Error in publish_update: {0}".format(e))
+            return False
+
+    def _time_until_flush(self):
+        if self._pending_match is None:
+            return None
+        elapsed = time.monotonic() - self._last_publish_time
+        return max(self._publish_interval - elapsed, 0.0)
 
 
 def convert_message(match_obj):
-    new_string = match_obj.group(1)
+    new_string = match_obj.group(1).decode("utf-8")
     update_string = "Update {0}".format(new_string)
     return update_string.encode("utf-8")
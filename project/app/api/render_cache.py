@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import hashlib
+import logging
+
+from app import constants as cnst
+from app.redis_client import RedisClient, with_redis_conn, decode_redis_hash, is_backfill_finished
+
+_CACHED_RENDER_TYPES = {
+    cnst.BackgroundRenderType.glb_file: cnst.USER_MODEL_DIR,
+    cnst.BackgroundRenderType.thumbnail: cnst.USER_THUMB_DIR,
+}
+
+
+def build_cache_key(hip_hash, node_path, start, end, step, export_settings, render_type):
+    """Content address of a render: identical inputs against identical
+    .hip contents always produce the same key, regardless of user or upload.
+    """
+    key_data = [hip_hash, node_path, start, end, step,
+                sorted((export_settings or {}).items()), render_type]
+    serialized = json.dumps(key_data, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+@with_redis_conn
+def lookup(redis_conn, cache_key):
+    """Return the cached filenames keyed by render type if every output
+    of the render is still on disk, otherwise None.
+    """
+    entry = decode_redis_hash(redis_conn.hgetall(f"render_cache:entry:{cache_key}"))
+    cached_files = {}
+    for render_type, directory in _CACHED_RENDER_TYPES.items():
+        filename = entry.get(render_type)
+        if filename is None:
+            return None
+
+        if not os.path.exists(os.path.join(directory, filename)):
+            # Output was removed behind our back, the entry can't be served.
+            _drop_entry(cache_key)
+            return None
+        cached_files[render_type] = filename
+
+    redis_conn.zadd("render_cache:lru", {cache_key: time.time()})
+    return cached_files
+
+
+@with_redis_conn
+def register_pending(redis_conn, render_id, cache_key):
+    # Expires on its own if the render fails and never completes.
+    redis_conn.set(f"render_cache:pending:{render_id}", cache_key, ex=cnst.RENDER_CACHE_PENDING_TTL)
+
+
+@with_redis_conn
+def store_result(redis_conn, render_type, filename):
+    """Attach a finished output to the cache entry of the render that
+    produced it, then evict entries above the configured byte budget.
+    """
+    directory = _CACHED_RENDER_TYPES.get(render_type)
+    if directory is None:
+        return
+
+    render_id = os.path.splitext(filename)[0]
+    cache_key = redis_conn.get(f"render_cache:pending:{render_id}")
+    if cache_key is None:
+        return
+    cache_key = cache_key.decode("utf-8")
+
+    try:
+        file_size = os.path.getsize(os.path.join(directory, filename))
+    except OSError:
+        logging.error("Unable to cache missing render output: {0}".format(filename))
+        return
+
+    entry_key = f"render_cache:entry:{cache_key}"
+    previous_size = redis_conn.hget(entry_key, f"{render_type}_size")
+
+    pipe = redis_conn.pipeline()
+    pipe.hset(entry_key, mapping={render_type: filename, f"{render_type}_size": file_size})
+    # Keeps the storage collector off files the cache can still serve.
+    pipe.hset("render_cache:files", filename, cache_key)
+    pipe.incrby("render_cache:total_bytes", file_size - int(previous_size or 0))
+    pipe.zadd("render_cache:lru", {cache_key: time.time()})
+
+    # Once every output type has arrived, the pending marker is no longer needed.
+    pending_types = set(_CACHED_RENDER_TYPES) - {render_type}
+    if all(redis_conn.hexists(entry_key, t) for t in pending_types):
+        pipe.delete(f"render_cache:pending:{render_id}")
+    pipe.execute()
+
+    evict(cnst.RENDER_CACHE_MAX_BYTES)
+
+
+@with_redis_conn
+def evict(redis_conn, max_bytes):
+    """Delete least recently used renders until the cache fits `max_bytes`.
+
+    Outputs a .hip still references (see `file_render_data`) are only
+    dropped from the cache, the storage collector deletes them once the .hip
+    lets go of them.
+    """
+    if not is_backfill_finished("render_refs"):
+        # Older renders aren't referenced yet, any of them could still be in use.
+        logging.info("Render references are still being backfilled, deferring eviction.")
+        return
+
+    while int(redis_conn.get("render_cache:total_bytes") or 0) > max_bytes:
+        # Popping claims the entry, concurrent evictions never pick the same one.
+        oldest = redis_conn.zpopmin("render_cache:lru")
+        if not oldest:
+            break
+
+        cache_key = oldest[0][0].decode("utf-8")
+        entry = decode_redis_hash(redis_conn.hgetall(f"render_cache:entry:{cache_key}"))
+        for render_type, directory in _CACHED_RENDER_TYPES.items():
+            filename = entry.get(render_type)
+            if filename is None or _is_referenced(redis_conn, filename):
+                continue
+            try:
+                os.remove(os.path.join(directory, filename))
+            except OSError:
+                pass
+        logging.info("Evicted cached render: {0}".format(cache_key))
+        _drop_entry(cache_key)
+
+
+def _is_referenced(redis_conn, filename):
+    # Kept alongside `file_render_data` by `store_render_data`.
+    return redis_conn.exists(f"render_refs:{filename}")
+
+
+def _drop_entry(cache_key):
+    """:returns: Whether this call dropped the entry, False if it was
+        already gone.
+    """
+    drop_script = RedisClient.get_script("drop_render_cache_entry")
+    return bool(drop_script(keys=[f"render_cache:entry:{cache_key}", "render_cache:files",
+                                  "render_cache:lru", "render_cache:total_bytes"],
+                            args=[cache_key, *_CACHED_RENDER_TYPES]))
@@ -0,0 +1,118 @@
+import os
+import logging
+
+from app import redis_client, constants as cnst
+from app.api import render_cache
+
+
+def emit(event, data, socket_id, history_file_uuid=None, user_uuid=None):
+    """Publish `event` to the render event stream, from which the web tier's
+    relays deliver it to `socket_id` (see event_relay).
+
+    Events given a `history_file_uuid` and the submitting `user_uuid` are
+    also kept in that user's history of the .hip, so a client that missed
+    them while disconnected can replay them.
+    """
+    if history_file_uuid is None or user_uuid is None:
+        history_file_uuid = None
+        if socket_id is None:
+            logging.error("No socket to emit {0} to.".format(event))
+            return
+
+    if history_file_uuid is not None:
+        # Lets the client track its replay position per .hip.
+        data = dict(data, eventFile=history_file_uuid)
+    return redis_client.publish_render_event(event, data, socket_id, user_uuid, history_file_uuid)
+
+
+def emit_render_progress(node_path, progress, socket_id):
+    emit(cnst.PublishChannels.node_render_update, {
+        'nodePath': node_path,
+        'progress': progress
+    }, socket_id)
+
+
+def emit_thumb_progress(node_path, progress, socket_id):
+    emit(cnst.PublishChannels.node_thumb_update, {
+        'nodePath': node_path,
+        'progress': float(progress)
+    }, socket_id)
+
+
+def emit_rop_failure(render_id, node_path, socket_id, trace_id=None,
+                     hip_file_uuid=None, user_uuid=None):
+    """Notify the socket that submitted a ROP render that the sequence
+    won't complete, so the client stops waiting on it.
+    """
+    rop_failure_dict = {
+        'hipFile': hip_file_uuid,
+        'fileName': render_id,
+        'nodePath': node_path
+    }
+    if trace_id is not None:
+        rop_failure_dict["traceId"] = trace_id
+
+    emit(cnst.PublishChannels.render_rop_failed, rop_failure_dict, socket_id,
+         history_file_uuid=hip_file_uuid, user_uuid=user_uuid)
+
+
+def emit_render_completion(file_uuid, render_path, render_type, node_path,
+                           frames, socket_id, rop_uuid=None, lod=None, trace_id=None,
+                           hip_file_uuid=None, user_uuid=None):
+    """Record a finished render and notify the socket that submitted it.
+
+    :param hip_file_uuid: The .hip whose event history records the completion,
+        for ROP renders whose `file_uuid` is their render ID.
+    :param user_uuid: The submitting user, whose history records the completion.
+    """
+    if render_type == cnst.BackgroundRenderType.glb_file:
+        channel = cnst.PublishChannels.node_render_finished
+    elif render_type == cnst.BackgroundRenderType.thumbnail:
+        channel = cnst.PublishChannels.node_thumb_finished
+    elif render_type == cnst.BackgroundRenderType.rop_render:
+        channel = cnst.PublishChannels.render_rop_finished
+    else:
+        logging.error("Unknown render type: {0}".format(render_type))
+        return
+
+    filename = render_path.split(os.sep)[-1]
+    if render_type == cnst.BackgroundRenderType.rop_render:
+        filename = rop_uuid
+        if filename is None:
+            logging.error("Render UUID has not provided "
+                          "for {0}".format(render_path))
+            return
+
+    # Proxy LODs are transient previews, only the full model is stored and cached.
+    lod = lod or cnst.RenderLod.full
+    if lod != cnst.RenderLod.proxy:
+        formatted_frame_string = None
+        if render_type == cnst.BackgroundRenderType.glb_file:
+            formatted_frame_string = "{0}-{1}".format(frames[0], frames[1])
+
+        redis_client.store_render_data(render_type,
+                                       file_uuid,
+                                       filename,
+                                       node_path,
+                                       formatted_frame_string)
+        render_cache.store_result(render_type, filename)
+
+    render_completion_dict = {
+        'hipFile': file_uuid,
+        'fileName': filename,
+        'nodePath': node_path
+    }
+
+    if render_type == cnst.BackgroundRenderType.glb_file:
+        render_completion_dict["frameRange"] = frames
+
+    if render_type != cnst.BackgroundRenderType.rop_render:
+        render_completion_dict["lod"] = lod
+
+    # Echoed back by the client to acknowledge delivery (see render_trace).
+    if trace_id is not None:
+        render_completion_dict["traceId"] = trace_id
+
+    logging.info("Render Completion Emitted: {0}".format(render_completion_dict))
+    emit(channel, render_completion_dict, socket_id,
+         history_file_uuid=hip_file_uuid or file_uuid, user_uuid=user_uuid)
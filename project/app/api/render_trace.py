@@ -0,0 +1,133 @@
+import re
+import uuid
+import logging
+
+import redis
+
+from app import redis_client, constants as cnst
+
+_TRACE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+# Percentiles reported by `summarize_recent`.
+_PERCENTILES = (50, 90, 99)
+
+
+def new_trace_id():
+    return uuid.uuid4().hex
+
+
+def is_valid_trace_id(trace_id):
+    return isinstance(trace_id, str) and _TRACE_ID_PATTERN.match(trace_id) is not None
+
+
+def record(trace_id, stage, render_type=None, **fields):
+    """Append a `stage` event to the render's timeline.
+
+    Tracing is best effort: renders queued without a trace id are ignored
+    and redis errors are only logged.
+    """
+    if not trace_id:
+        return
+
+    event = {"stage": stage}
+    if render_type is not None:
+        event["render_type"] = render_type
+    event.update({name: str(value) for name, value in fields.items() if value is not None})
+
+    try:
+        redis_client.append_trace_event(trace_id, event)
+    except redis.RedisError as exc:
+        logging.warning("Unable to record {0} for trace {1}: {2}".format(stage, trace_id, exc))
+
+
+def get_timeline(trace_id):
+    """:returns: The render's stage breakdown, or None for unknown traces."""
+    events = redis_client.get_trace_events([trace_id])[trace_id]
+    if not events:
+        return None
+    return build_timeline(trace_id, events)
+
+
+def build_timeline(trace_id, events):
+    """Attribute the time between consecutive events to the later stage.
+
+    Deliveries are acknowledged by the browser asynchronously, so they are
+    measured from their matching notification instead.
+    """
+    start_time = _entry_time(events[0][0])
+    previous_time = start_time
+    notified_times = {}
+
+    timeline = []
+    for entry_id, event in events:
+        event_time = _entry_time(entry_id)
+        label = get_stage_label(event)
+
+        if event["stage"] == cnst.TraceStages.delivered:
+            notified_label = label.replace(cnst.TraceStages.delivered, cnst.TraceStages.notified, 1)
+            duration = event_time - notified_times.get(notified_label, event_time)
+        else:
+            duration = event_time - previous_time
+            previous_time = event_time
+            if event["stage"] == cnst.TraceStages.notified:
+                notified_times[label] = event_time
+
+        timeline.append(dict(event,
+                             label=label,
+                             elapsed_s=(event_time - start_time) / 1000.0,
+                             duration_s=duration / 1000.0))
+
+    return {
+        "trace_id": trace_id,
+        "events": timeline,
+        "total_s": (_entry_time(events[-1][0]) - start_time) / 1000.0,
+    }
+
+
+def summarize_recent(limit=cnst.RENDER_TRACE_HISTORY):
+    """Percentiles of each stage's duration across the most recent renders."""
+    trace_ids = redis_client.get_recent_trace_ids(limit)
+    stage_durations = {}
+    totals = []
+    for trace_id, events in redis_client.get_trace_events(trace_ids).items():
+        if not events:
+            continue
+
+        timeline = build_timeline(trace_id, events)
+        totals.append(timeline["total_s"])
+        for event in timeline["events"][1:]:
+            stage_durations.setdefault(event["label"], []).append(event["duration_s"])
+
+    return {
+        "traces": len(totals),
+        "total": summarize_durations(totals),
+        "stages": {label: summarize_durations(durations)
+                   for label, durations in sorted(stage_durations.items())},
+    }
+
+
+def summarize_durations(durations):
+    if not durations:
+        return {"count": 0}
+
+    ordered = sorted(durations)
+    summary = {"count": len(ordered), "mean_s": sum(ordered) / len(ordered)}
+    for percentile in _PERCENTILES:
+        # Nearest-rank percentile.
+        rank = max(int(-(-percentile * len(ordered) // 100)), 1)
+        summary["p{0}_s".format(percentile)] = ordered[rank - 1]
+    return summary
+
+
+def get_stage_label(event):
+    """Stage name qualified by render type and LOD, e.g. `notified:glb:proxy`."""
+    parts = [event["stage"]]
+    for field in ("render_type", "lod"):
+        if event.get(field):
+            parts.append(event[field])
+    return ":".join(parts)
+
+
+def _entry_time(entry_id):
+    # Stream entry IDs are `<milliseconds>-<sequence>`.
+    return int(entry_id.split("-")[0])
@@ -0,0 +1,91 @@
+import os
+import logging
+
+import hou
+from celery import current_task
+from celery.utils.nodenames import worker_direct
+
+from app import redis_client, constants as cnst
+from app.api import metrics
+
+
+class ResidentScene:
+    """Keeps the last loaded .hip resident in the worker process so that
+    consecutive tasks targeting the same file skip `hou.hipFile.load`.
+
+    A hou session can only hold a single scene, so each worker process
+    keeps exactly one resident scene. The farm-wide view of which worker
+    holds which scene lives in redis (see `task_routing_options`), where
+    stale entries expire on their own.
+    """
+
+    _scene_key = None
+    _load_frame = None
+
+    @classmethod
+    def load(cls, hip_path, file_uuid=None):
+        """:returns: Whether the resident scene was reused."""
+        scene_key = _build_scene_key(hip_path)
+        reused = scene_key is not None and scene_key == cls._scene_key and \
+            hou.hipFile.path() == hip_path
+        if reused:
+            redis_client.increment_scene_cache_metric("reuse")
+            logging.info("Reusing resident scene: {0}".format(hip_path))
+            # Earlier tasks cook at their own frames, start from the frame
+            # the file was saved at like a fresh load would.
+            hou.setFrame(cls._load_frame)
+        else:
+            with metrics.HIP_LOAD_SECONDS.time(process=metrics.get_process_type()):
+                hou.hipFile.load(hip_path, suppress_save_prompt=True, ignore_load_warnings=True)
+            cls._scene_key = scene_key
+            cls._load_frame = hou.frame()
+            redis_client.increment_scene_cache_metric("reload")
+            logging.info("Loaded scene: {0}".format(hip_path))
+
+        if file_uuid is not None:
+            _advertise_resident_scene(file_uuid)
+        return reused
+
+    @classmethod
+    def invalidate(cls):
+        cls._scene_key = None
+
+
+def load_hip(hip_path, file_uuid=None):
+    return ResidentScene.load(hip_path, file_uuid=file_uuid)
+
+
+def invalidate():
+    ResidentScene.invalidate()
+
+
+def task_routing_options(file_uuid):
+    """Build the `apply_async` options routing a task to the worker that
+    most recently loaded the .hip for `file_uuid`.
+
+    Only interactive-only workers advertise their scene, a worker that
+    also takes batch jobs could leave the task waiting behind a long ROP.
+    Falls back to the default queue if no worker advertised the scene.
+    """
+    hostname = redis_client.get_scene_affinity(file_uuid)
+    if hostname is None:
+        return {}
+    return {"queue": worker_direct(hostname)}
+
+
+def _advertise_resident_scene(file_uuid):
+    request = getattr(current_task, "request", None)
+    hostname = getattr(request, "hostname", None)
+    if hostname and hostname.split("@")[0] == cnst.INTERACTIVE_WORKER_NAME:
+        redis_client.set_scene_affinity(file_uuid, hostname)
+
+
+def _build_scene_key(hip_path):
+    """Change detection for the resident scene: a re-uploaded or edited
+    file changes its mtime or size and forces a reload.
+    """
+    try:
+        stat = os.stat(hip_path)
+    except OSError:
+        return None
+    return os.path.realpath(hip_path), stat.st_mtime_ns, stat.st_size
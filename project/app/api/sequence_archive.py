@@ -0,0 +1,52 @@
+import os
+import zipfile
+import logging
+import tempfile
+
+from app import constants as cnst
+
+
+def get_archive_path(render_id):
+    return os.path.join(cnst.USER_RENDER_ARCHIVE_DIR, "{0}.zip".format(render_id))
+
+
+def build_sequence_archive(render_id):
+    """Zip the outputs of a ROP render into its downloadable archive.
+
+    Image formats that are already compressed are stored as-is, deflating
+    them again only costs CPU. The archive lives outside the render folder
+    so it never ends up inside a later archive, and is written to a temp
+    file first so a download can't observe a partial zip.
+
+    :returns: Path to the archive, or None if the render folder is missing.
+    :rtype: str
+    """
+    render_dir = os.path.join(cnst.USER_RENDER_DIR, render_id)
+    if not os.path.isdir(render_dir):
+        logging.error("No render directory found for: {0}".format(render_id))
+        return None
+
+    archive_path = get_archive_path(render_id)
+    os.makedirs(cnst.USER_RENDER_ARCHIVE_DIR, exist_ok=True)
+
+    fd, temp_path = tempfile.mkstemp(suffix=".zip", dir=cnst.USER_RENDER_ARCHIVE_DIR)
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            with zipfile.ZipFile(temp_file, "w") as zipf:
+                for file_name in sorted(os.listdir(render_dir)):
+                    file_path = os.path.join(render_dir, file_name)
+                    if not os.path.isfile(file_path):
+                        continue
+
+                    extension = os.path.splitext(file_name)[1].lower()
+                    if extension in cnst.PRECOMPRESSED_EXTENSIONS:
+                        compress_type = zipfile.ZIP_STORED
+                    else:
+                        compress_type = zipfile.ZIP_DEFLATED
+                    zipf.write(file_path, file_name, compress_type=compress_type)
+        os.replace(temp_path, archive_path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+    return archive_path
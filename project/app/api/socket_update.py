@@ -1,10 +1,10 @@
 import os
-import json
 import uuid
-from flask import request, current_app
+from flask import request, session, current_app
 
 from app import socketio, redis_client, constants as cnst
-from app.api import hou_api, utils
+from app.api import (event_relay, hou_api, render_cache, render_events, render_trace,
+                     storage_gc, utils)
 
 logger = utils.get_logger("celery_listener")
 
@@ -39,11 +39,45 @@ def receive_render_task(render_data):
                                               step=step,
                                               file_uuid=file_uuid,
                                               socket_id=socket_id,
-                                              export_settings=export_settings)
+                                              export_settings=export_settings,
+                                              trace_id=render_trace.new_trace_id(),
+                                              user_uuid=session.get("user_uuid"))
         logger.info(render_struct)
-        result = hou_api.submit_node_for_render(render_struct)
+        render_trace.record(render_struct.trace_id, cnst.TraceStages.submitted,
+                            node_path=node_path, file_uuid=file_uuid)
+        storage_gc.touch_hip(file_uuid)
+
+        # Replay position covering every event of this submission.
+        event_cursor = None
+        if render_struct.user_uuid is not None:
+            event_cursor = redis_client.get_render_event_tip(render_struct.user_uuid, file_uuid)
+
+        cache_key = None
+        if current_app.config["RENDER_CACHE_ENABLED"]:
+            cache_key = get_render_cache_key(render_struct)
+
+        if cache_key is not None:
+            cached_files = render_cache.lookup(cache_key)
+            if cached_files:
+                # Emit once the acknowledgement below has reached the client.
+                socketio.start_background_task(emit_cached_render, render_struct, cached_files)
+                glb_filename = cached_files[cnst.BackgroundRenderType.glb_file]
+                return {
+                    "message": "Submission served from render cache.",
+                    "filename": os.path.splitext(glb_filename)[0],
+                    "success": True,
+                    "cached": True,
+                    "traceId": render_struct.trace_id,
+                    "eventCursor": event_cursor
+                }
+
+        # Jobs are scheduled fairly between users, falling back to the socket.
+        result = hou_api.submit_node_for_render(render_struct, user_key=render_struct.user_uuid)
         if not result:
             raise RuntimeError("Render submission failed.")
+
+        if cache_key is not None:
+            render_cache.register_pending(render_id, cache_key)
     except Exception as e:
         error_message = str(e)
         return {"message": error_message, "success": False}
@@ -52,136 +86,110 @@ def receive_render_task(render_data):
     return {
         "message": "Submission succeeded.",
         "filename": str(render_id),
-        "success": True
-    }
-
-
-def listen_to_celery_workers():
-    """Create a redis client subscribed to the channels on which
-    the celery workers will publish their updates.
-
-    Render updates received over the `render_updates` channel are
-    then emitted over a WebSocket to update the popper's progress
-    bar.
-
-    Completion notifications received over `render_completion_channel`
-    will indicate to the user that model is being loaded in Babylon.
-    """
-    _redis_client = redis_client.get_client_instance()
-    pubsub = _redis_client.pubsub()
-    pubsub.subscribe(cnst.PublishChannels.render_completion,
-                     cnst.PublishChannels.glb_progress,
-                     cnst.PublishChannels.thumb_progress)
-
-    channel_handlers = {
-        cnst.PublishChannels.render_completion: handle_render_completion,
-        cnst.PublishChannels.glb_progress: handle_glb_progress_update,
-        cnst.PublishChannels.thumb_progress: handle_thumb_progress_update,
+        "success": True,
+        "traceId": render_struct.trace_id,
+        "eventCursor": event_cursor
     }
 
-    for message in pubsub.listen():
-        if message['type'] != 'message':
-            continue
-
-        channel = message['channel'].decode('utf-8')
-        message_data = message['data'].decode('utf-8')
-
-        if not message_data:
-            logger.error("No message data provided "
-                         "for update: {0}".format(channel))
-            return
-
-        if channel in channel_handlers:
-            channel_handlers[channel](message_data)
-        else:
-            logger.error("Invalid channel name: {0}".format(channel))
-
-
-def handle_render_completion(message_data):
-    render_completion_data = json.loads(message_data)
 
-    required_keys = {
-        'file_uuid', 'render_type', 'render_node_path',
-        'render_file_path', 'socket_id', 'frame_info',
-    }
-    if not validate_required_keys(render_completion_data, required_keys):
+@socketio.on('render_trace_ack')
+def acknowledge_render_delivery(data):
+    """Completes a render's trace once the browser received its completion."""
+    trace_id = data.get('traceId') if isinstance(data, dict) else None
+    if not render_trace.is_valid_trace_id(trace_id):
         return
 
-    render_type = render_completion_data["render_type"]
-    if render_type == cnst.BackgroundRenderType.glb_file:
-        channel = cnst.PublishChannels.node_render_finished
-    elif render_type == cnst.BackgroundRenderType.thumbnail:
-        channel = cnst.PublishChannels.node_thumb_finished
-    elif render_type == cnst.BackgroundRenderType.rop_render:
-        channel = cnst.PublishChannels.render_rop_finished
-    else:
-        logger.error("Unknown render type: {0}".format(render_type))
+    render_type = data.get('renderType')
+    if render_type not in (cnst.BackgroundRenderType.glb_file,
+                           cnst.BackgroundRenderType.thumbnail,
+                           cnst.BackgroundRenderType.rop_render):
         return
 
-    filename = render_completion_data["render_file_path"].split(os.sep)[-1]
-    if render_type == cnst.BackgroundRenderType.rop_render:
-        filename = render_completion_data.get("rop_uuid", None)
-        if filename is None:
-            logger.error("Render UUID has not provided "
-                         "for {0}".format(render_completion_data["render_file_path"]))
-            return
-
-    formatted_frame_string = None
-    if render_type == cnst.BackgroundRenderType.glb_file:
-        frames = render_completion_data["frame_info"]
-        formatted_frame_string = "{0}-{1}".format(frames[0], frames[1])
-
-    redis_client.store_render_data(render_type,
-                                   render_completion_data["file_uuid"],
-                                   filename,
-                                   render_completion_data["render_node_path"],
-                                   formatted_frame_string)
-
-    render_completion_dict = {
-        'hipFile': render_completion_data["file_uuid"],
-        'fileName': filename,
-        'nodePath': render_completion_data["render_node_path"]
-    }
-
-    if render_type == cnst.BackgroundRenderType.glb_file:
-        render_completion_dict["frameRange"] = render_completion_data["frame_info"]
+    lod = data.get('lod')
+    if lod not in (cnst.RenderLod.proxy, cnst.RenderLod.full):
+        lod = None
+    render_trace.record(trace_id, cnst.TraceStages.delivered, render_type=render_type, lod=lod)
 
-    socketio.emit(channel, render_completion_dict, room=render_completion_data["socket_id"])
 
+@socketio.on('resync_render_events')
+def resync_render_events(data):
+    """Replay the render events a reconnecting client missed.
 
-def handle_glb_progress_update(message_data):
-    glb_progress_data = json.loads(message_data)
-
-    required_keys = {'render_node_path', 'progress', "socket_id"}
-    if not validate_required_keys(glb_progress_data, required_keys):
-        return
-
-    socketio.emit(cnst.PublishChannels.node_render_update, {
-        'nodePath': glb_progress_data['render_node_path'],
-        'progress': glb_progress_data['progress']
-    },
-                  room=glb_progress_data["socket_id"])
-
+    The client sends the last event ID it received per .hip and is
+    answered with the updated positions once the replay was emitted.
+    Only the session user's own render events are replayed.
+    """
+    cursors = data.get('cursors') if isinstance(data, dict) else None
+    user_uuid = session.get("user_uuid")
+    if not isinstance(cursors, list) or not user_uuid:
+        return {"cursors": {}}
 
-def handle_thumb_progress_update(message_data):
-    thumb_data = json.loads(message_data)
+    cursors = [cursor for cursor in cursors if isinstance(cursor, dict)]
+    return {"cursors": event_relay.replay(cursors, request.sid, user_uuid)}
 
-    required_keys = {'nodePath', 'progress', "socket_id"}
-    if not validate_required_keys(thumb_data, required_keys):
-        return
 
-    socketio.emit(cnst.PublishChannels.node_thumb_update, {
-        'nodePath': thumb_data["nodePath"],
-        'progress': float(thumb_data["progress"])
-    },
-                  room=thumb_data["socket_id"])
+def get_render_cache_key(render_struct):
+    """Content address for the submission, or None if it can't be cached.
 
-
-def validate_required_keys(data, keys):
-    if not keys.issubset(data):
-        logger.error("Missing required data in message: {0}".format(str(keys)))
-        return False
-    return True
+    Only .glb previews are cached. ROP renders write arbitrary outputs and
+    files uploaded before hashes were recorded have nothing to key on.
+    """
+    hip_hash = redis_client.get_file_hash_from_uuid(render_struct.file_uuid)
+    if hip_hash is None:
+        return None
+
+    render_type = hou_api.get_render_type(render_struct.node_path)
+    if render_type != cnst.BackgroundRenderType.glb_file:
+        return None
+
+    return render_cache.build_cache_key(hip_hash,
+                                        render_struct.node_path,
+                                        render_struct.start,
+                                        render_struct.end,
+                                        render_struct.step,
+                                        render_struct.export_settings,
+                                        render_type)
+
+
+def emit_cached_render(render_struct, cached_files):
+    """Replay the completion events of a cached render without Celery."""
+    frame_range = [render_struct.start, render_struct.end]
+    glb_filename = cached_files[cnst.BackgroundRenderType.glb_file]
+    thumb_filename = cached_files[cnst.BackgroundRenderType.thumbnail]
+
+    redis_client.store_render_data(cnst.BackgroundRenderType.glb_file,
+                                   render_struct.file_uuid,
+                                   glb_filename,
+                                   render_struct.node_path,
+                                   "{0}-{1}".format(*frame_range))
+    redis_client.store_render_data(cnst.BackgroundRenderType.thumbnail,
+                                   render_struct.file_uuid,
+                                   thumb_filename,
+                                   render_struct.node_path,
+                                   None)
+
+    for render_type in (cnst.BackgroundRenderType.glb_file, cnst.BackgroundRenderType.thumbnail):
+        render_trace.record(render_struct.trace_id, cnst.TraceStages.notified,
+                            render_type=render_type, lod=cnst.RenderLod.full, cached=1)
+
+    # Published like any other completion so they can be replayed too.
+    render_events.emit(cnst.PublishChannels.node_render_finished, {
+        'hipFile': render_struct.file_uuid,
+        'fileName': glb_filename,
+        'nodePath': render_struct.node_path,
+        'frameRange': frame_range,
+        'lod': cnst.RenderLod.full,
+        'traceId': render_struct.trace_id
+    }, render_struct.socket_id, history_file_uuid=render_struct.file_uuid,
+        user_uuid=render_struct.user_uuid)
+    render_events.emit(cnst.PublishChannels.node_thumb_finished, {
+        'hipFile': render_struct.file_uuid,
+        'fileName': thumb_filename,
+        'nodePath': render_struct.node_path,
+        'lod': cnst.RenderLod.full,
+        'traceId': render_struct.trace_id
+    }, render_struct.socket_id, history_file_uuid=render_struct.file_uuid,
+        user_uuid=render_struct.user_uuid)
 
 
 def generate_uuid_filepath(glb_suffix):
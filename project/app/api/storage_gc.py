@@ -0,0 +1,386 @@
+import os
+import glob
+import time
+import zlib
+import shutil
+import logging
+
+import redis
+
+from app import redis_client, constants as cnst
+from app.api import metrics, sequence_archive
+
+# Directories holding the renders .hip files reference, by extension.
+_RENDER_DIRS = {
+    ".glb": cnst.USER_MODEL_DIR,
+    ".gltf": cnst.USER_MODEL_DIR,
+    "." + cnst.THUMBNAIL_EXT: cnst.USER_THUMB_DIR,
+}
+
+_PART_SUFFIX = ".part"
+
+# Bookkeeping of data stored before the collector existed, filled in by
+# resumable scans before anything is collected (see `backfill`).
+_BACKFILLS = (
+    ("hip_owners", "user:*:filenames_set", redis_client.backfill_hip_owners),
+    ("render_refs", "file_render_data:*", redis_client.backfill_render_refs),
+)
+
+
+def get_shard(name):
+    """Bucket a stored file is swept in, stable across processes."""
+    return zlib.crc32(name.encode("utf-8")) % cnst.STORAGE_GC_SHARDS
+
+
+def touch_hip(file_uuid):
+    if file_uuid:
+        _touch(redis_client.touch_storage, cnst.StorageKinds.hip, file_uuid, existing_only=True)
+
+
+def touch_render(filename):
+    """Count an access of a render towards the .hip that produced it."""
+    _touch(redis_client.touch_render_owner, filename)
+
+
+def touch_rop(render_id):
+    _touch(redis_client.touch_storage, cnst.StorageKinds.rop, render_id)
+
+
+def sweep(upload_folder):
+    """Run one incremental pass of the storage collector.
+
+    Each pass deletes renders replaced by re-renders, then sweeps a single
+    bucket of the stored files: unreferenced renders and uploads are deleted,
+    expired ROP outputs too, and the bytes kept are recorded. Owners of the
+    uploads in the bucket are held to their quota, then all storage to the
+    global one, by evicting the least recently used .hip files.
+    """
+    lock_timeout = cnst.STORAGE_GC_INTERVAL * 10
+    if not redis_client.acquire_storage_sweep_lock(lock_timeout):
+        logging.info("Storage sweep already running, skipping.")
+        return
+
+    try:
+        if not backfill():
+            return
+
+        now = time.time()
+        collect_replaced_renders(now)
+
+        shard = redis_client.next_storage_shard()
+        owners = sweep_shard(shard, upload_folder, now)
+
+        for user_uuid in owners:
+            enforce_user_quota(user_uuid, upload_folder, now)
+        enforce_global_quota(upload_folder, now)
+    finally:
+        redis_client.release_storage_sweep_lock()
+
+
+def backfill():
+    """Advance the backfill scans within the sweep's time budget.
+
+    :returns: Whether every backfill has finished.
+    """
+    deadline = time.monotonic() + cnst.STORAGE_GC_BACKFILL_BUDGET
+    for name, pattern, backfill_func in _BACKFILLS:
+        finished = False
+        while not finished:
+            if time.monotonic() > deadline:
+                return False
+            keys, finished = redis_client.scan_backfill_keys(name, pattern)
+            if keys:
+                backfill_func(keys)
+    return True
+
+
+def collect_replaced_renders(now):
+    """Delete renders replaced by a re-render of the same node, unless
+    another .hip or the render cache still uses them.
+    """
+    filenames = redis_client.get_orphan_candidates(now - cnst.STORAGE_GC_GRACE_PERIOD,
+                                                   cnst.STORAGE_GC_BATCH_SIZE)
+    if not filenames:
+        return
+
+    referenced = redis_client.get_render_references(filenames)
+    orphans = [filename for filename in filenames if filename not in referenced]
+    redis_client.delete_render_records(orphans)
+    remove_paths([path for filename in orphans for path in get_render_paths(filename)],
+                 cnst.StorageGcReasons.orphan)
+    redis_client.remove_orphan_candidates(filenames)
+
+
+def sweep_shard(shard, upload_folder, now):
+    """Collect what's unused among the stored files of `shard`.
+
+    :returns: Set of the users owning uploads in the shard.
+    """
+    expired_before = now - cnst.STORAGE_GC_GRACE_PERIOD
+    kept_bytes, removed = 0, []
+
+    # Proxy LODs share the fate of the render they preview.
+    render_entries = [entry for directory in set(_RENDER_DIRS.values())
+                      for entry in _scan_shard(directory, shard)]
+    referenced = redis_client.get_render_references(
+        list({_get_base_render(entry.name) for entry in render_entries}))
+    for entry in render_entries:
+        size, modified = _stat(entry)
+        if _get_base_render(entry.name) in referenced or modified > expired_before:
+            kept_bytes += size
+        else:
+            removed.append(entry.path)
+
+    rop_bytes, expired_rops = _sweep_rop_outputs(shard, now)
+    kept_bytes += rop_bytes
+
+    hip_bytes, orphaned_hips, owners = _sweep_uploads(shard, upload_folder, expired_before)
+    kept_bytes += hip_bytes
+
+    remove_paths(removed + orphaned_hips, cnst.StorageGcReasons.orphan)
+    for render_id in expired_rops:
+        evict_rop(render_id, cnst.StorageGcReasons.expired)
+    # Set last, overriding what the deletions above released from the shard.
+    redis_client.set_shard_bytes(shard, kept_bytes)
+    return owners
+
+
+def enforce_user_quota(user_uuid, upload_folder, now):
+    if not cnst.STORAGE_USER_QUOTA_BYTES:
+        return
+
+    hips = redis_client.get_user_storage(user_uuid)
+    used_bytes = sum(size for _, size, _ in hips)
+    for file_uuid, size, last_access in sorted(hips, key=lambda hip: hip[2]):
+        if used_bytes <= cnst.STORAGE_USER_QUOTA_BYTES or \
+                last_access > now - cnst.STORAGE_GC_GRACE_PERIOD:
+            break
+        evict_hip(file_uuid, upload_folder, cnst.StorageGcReasons.user_quota)
+        used_bytes -= size
+
+
+def enforce_global_quota(upload_folder, now):
+    """Evict the least recently used .hip files and ROP outputs alike until
+    storage fits `STORAGE_MAX_BYTES`. At most one batch is evicted per
+    sweep, the next sweep carries on if storage is still over quota.
+    """
+    if not cnst.STORAGE_MAX_BYTES:
+        return
+
+    used_bytes = redis_client.get_storage_bytes()
+    if used_bytes <= cnst.STORAGE_MAX_BYTES:
+        return
+
+    least_recent = sorted((last_access, kind, name)
+                          for kind in (cnst.StorageKinds.hip, cnst.StorageKinds.rop)
+                          for name, last_access in redis_client.get_least_recent_storage(
+                              kind, cnst.STORAGE_GC_BATCH_SIZE))
+    for last_access, kind, name in least_recent[:cnst.STORAGE_GC_BATCH_SIZE]:
+        if used_bytes <= cnst.STORAGE_MAX_BYTES:
+            return
+        if last_access > now - cnst.STORAGE_GC_GRACE_PERIOD:
+            break
+        if kind == cnst.StorageKinds.hip:
+            used_bytes -= evict_hip(name, upload_folder, cnst.StorageGcReasons.global_quota)
+        else:
+            used_bytes -= evict_rop(name, cnst.StorageGcReasons.global_quota)
+
+    if used_bytes > cnst.STORAGE_MAX_BYTES:
+        logging.warning("Storage is still {0} bytes over quota.".format(
+            used_bytes - cnst.STORAGE_MAX_BYTES))
+
+
+def evict_hip(file_uuid, upload_folder, reason):
+    """Delete an upload with its bookkeeping, and the renders nothing else uses.
+
+    Redis is cleaned up first, files left behind by an interrupted eviction
+    are collected as orphans by a later sweep.
+
+    :returns: Number of bytes freed.
+    """
+    hip_paths = glob.glob(os.path.join(upload_folder, "{0}.hip*".format(glob.escape(file_uuid))))
+
+    hip_info = redis_client.get_hip_storage_info([file_uuid])[file_uuid]
+    orphans = redis_client.delete_hip_records(file_uuid, hip_info)
+    redis_client.delete_render_records(orphans)
+    render_paths = [path for filename in orphans for path in get_render_paths(filename)]
+
+    freed_bytes = remove_paths(hip_paths + render_paths, reason)
+    logging.info("Evicted .hip {0} ({1}), freed {2} bytes.".format(file_uuid, reason, freed_bytes))
+    return freed_bytes
+
+
+def evict_rop(render_id, reason):
+    redis_client.delete_rop_records([render_id])
+    freed_bytes = remove_paths([os.path.join(cnst.USER_RENDER_DIR, render_id),
+                                sequence_archive.get_archive_path(render_id)], reason)
+    logging.info("Evicted ROP render {0} ({1}), freed {2} bytes.".format(
+        render_id, reason, freed_bytes))
+    return freed_bytes
+
+
+def get_render_paths(filename):
+    """Paths of a render and its proxy LOD."""
+    root, ext = os.path.splitext(filename)
+    directory = _RENDER_DIRS.get(ext.lower())
+    if directory is None or os.path.basename(filename) != filename:
+        return []
+    return [os.path.join(directory, filename),
+            os.path.join(directory, root + cnst.PROXY_SUFFIX + ext)]
+
+
+def remove_paths(paths, reason):
+    """Delete files and directories, releasing their bytes from the
+    storage total.
+
+    :returns: Number of bytes freed.
+    """
+    freed_bytes = {}
+    for path in paths:
+        name = os.path.basename(path)
+        try:
+            size = _get_size(path)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            continue
+        except OSError as exc:
+            logging.error("Unable to delete {0}: {1}".format(path, exc))
+            continue
+        shard = get_shard(name)
+        freed_bytes[shard] = freed_bytes.get(shard, 0) + size
+
+    total_freed = sum(freed_bytes.values())
+    if total_freed:
+        redis_client.release_shard_bytes(freed_bytes)
+        metrics.STORAGE_GC_BYTES_TOTAL.inc(total_freed, reason=reason)
+    return total_freed
+
+
+def _sweep_rop_outputs(shard, now):
+    """:returns: Tuple of the bytes kept and the expired render IDs."""
+    outputs = {}
+    for directory in (cnst.USER_RENDER_DIR, cnst.USER_RENDER_ARCHIVE_DIR):
+        for entry in _scan_shard(directory, shard):
+            render_id = entry.name if entry.is_dir() else os.path.splitext(entry.name)[0]
+            outputs.setdefault(render_id, []).append(entry)
+    if not outputs:
+        return 0, []
+
+    # Archives are swept in the bucket of their own name, so a render
+    # directory and its archive may expire on different sweeps.
+    last_accesses = redis_client.get_storage_access(cnst.StorageKinds.rop, list(outputs))
+    kept_bytes, expired, unseen = 0, [], {}
+    for render_id, entries in outputs.items():
+        modified = max(_stat(entry)[1] for entry in entries)
+        last_access = last_accesses[render_id]
+        if last_access is None:
+            unseen[render_id] = modified
+            last_access = modified
+
+        if last_access < now - cnst.ROP_OUTPUT_RETENTION:
+            expired.append(render_id)
+        else:
+            kept_bytes += sum(_get_size(entry.path) for entry in entries)
+
+    redis_client.seed_storage_access(cnst.StorageKinds.rop, unseen)
+    return kept_bytes, expired
+
+
+def _sweep_uploads(shard, upload_folder, expired_before):
+    """:returns: Tuple of the bytes kept, orphaned paths and the owners seen."""
+    uploads, parts = {}, {}
+    for entry in _scan_shard(upload_folder, shard):
+        if entry.name.endswith(_PART_SUFFIX):
+            parts[entry.name[:-len(_PART_SUFFIX)]] = entry
+        elif entry.is_file():
+            uploads[os.path.splitext(entry.name)[0]] = entry
+
+    kept_bytes, orphaned, owners = 0, [], set()
+
+    # Resumable uploads are named after their session, single request
+    # uploads are temp files only ever alive for the request.
+    active_sessions = redis_client.get_active_upload_sessions(list(parts))
+    for upload_id, entry in parts.items():
+        size, modified = _stat(entry)
+        if upload_id in active_sessions or modified > expired_before:
+            kept_bytes += size
+        else:
+            orphaned.append(entry.path)
+
+    hip_info = redis_client.get_hip_storage_info(list(uploads))
+    hip_bytes, last_modified = {}, {}
+    for file_uuid, entry in uploads.items():
+        size, modified = _stat(entry)
+        info = hip_info[file_uuid]
+        if info is None:
+            if modified > expired_before:
+                kept_bytes += size
+            else:
+                orphaned.append(entry.path)
+            continue
+
+        # A .hip accounts for the renders it references, they're counted
+        # towards the storage total in their own buckets.
+        hip_bytes[file_uuid] = size + sum(_get_size(path) for filename in info["renders"]
+                                          for path in get_render_paths(filename))
+        last_modified[file_uuid] = modified
+        kept_bytes += size
+        if info["user_uuid"] is not None:
+            owners.add(info["user_uuid"])
+
+    redis_client.store_hip_bytes(hip_bytes)
+    redis_client.seed_storage_access(cnst.StorageKinds.hip, last_modified)
+    return kept_bytes, orphaned, owners
+
+
+def _scan_shard(directory, shard):
+    try:
+        with os.scandir(directory) as entries:
+            return [entry for entry in entries if get_shard(entry.name) == shard]
+    except FileNotFoundError:
+        return []
+
+
+def _get_base_render(filename):
+    root, ext = os.path.splitext(filename)
+    if root.endswith(cnst.PROXY_SUFFIX):
+        root = root[:-len(cnst.PROXY_SUFFIX)]
+    return root + ext
+
+
+def _stat(entry):
+    """:returns: Tuple of the entry's size and modification time."""
+    try:
+        stat_result = entry.stat()
+    except FileNotFoundError:
+        return 0, time.time()
+    return stat_result.st_size, stat_result.st_mtime
+
+
+def _get_size(path):
+    """Size of a file, or of everything inside a directory."""
+    if not os.path.isdir(path):
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return 0
+
+    total_size = 0
+    for root, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total_size += os.path.getsize(os.path.join(root, filename))
+            except FileNotFoundError:
+                pass
+    return total_size
+
+
+def _touch(touch_func, *args, **kwargs):
+    # Access tracking is best effort, it never fails the request.
+    try:
+        touch_func(*args, **kwargs)
+    except redis.RedisError as exc:
+        logging.warning("Unable to record storage access: {0}".format(exc))
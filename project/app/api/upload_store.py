@@ -0,0 +1,138 @@
+import os
+import uuid
+import hashlib
+import tempfile
+
+from app import redis_client, constants as cnst
+
+_PART_SUFFIX = ".part"
+
+
+class UploadOffsetMismatch(Exception):
+    """Raised when a chunk doesn't continue where the upload left off."""
+
+    def __init__(self, expected_offset):
+        super().__init__("Upload expected offset {0}.".format(expected_offset))
+        self.expected_offset = expected_offset
+
+
+def stream_to_temp_file(stream, upload_folder, buffer_size=cnst.UPLOAD_BUFFER_SIZE):
+    """Copy `stream` into a temporary file inside `upload_folder`, hashing
+    the contents on the way so the upload is only read once.
+
+    Keeping the temporary file on the same filesystem lets `persist_upload`
+    move it into place with an atomic rename.
+
+    :returns: Tuple of the temporary file's path and its SHA-256 hex digest.
+    :rtype: tuple(str, str)
+    """
+    sha256 = hashlib.sha256()
+    fd, temp_path = tempfile.mkstemp(suffix=_PART_SUFFIX, dir=upload_folder)
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            while True:
+                data = stream.read(buffer_size)
+                if not data:
+                    break
+                sha256.update(data)
+                temp_file.write(data)
+    except BaseException:
+        discard(temp_path)
+        raise
+    return temp_path, sha256.hexdigest()
+
+
+def persist_upload(user_uuid, original_filename, temp_path, file_hash, upload_folder):
+    """Register a fully received upload and move it into place, or discard
+    it if the user already uploaded identical contents.
+
+    :returns: UUID of the stored .hip, or None if a matching hash was found
+        but its file couldn't be resolved.
+    """
+    _, ext = os.path.splitext(original_filename)
+    file_uuid = str(uuid.uuid4())
+
+    if redis_client.add_unique_filename(user_uuid, original_filename, file_uuid, file_hash):
+        os.replace(temp_path, os.path.join(upload_folder, "{0}{1}".format(file_uuid, ext)))
+        return file_uuid
+
+    discard(temp_path)
+    return redis_client.retrieve_uuid_from_filename(user_uuid, file_hash)
+
+
+def discard(temp_path):
+    try:
+        os.remove(temp_path)
+    except OSError:
+        pass
+
+
+def create_session(user_uuid, original_filename, total_size, upload_folder, max_sessions):
+    """Start a resumable upload, sent as consecutive chunks by `append_chunk`.
+
+    :returns: The upload id, or None if the user already has `max_sessions`
+        uploads open.
+    """
+    upload_id = str(uuid.uuid4())
+    part_path = get_part_path(upload_id, upload_folder)
+    open(part_path, "wb").close()
+    if not redis_client.create_upload_session(upload_id, user_uuid, original_filename,
+                                              total_size, max_sessions):
+        discard(part_path)
+        return None
+    return upload_id
+
+
+def append_chunk(upload_id, upload_session, offset, stream, upload_folder,
+                 buffer_size=cnst.UPLOAD_BUFFER_SIZE):
+    """Write the chunk in `stream` at `offset` of a resumable upload.
+
+    Chunks must arrive in order. A chunk interrupted midway leaves the
+    session at its previous offset, so the client resends it in full.
+
+    :returns: Number of bytes received so far.
+    :raises UploadOffsetMismatch: If `offset` isn't the next expected byte.
+    """
+    received = upload_session["received"]
+    if offset != received:
+        raise UploadOffsetMismatch(received)
+
+    part_path = get_part_path(upload_id, upload_folder)
+    with open(part_path, "r+b") as part_file:
+        part_file.seek(offset)
+        remaining = upload_session["total_size"] - offset
+        while remaining > 0:
+            data = stream.read(min(buffer_size, remaining))
+            if not data:
+                break
+            part_file.write(data)
+            remaining -= len(data)
+        received = part_file.tell()
+        # Drop leftovers of a previously interrupted attempt at this chunk.
+        part_file.truncate()
+
+    redis_client.advance_upload_session(upload_id, received)
+    return received
+
+
+def finish_session(upload_id, upload_session, upload_folder):
+    """Hash the completed upload and persist it like a single request upload.
+
+    :returns: UUID of the stored .hip, see `persist_upload`.
+    """
+    part_path = get_part_path(upload_id, upload_folder)
+    sha256 = hashlib.sha256()
+    with open(part_path, "rb") as part_file:
+        while True:
+            data = part_file.read(cnst.UPLOAD_BUFFER_SIZE)
+            if not data:
+                break
+            sha256.update(data)
+
+    redis_client.delete_upload_session(upload_id, upload_session["user_uuid"])
+    return persist_upload(upload_session["user_uuid"], upload_session["filename"],
+                          part_path, sha256.hexdigest(), upload_folder)
+
+
+def get_part_path(upload_id, upload_folder):
+    return os.path.join(upload_folder, upload_id + _PART_SUFFIX)
@@ -8,24 +8,60 @@ class BackgroundRenderType(object):
     rop_render = "rop"
 
 
+class RenderLod(object):
+    proxy = "proxy"
+    full = "full"
+
+
+class CeleryQueues(object):
+    interactive = "interactive"
+    batch = "batch"
+
+
 class PublishChannels(object):
-    render_completion = "render_completion_channel"
-    thumb_progress = "thumb_progress_channel"
-    glb_progress = "glb_progress_channel"
     node_render_update = "node_render_progress_channel"
     node_thumb_update = "node_thumb_progress_channel"
     node_render_finished = "node_render_finish_channel"
     node_thumb_finished = "node_thumb_finish_channel"
     render_rop_finished = "render_rop_finish_channel"
+    render_rop_failed = "render_rop_fail_channel"
+
+
+class TraceStages(object):
+    submitted = "submitted"
+    dequeued = "dequeued"
+    scene_loaded = "scene_loaded"
+    cooked = "cooked"
+    exported = "exported"
+    notified = "notified"
+    delivered = "delivered"
+    failed = "failed"
+
+
+class StorageKinds(object):
+    hip = "hip"
+    rop = "rop"
+
+
+# Why the storage collector deleted a file.
+class StorageGcReasons(object):
+    orphan = "orphan"
+    expired = "expired"
+    user_quota = "user_quota"
+    global_quota = "global_quota"
 
 
 class RenderTaskStruct(
     namedtuple(
         "RenderTaskStruct",
-        "node_path glb_path thumbnail_path start end step file_uuid socket_id export_settings")):
+        "node_path glb_path thumbnail_path start end step file_uuid socket_id export_settings "
+        "trace_id user_uuid")):
     """Immutable data struct defining necessary fields to perform the
     render task.
 
+    `trace_id` keys the render's lifecycle timeline (see render_trace).
+    `user_uuid` is the submitting user whose event history records the
+    render's completions, None for sessions without a user.
     """
     __slots__ = ()
 
@@ -36,6 +72,31 @@ FILE_OUTPUT_PARMS = ["vm_picture", "picture", "sopoutput", "filename", "file"]
 # These need to be expanded on, esp. for 3rd party rendering.
 ROP_THUMBNAIL_REQUIRED_PARMS = ["vm_picture", "picture"]
 
+# Export setting enabling the post-export GLB optimizer (welding, quantization, stripping).
+GLB_OPTIMIZE_SETTING = "optimizeGlb"
+
+# Export setting enabling a low-poly proxy LOD exported ahead of the full GLB.
+GLB_PROXY_SETTING = "proxyLod"
+
+# Export setting wrapping the render in a hou.perfMon profile to record per-node cook times.
+PROFILE_COOK_SETTING = "profileCook"
+
+# Export settings consumed by `render_glb` rather than set on the gltf ROP.
+POST_EXPORT_SETTINGS = {GLB_OPTIMIZE_SETTING, GLB_PROXY_SETTING, PROFILE_COOK_SETTING}
+
+# Profile every render, regardless of PROFILE_COOK_SETTING.
+PROFILE_RENDER_COOKS = os.getenv("PROFILE_RENDER_COOKS", "false").lower() == "true"
+
+# Proxy LODs are only worth exporting for targets with at least this many primitives.
+GLB_PROXY_MIN_PRIMS = int(os.getenv("GLB_PROXY_MIN_PRIMS", 200000))
+
+# Percentage of polygons kept by the PolyReduce pass of the proxy LOD.
+GLB_PROXY_PERCENTAGE = 5
+GLB_PROXY_NODE = "proxy_polyreduce1_webrender"
+
+# Filename suffix of proxy outputs (preview thumbnails and low-poly GLBs).
+PROXY_SUFFIX = "_proxy"
+
 CURRENT_FILE_UUID = 'current_file_uuid'
 THUMBNAIL_EXT = "png"
 THUMBNAIL_CAM = "thumbnail_cam1_webrender"
@@ -43,6 +104,93 @@ THUMBNAIL_ROP = "thumbnail_karma1_webrender"
 GLB_ROP = "preview_glb1_webrender"
 DEFAULT_RES = 512
 
+# Redis queue relaying Socket.IO emits between web workers.
+SOCKETIO_MESSAGE_QUEUE = os.getenv("SOCKETIO_MESSAGE_QUEUE", "redis://redis:6379/0")
+
+# Stream every render event is published to, drained by the web tier's consumer group.
+RENDER_EVENT_STREAM = "render_events:delivery"
+RENDER_EVENT_GROUP = "socketio"
+RENDER_EVENT_STREAM_MAXLEN = 10000
+
+# Completions are also kept per user and .hip so reconnecting clients can replay them.
+RENDER_EVENT_HISTORY_MAXLEN = 500
+RENDER_EVENT_HISTORY_TTL = 86400
+
+# Milliseconds a relay blocks waiting for events, and after which a dead
+# relay's undelivered events are claimed by another.
+RENDER_EVENT_BLOCK_MS = 5000
+RENDER_EVENT_CLAIM_IDLE_MS = 30000
+
+# Max progress messages per second published by a single ProgressFilter.
+PROGRESS_PUBLISH_RATE = 5
+
+# Redis connection pool sizes per process type (see REDIS_PROCESS_TYPE).
+REDIS_POOL_SIZES = {"web": 64, "celery": 8}
+
+# Seconds to wait for a free pooled redis connection before raising.
+REDIS_POOL_TIMEOUT = 20
+
+# Frames rendered per shard when fanning a ROP sequence out across workers (0 disables).
+ROP_SHARD_SIZE = int(os.getenv("ROP_SHARD_SIZE", 24))
+
+# Seconds the per-shard progress bookkeeping of a ROP render is kept for.
+ROP_SHARD_DATA_TTL = 86400
+
+# Byte budget for cached .glb and thumbnail outputs before LRU eviction.
+RENDER_CACHE_MAX_BYTES = int(os.getenv("RENDER_CACHE_MAX_BYTES", 10 * 1024 ** 3))
+
+# Seconds a submission waits for its outputs to be attached to its cache entry.
+RENDER_CACHE_PENDING_TTL = 86400
+
+# Bytes of uploads and renders a user may keep, and all storage may hold,
+# before the least recently used .hip files are evicted (0 disables).
+STORAGE_USER_QUOTA_BYTES = int(os.getenv("STORAGE_USER_QUOTA_BYTES", 5 * 1024 ** 3))
+STORAGE_MAX_BYTES = int(os.getenv("STORAGE_MAX_BYTES", 200 * 1024 ** 3))
+
+# Seconds a ROP sequence and its archive are kept after their last download.
+ROP_OUTPUT_RETENTION = int(os.getenv("ROP_OUTPUT_RETENTION", 7 * 86400))
+
+# Files and .hip uploads used more recently than this are never collected,
+# covering renders that are still being written.
+STORAGE_GC_GRACE_PERIOD = 86400
+
+# Seconds between storage sweeps. Each sweep visits one of the buckets
+# stored files are hashed into, so a full pass takes STORAGE_GC_SHARDS sweeps.
+STORAGE_GC_INTERVAL = 60
+STORAGE_GC_SHARDS = 256
+
+# Redis entries examined per round trip when draining overwritten renders
+# or backfilling the bookkeeping of data stored before the collector existed.
+STORAGE_GC_BATCH_SIZE = 500
+
+# Seconds of backfill work a sweep may do before moving on.
+STORAGE_GC_BACKFILL_BUDGET = 5
+
+# Seconds a signed download link stays valid for.
+DOWNLOAD_LINK_TTL = 3600
+
+# Seconds a worker keeps its claim on a resident .hip for task routing.
+SCENE_AFFINITY_TTL = 600
+
+# Node name of the workers that only consume the interactive queue (see
+# docker/Dockerfile.celery). Only these take scene affinity routed tasks.
+INTERACTIVE_WORKER_NAME = "interactive"
+
+# Seconds a render's lifecycle timeline is kept for.
+RENDER_TRACE_TTL = 7 * 86400
+
+# Most recent render traces kept for percentile summaries.
+RENDER_TRACE_HISTORY = 1000
+
+# Upper bound on events per trace, sharded ROP renders record one set per shard.
+RENDER_TRACE_MAX_EVENTS = 256
+
+# Prefix of every metric exposed on /metrics.
+METRICS_NAMESPACE = "houdini_web"
+
+# Upper bounds, in seconds, of the latency histogram buckets (+Inf is implied).
+METRICS_LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
 ICON_ZIP_PATH = "${HFS}/houdini/config/Icons/icons.zip"
 
 DEFAULT_PARENT_CONTEXTS = ["/obj", "/out"]
@@ -52,4 +200,18 @@ BASE_DIR = "/var/model_storage"
 STATIC_FOLDER = os.path.join(BASE_DIR, 'static')
 USER_RENDER_DIR = os.path.join(STATIC_FOLDER, 'user_renders')
 USER_THUMB_DIR = os.path.join(STATIC_FOLDER, 'user_thumbnails')
+USER_MODEL_DIR = os.path.join(STATIC_FOLDER, 'user_models')
+USER_RENDER_ARCHIVE_DIR = os.path.join(STATIC_FOLDER, 'user_render_archives')
 USER_RENDER_ROUTE = os.path.join('static', 'user_renders')
+
+# Output formats which gain nothing from being deflated into a .zip.
+PRECOMPRESSED_EXTENSIONS = {".png", ".jpg", ".jpeg", ".exr", ".tif", ".tiff", ".rat", ".glb", ".zip"}
+
+# Bytes read per iteration when streaming an upload to disk while hashing it.
+UPLOAD_BUFFER_SIZE = 1024 * 1024
+
+# Size of the chunks resumable uploads are sent in.
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Seconds an idle resumable upload can be resumed for.
+UPLOAD_SESSION_TTL = 86400
@@ -1,23 +1,21 @@
 import re
 import os
 import glob
+import hashlib
 import uuid
-import time
-import zipfile
+import urllib.parse
 from nanoid import generate
 
-from app import redis_client
+from app import redis_client, constants as cnst
 from app.main import bp
-from app.api import hou_api
+from app.api import (hou_api, sequence_archive, upload_store, download_tokens, metrics,
+                     render_trace, cook_profiler, storage_gc)
 from app.constants import CURRENT_FILE_UUID
 from flask import (current_app, render_template,
                    url_for, redirect, jsonify, request,
                    session, send_from_directory, send_file)
 from werkzeug.utils import secure_filename
 
-temporary_links = {}
-
-
 @bp.route('/', methods=['GET', 'POST'])
 @bp.route('/index', methods=['GET', 'POST'])
 def index():
@@ -43,36 +41,37 @@ def generate_download_link():
             "error": "No filename was provided for download generation request."
         }), 400
 
-    download_id = str(uuid.uuid4())
-    expiry_time = time.time() + 3600
-    temporary_links[download_id] = (filename, expiry_time)
-    return jsonify(download_link=f"/download/{file_ext}/{download_id}")
+    token = download_tokens.generate_token(current_app.config["SECRET_KEY"], filename, file_ext)
+    return jsonify(download_link=f"/download/{file_ext}/{token}")
 
 
-@bp.route('/download/<ext>/<download_id>', methods=['GET'])
-def download_glb_file(ext, download_id):
+@bp.route('/download/<ext>/<token>', methods=['GET'])
+def download_glb_file(ext, token):
     if ext not in ('glb', 'hip'):
         return jsonify({
             "error": "Invalid download extension provided."
         }), 400
 
-    if download_id not in temporary_links:
+    try:
+        filename, signed_ext = download_tokens.verify_token(current_app.config["SECRET_KEY"], token)
+    except download_tokens.InvalidDownloadToken as exc:
         return jsonify({
-            "error": "Invalid download link provided."
+            "error": str(exc)
         }), 400
 
-    filename, expiry_time = temporary_links[download_id]
-    if time.time() >= expiry_time:
+    if signed_ext != ext or os.path.basename(filename) != filename:
         return jsonify({
-            "error": "Download link expired!"
+            "error": "Invalid download link provided."
         }), 400
 
     if ext == "glb":
         mimetype = 'model/gltf-binary'
         directory_path = f"{current_app.config['STATIC_FOLDER']}/{current_app.config['MODEL_DIR']}"
+        accel_route = current_app.config['MODEL_ACCEL_ROUTE']
     else:
         mimetype = 'application/octet-stream'
         directory_path = current_app.config['UPLOAD_FOLDER']
+        accel_route = current_app.config['HIP_ACCEL_ROUTE']
         if 'hip' not in filename:
             # Hip UUID's are stored without file extension (.hip, .hiplc, .hipnc)
             # Retrieve the file extension based on the redis entry.
@@ -80,19 +79,24 @@ def download_glb_file(ext, download_id):
             if original_name:
                 filename += os.path.splitext(original_name)[1]
 
-    if os.path.exists(os.path.join(directory_path, filename)):
-        return send_from_directory(directory_path,
-                                   filename,
-                                   download_name=generate_download_name(filename, ext) or filename,
-                                   as_attachment=True,
-                                   mimetype=mimetype)
-
-    placeholder_path = f"{current_app.config['STATIC_FOLDER']}/{current_app.config['PLACEHOLDER_DIR']}"
-    if os.path.exists(os.path.join(placeholder_path, filename)):
-        return send_from_directory(placeholder_path,
+    file_path = os.path.join(directory_path, filename)
+    if os.path.exists(file_path):
+        if ext == "glb":
+            storage_gc.touch_render(filename)
+        else:
+            storage_gc.touch_hip(os.path.splitext(filename)[0])
+        return send_protected_file(file_path,
+                                   accel_route,
+                                   generate_download_name(filename, ext) or filename,
+                                   mimetype)
+
+    placeholder_path = os.path.join(current_app.config['STATIC_FOLDER'],
+                                    current_app.config['PLACEHOLDER_DIR'], filename)
+    if os.path.exists(placeholder_path):
+        return send_protected_file(placeholder_path,
+                                   current_app.config['PLACEHOLDER_ACCEL_ROUTE'],
                                    filename,
-                                   as_attachment=True,
-                                   mimetype=mimetype)
+                                   mimetype)
 
     return jsonify({
         "error": "File does not exist!"
@@ -144,16 +148,21 @@ def download_rendered_sequence_zip():
     if not filename:
         return jsonify({"message": "No valid filename was provided to download."}), 400
 
-    file_uuid = filename.split(".")[0]
-    directory = os.path.join(current_app.config['USER_RENDER_DIR'], file_uuid)
+    render_id = secure_filename(filename.split(".")[0])
+    archive_path = sequence_archive.get_archive_path(render_id)
 
-    files = glob.glob(os.path.join(directory, '*'))
-    zip_path = os.path.join(directory, "{0}.zip".format(file_uuid))
-    with zipfile.ZipFile(zip_path, 'w') as zipf:
-        for file in files:
-            zipf.write(file, os.path.basename(file))
+    # Archives are built by the worker on completion, only renders
+    # predating that need to be zipped here.
+    if not os.path.exists(archive_path):
+        archive_path = sequence_archive.build_sequence_archive(render_id)
+        if archive_path is None:
+            return jsonify({"message": "No rendered sequence found."}), 404
 
-    return send_file(zip_path, as_attachment=True)
+    storage_gc.touch_rop(render_id)
+    return send_protected_file(archive_path,
+                               current_app.config["RENDER_ARCHIVE_ACCEL_ROUTE"],
+                               download_name=os.path.basename(archive_path),
+                               mimetype="application/zip")
 
 
 @bp.route("/get_file_uuid_from_nano", methods=["GET"])
@@ -199,6 +208,9 @@ def get_glb_file(filename):
     if not filename.endswith(".glb"):
         return jsonify({"error": "Invalid file type requested."}), 400
 
+    # Shared links resolve here, which keeps shared models from being evicted.
+    storage_gc.touch_render(filename)
+
     # If not using nginx, call `send_file` with flask to send the .glb
 
     # Redirect the requst to nginx.
@@ -211,22 +223,98 @@ def get_glb_file(filename):
 def graph_data():
     """Process the .hip file and return a dictionary for CytoscapeJS.
 
+    Children of the context can be paged through with `cursor` and `limit`,
+    following the returned `next_cursor`. Cookability is derived from node
+    types and flags only, `lazy_cook=true` skips it entirely. Geometry
+    validation is deferred to `/node_cookable`. Nodes cooked by a profiled
+    render carry their cook time (ms), cook count and memory.
+
     :returns: Dictionary to populate CytoscapeJS nodes and poppers.
     :rtype: dict
     """
     file_uuid = request.args.get('uuid')
     parent_node = request.args.get('name')
+    cursor = request.args.get('cursor', 0, type=int)
+    limit = request.args.get('limit', None, type=int)
+    lazy_cook = request.args.get('lazy_cook') == 'true'
 
     if not file_uuid:
         return jsonify({"error": "A file UUID is required."}), 400
 
-    # Avoid calling hou.hipFile.load if we've already loaded.
-    if file_uuid == session.get(CURRENT_FILE_UUID, None):
-        node_data = hou_api.scan_and_display_nodes(parent_node, load=False)
-        return jsonify(node_data), 200
+    if cursor < 0 or (limit is not None and limit < 1):
+        return jsonify({"error": "Invalid cursor or page limit."}), 400
+
+    hip_file, error_response = locate_hip_file(file_uuid)
+    if error_response is not None:
+        return error_response
+
+    # Opening a graph counts as using the .hip, paging through it doesn't.
+    if cursor == 0:
+        storage_gc.touch_hip(file_uuid)
+
+    # Uploaded .hip files are immutable per UUID, so an unchanged file and
+    # query can be answered without loading or scanning the scene. Newly
+    # profiled cook times change the version and invalidate the graph.
+    hip_key = cook_profiler.get_hip_key(file_uuid)
+    cook_stats_version = redis_client.get_cook_stats_version(hip_key)
+    etag = generate_graph_etag(hip_file, request.query_string, cook_stats_version)
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    node_data = hou_api.scan_and_display_nodes(parent_node,
+                                               hip_file=hip_file,
+                                               cursor=cursor,
+                                               limit=limit,
+                                               lazy_cook=lazy_cook,
+                                               hip_key=hip_key)
+    if node_data is None:
+        return jsonify({"error": "Invalid node context: {0}".format(parent_node)}), 400
+
+    # Store the current file UUID for later use when storing render data in redis.
+    session[CURRENT_FILE_UUID] = file_uuid
+
+    # Store UUID for socketIO room.
+    if "session_id" not in session:
+        session["session_id"] = str(uuid.uuid4())
+    node_data["session_id"] = session["session_id"]
+
+    response = jsonify(node_data)
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response, 200
+
 
-    # Locate the file on disk. Search for UUID prefix.
-    # Handles searching for .hip, .hiplc, and .hipnc files.
+@bp.route("/node_cookable", methods=['GET'])
+def node_cookable():
+    """Validate a single node's render geometry on demand.
+
+    The graph itself only performs static checks, this endpoint cooks.
+    """
+    file_uuid = request.args.get('uuid')
+    node_path = request.args.get('path')
+    if not file_uuid or not node_path:
+        return jsonify({"error": "A file UUID and node path are required."}), 400
+
+    hip_file, error_response = locate_hip_file(file_uuid)
+    if error_response is not None:
+        return error_response
+
+    can_cook = hou_api.evaluate_node_cookable(node_path, hip_file, file_uuid)
+    if can_cook is None:
+        return jsonify({"error": "Invalid node path: {0}".format(node_path)}), 400
+
+    return jsonify({"path": node_path, "can_cook": list(can_cook)}), 200
+
+
+def locate_hip_file(file_uuid):
+    """Locate the uploaded file on disk by searching for the UUID prefix.
+
+    Handles searching for .hip, .hiplc, and .hipnc files.
+
+    :returns: Tuple of the hip path and an error response, one of which is None.
+    """
     search_pattern = os.path.join(current_app.config['UPLOAD_FOLDER'],
                                   "{0}.hip*".format(file_uuid))
 
@@ -236,23 +324,33 @@ def graph_data():
             # Make an exception if we're attempting to load placeholder.hip
             matching_files = [current_app.config["PLACEHOLDER_HIP_PATH"]]
         else:
-            return jsonify({"error": "No matching files with provided UUID."}), 400
+            return None, (jsonify({"error": "No matching files with provided UUID."}), 400)
 
     if len(matching_files) > 1:
         # Potentially indicates need for cleanup or strange collision issue.
-        return jsonify({"error": "Multiple files found."}), 500
+        return None, (jsonify({"error": "Multiple files found."}), 500)
 
-    hip_file = matching_files[0]
-    node_data = hou_api.scan_and_display_nodes(parent_node, hip_file=hip_file)
+    return matching_files[0], None
 
-    # Store the current file UUID for later use when storing render data in redis.
-    session[CURRENT_FILE_UUID] = file_uuid
 
-    # Store UUID for socketIO room.
-    if "session_id" not in session:
-        session["session_id"] = str(uuid.uuid4())
-    node_data["session_id"] = session["session_id"]
-    return jsonify(node_data), 200
+def generate_graph_etag(hip_file, query_string, cook_stats_version=0):
+    hip_stat = os.stat(hip_file)
+    etag_source = "{0}:{1}:{2}:{3}".format(hip_file, hip_stat.st_mtime_ns,
+                                           query_string.decode("utf-8"), cook_stats_version)
+    return hashlib.sha1(etag_source.encode("utf-8")).hexdigest()
+
+
+@bp.route("/node_icon/<path:icon_path>", methods=['GET'])
+def get_node_icon(icon_path):
+    icon_content = hou_api.get_icon_content(icon_path)
+    if icon_content is None:
+        return jsonify({"error": "Icon does not exist!"}), 404
+
+    response = current_app.response_class(icon_content, mimetype="image/svg+xml")
+    # Icons only change with the Houdini install, let the browser hold onto them.
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+    return response
 
 
 # Serve the base html structure.
@@ -280,37 +378,107 @@ def handle_upload():
 
     if hip_file and allowed_hip(hip_file.filename):
         sanitized_filename = secure_filename(hip_file.filename)
-        _, ext = os.path.splitext(sanitized_filename)
-        file_uuid = str(uuid.uuid4())
-        filename = "{0}{1}".format(file_uuid, ext)
+        upload_folder = current_app.config['UPLOAD_FOLDER']
 
-        if 'uploaded_files' not in session:
-            session['uploaded_files'] = []
+        # Hash while writing, the upload is only read once.
+        temp_path, file_hash = upload_store.stream_to_temp_file(hip_file.stream, upload_folder)
+        file_uuid = upload_store.persist_upload(session["user_uuid"], sanitized_filename,
+                                                temp_path, file_hash, upload_folder)
+        return upload_response(file_uuid, sanitized_filename)
+    else:
+        return jsonify({"message": "File type not allowed"}), 400
 
-        session['uploaded_files'].append(file_uuid)
 
-        # Store user's uploaded .hip file name in redis instance.
-        is_unique_hip, file_hash = redis_client.add_unique_filename(
-            session["user_uuid"], sanitized_filename, file_uuid, hip_file)
+@bp.route("/hip_upload/sessions", methods=['POST'])
+def create_upload_session():
+    """Start a resumable upload. Large .hip files are sent as a sequence of
+    short chunk requests rather than one long request per file.
+    """
+    upload_data = request.get_json(silent=True) or {}
+    filename = upload_data.get("filename")
+    total_size = upload_data.get("size")
 
-        if is_unique_hip:
-            file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-            hip_file.save(file_path)
-        else:
-            # File has already been saved for the user. Find that and return the file uuid.
-            file_uuid = redis_client.retrieve_uuid_from_filename(session["user_uuid"], file_hash)
+    if not filename or not allowed_hip(filename):
+        return jsonify({"message": "File type not allowed"}), 400
+    if not isinstance(total_size, int) or total_size <= 0:
+        return jsonify({"message": "Invalid upload size."}), 400
+    if total_size > current_app.config['MAX_UPLOAD_SIZE']:
+        return jsonify({"message": "File exceeds the upload size limit."}), 413
+
+    upload_id = upload_store.create_session(session["user_uuid"],
+                                            secure_filename(filename),
+                                            total_size,
+                                            current_app.config['UPLOAD_FOLDER'],
+                                            current_app.config['MAX_UPLOAD_SESSIONS'])
+    if upload_id is None:
+        return jsonify({"message": "Too many uploads in progress."}), 429
+    return jsonify({
+        "uploadId": upload_id,
+        "offset": 0,
+        "chunkSize": cnst.UPLOAD_CHUNK_SIZE
+    }), 201
+
+
+@bp.route("/hip_upload/sessions/<upload_id>", methods=['GET'])
+def get_upload_session(upload_id):
+    """Report how much of an upload has arrived, for resuming it."""
+    upload_session, error_response = locate_upload_session(upload_id)
+    if error_response:
+        return error_response
+    return jsonify({"offset": upload_session["received"],
+                    "size": upload_session["total_size"]}), 200
+
+
+@bp.route("/hip_upload/sessions/<upload_id>", methods=['PUT'])
+def upload_chunk(upload_id):
+    """Append the raw request body at `offset`. Completes the upload once
+    every byte has arrived.
+    """
+    upload_session, error_response = locate_upload_session(upload_id)
+    if error_response:
+        return error_response
 
-            # This can be None if the file never rendered anything, but had an entry made.
-            if file_uuid is None:
-                return jsonify({"message": "File hash matched, but unable to retrieve file."}), 400
-            print("Located existing file with matching hash for: {0}".format(sanitized_filename))
+    offset = request.args.get("offset", type=int)
+    if offset is None:
+        return jsonify({"message": "Missing chunk offset."}), 400
 
-        return jsonify({
-            "uuid": file_uuid,
-            "message": "File upload successful."
-        }), 200
-    else:
-        return jsonify({"message": "File type not allowed"}), 400
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    try:
+        received = upload_store.append_chunk(upload_id, upload_session, offset,
+                                             request.stream, upload_folder)
+    except upload_store.UploadOffsetMismatch as exc:
+        return jsonify({"message": str(exc), "offset": exc.expected_offset}), 409
+
+    if received < upload_session["total_size"]:
+        return jsonify({"offset": received}), 200
+
+    file_uuid = upload_store.finish_session(upload_id, upload_session, upload_folder)
+    return upload_response(file_uuid, upload_session["filename"])
+
+
+def locate_upload_session(upload_id):
+    upload_session = redis_client.get_upload_session(upload_id)
+    if upload_session is None:
+        return None, (jsonify({"message": "Unknown or expired upload."}), 404)
+    if upload_session["user_uuid"] != session.get("user_uuid"):
+        return None, (jsonify({"message": "Upload belongs to another user."}), 403)
+    return upload_session, None
+
+
+def upload_response(file_uuid, filename):
+    # This can be None if the file never rendered anything, but had an entry made.
+    if file_uuid is None:
+        return jsonify({"message": "File hash matched, but unable to retrieve file."}), 400
+
+    if 'uploaded_files' not in session:
+        session['uploaded_files'] = []
+    session['uploaded_files'].append(file_uuid)
+
+    print("Stored upload {0} as: {1}".format(filename, file_uuid))
+    return jsonify({
+        "uuid": file_uuid,
+        "message": "File upload successful."
+    }), 200
 
 
 @bp.route('/get_stored_models', methods=['GET'])
@@ -319,11 +487,19 @@ def retrieve_stored_models():
     if not user_uuid:
         return jsonify({"message": "Invalid request. Specify a user_uuid."}), 400
 
-    stored_model_data = redis_client.get_user_uploaded_file_dicts(user_uuid)
+    offset = request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', None, type=int)
+    if offset < 0 or (limit is not None and limit < 1):
+        return jsonify({"message": "Invalid offset or page limit."}), 400
+
+    stored_model_data, total = redis_client.get_user_uploaded_file_dicts(user_uuid,
+                                                                          offset=offset,
+                                                                          limit=limit)
     if stored_model_data:
-        return jsonify({'model_data': stored_model_data}), 200
+        return jsonify({'model_data': stored_model_data, 'total': total}), 200
     else:
-        return jsonify({"message": "Empty model data! No associated user renders."}), 200
+        return jsonify({"message": "Empty model data! No associated user renders.",
+                        'total': total}), 200
 
 
 @bp.route('/get_hip_name_from_nano_id', methods=['GET'])
@@ -346,6 +522,58 @@ def hip_file_name_from_nanoid():
     return jsonify({"message": "Invalid filename. No linked hip file found."}), 400
 
 
+@bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Render pipeline and request metrics in the Prometheus text format,
+    aggregated across every web and Celery worker.
+    """
+    return current_app.response_class(metrics.generate_latest(),
+                                      mimetype="text/plain; version=0.0.4")
+
+
+@bp.route('/render_traces', methods=['GET'])
+def get_render_trace_summary():
+    """Per-stage duration percentiles across the most recent renders."""
+    limit = request.args.get('limit', cnst.RENDER_TRACE_HISTORY, type=int)
+    if limit < 1 or limit > cnst.RENDER_TRACE_HISTORY:
+        return jsonify({"error": "Limit must be between 1 and "
+                                 "{0}.".format(cnst.RENDER_TRACE_HISTORY)}), 400
+
+    return jsonify(render_trace.summarize_recent(limit)), 200
+
+
+@bp.route('/render_traces/<trace_id>', methods=['GET'])
+def get_render_trace(trace_id):
+    """Timestamped lifecycle events of a single render, see `render_trace`."""
+    if not render_trace.is_valid_trace_id(trace_id):
+        return jsonify({"error": "Invalid trace id."}), 400
+
+    timeline = render_trace.get_timeline(trace_id)
+    if timeline is None:
+        return jsonify({"error": "No trace found for {0}.".format(trace_id)}), 404
+
+    return jsonify(timeline), 200
+
+
+def send_protected_file(file_path, accel_route, download_name, mimetype):
+    """Hand the file transfer off to nginx through X-Accel-Redirect.
+
+    nginx then serves the file with Range/resume support without tying up
+    a worker. Falls back to streaming through Flask when not behind nginx.
+    """
+    if not current_app.config["USE_X_ACCEL_REDIRECT"]:
+        return send_file(file_path,
+                         as_attachment=True,
+                         download_name=download_name,
+                         mimetype=mimetype,
+                         conditional=True)
+
+    response = current_app.response_class(mimetype=mimetype)
+    response.headers["X-Accel-Redirect"] = accel_route + urllib.parse.quote(os.path.basename(file_path))
+    response.headers.set("Content-Disposition", "attachment", filename=download_name)
+    return response
+
+
 def allowed_hip(filename):
     _, ext = os.path.splitext(filename)
     return ext.lower() in current_app.config["ALLOWED_EXTENSIONS"]
@@ -1,7 +1,8 @@
 import datetime
 import functools
-import hashlib
+import json
 import os
+import time
 import redis
 
 import app.constants as cnst
@@ -11,24 +12,190 @@ class RedisClient:
     """Singleton implementation of the redis client to ensure we
     avoid creating unnecessary connections.
 
+    Connections come from a blocking pool sized for the process type, set
+    through REDIS_PROCESS_TYPE. Eventlet web workers multiplex many
+    greenlets over one process, Celery workers only need a handful.
     """
 
     _client_instance = None
+    _scripts = {}
 
     @classmethod
     def get_client_instance(cls):
         if cls._client_instance is None:
             redis_host = os.getenv('REDIS_HOST', 'redis')
             redis_port = os.getenv('REDIS_PORT', 6379)
-            cls._client_instance = redis.Redis(host=redis_host,
-                                               port=redis_port,
-                                               db=0)
+            connection_pool = redis.BlockingConnectionPool(host=redis_host,
+                                                           port=redis_port,
+                                                           db=0,
+                                                           max_connections=get_pool_size(),
+                                                           timeout=cnst.REDIS_POOL_TIMEOUT)
+            cls._client_instance = redis.Redis(connection_pool=connection_pool)
 
             # Flush the DB for testing purposes.
             # cls._client_instance.flushdb()
 
         return cls._client_instance
 
+    @classmethod
+    def get_script(cls, name):
+        if name not in cls._scripts:
+            cls._scripts[name] = cls.get_client_instance().register_script(_LUA_SCRIPTS[name])
+        return cls._scripts[name]
+
+
+def get_pool_size():
+    pool_size = os.getenv('REDIS_POOL_SIZE')
+    if pool_size:
+        return int(pool_size)
+
+    process_type = os.getenv('REDIS_PROCESS_TYPE', 'web')
+    return cnst.REDIS_POOL_SIZES.get(process_type, cnst.REDIS_POOL_SIZES['web'])
+
+
+# Registers an upload in a single atomic round-trip. The hash set membership
+# test and the metadata writes can't interleave with a concurrent upload.
+_ADD_UNIQUE_FILENAME_SCRIPT = """
+if redis.call('SADD', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[3])
+redis.call('HSET', KEYS[3], 'original_filename', ARGV[2], 'upload_time', ARGV[4], 'file_hash', ARGV[1],
+           'user_uuid', ARGV[5])
+if redis.call('SADD', KEYS[4], ARGV[3]) == 1 then
+    redis.call('RPUSH', KEYS[5], ARGV[3])
+end
+redis.call('ZADD', KEYS[6], ARGV[6], ARGV[3])
+return 1
+"""
+
+# Points a node's render at a new output and references it from the .hip.
+# The output it replaces loses that reference and is queued for the storage
+# collector, which deletes it once nothing else (e.g. the render cache) uses it.
+_STORE_RENDER_DATA_SCRIPT = """
+local previous = redis.call('HGET', KEYS[1], ARGV[1])
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('SET', KEYS[2], ARGV[3])
+redis.call('SADD', KEYS[3], ARGV[3])
+if previous and previous ~= ARGV[2] then
+    redis.call('SREM', ARGV[4] .. previous, ARGV[3])
+    redis.call('ZADD', KEYS[4], ARGV[5], previous)
+end
+if #KEYS > 4 then
+    redis.call('HSET', KEYS[5], ARGV[1], ARGV[6])
+    redis.call('HSET', KEYS[6], ARGV[1], ARGV[7])
+end
+return 1
+"""
+
+# Fair-share queues keep one job list per user and a sorted set of users
+# scored by how many jobs they've been served. A user joining the queue
+# starts level with the least served user, so nobody is owed a backlog.
+_ENQUEUE_FAIR_SHARE_JOB_SCRIPT = """
+redis.call('RPUSH', KEYS[2], ARGV[2])
+if not redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+    local least_served = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    local score = least_served[2] or 0
+    redis.call('ZADD', KEYS[1], score, ARGV[1])
+end
+return 1
+"""
+
+_POP_FAIR_SHARE_JOB_SCRIPT = """
+local user_key = false
+local job = false
+if #ARGV > 1 then
+    -- Prefer the job of the .hip this dispatch was routed for, if still queued.
+    for _, queued in ipairs(redis.call('LRANGE', ARGV[1] .. ARGV[2], 0, -1)) do
+        if cjson.decode(queued)['file_uuid'] == ARGV[3] then
+            user_key = ARGV[2]
+            job = queued
+            redis.call('LREM', ARGV[1] .. user_key, 1, job)
+            break
+        end
+    end
+end
+if not job then
+    local least_served = redis.call('ZRANGE', KEYS[1], 0, 0)
+    if #least_served == 0 then
+        return false
+    end
+    user_key = least_served[1]
+    job = redis.call('LPOP', ARGV[1] .. user_key)
+end
+local jobs_key = ARGV[1] .. user_key
+if redis.call('LLEN', jobs_key) == 0 then
+    redis.call('ZREM', KEYS[1], user_key)
+else
+    redis.call('ZINCRBY', KEYS[1], 1, user_key)
+end
+return job
+"""
+
+# Publishes a render event for delivery. Events with a history key are also
+# appended to it first, so the delivered copy carries its replayable ID.
+_PUBLISH_RENDER_EVENT_SCRIPT = """
+local event_id = ''
+if #KEYS > 1 then
+    event_id = redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[5], '*',
+                          'event', ARGV[1], 'data', ARGV[2])
+    redis.call('EXPIRE', KEYS[2], ARGV[6])
+end
+redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[4], '*',
+           'event', ARGV[1], 'data', ARGV[2], 'socket_id', ARGV[3], 'event_id', event_id)
+return event_id
+"""
+
+# Opens an upload session unless its user already has ARGV[2] of them open.
+# The user's set of sessions drops those which expired before finishing.
+_CREATE_UPLOAD_SESSION_SCRIPT = """
+for _, upload_id in ipairs(redis.call('SMEMBERS', KEYS[2])) do
+    if redis.call('EXISTS', ARGV[1] .. upload_id) == 0 then
+        redis.call('SREM', KEYS[2], upload_id)
+    end
+end
+if redis.call('SCARD', KEYS[2]) >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'user_uuid', ARGV[5], 'filename', ARGV[6],
+           'total_size', ARGV[7], 'received', 0)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('SADD', KEYS[2], ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+return 1
+"""
+
+# Drops a render cache entry along with its filename index and LRU member,
+# taking its outputs' sizes off the cache total. Only the call that deletes
+# the entry decrements, so concurrent drops can't count an entry twice.
+_DROP_RENDER_CACHE_ENTRY_SCRIPT = """
+redis.call('ZREM', KEYS[3], ARGV[1])
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+local entry_size = 0
+for i = 2, #ARGV do
+    local filename = redis.call('HGET', KEYS[1], ARGV[i])
+    if filename then
+        redis.call('HDEL', KEYS[2], filename)
+    end
+    entry_size = entry_size + tonumber(redis.call('HGET', KEYS[1], ARGV[i] .. '_size') or 0)
+end
+redis.call('DEL', KEYS[1])
+redis.call('DECRBY', KEYS[4], entry_size)
+return 1
+"""
+
+_LUA_SCRIPTS = {
+    "add_unique_filename": _ADD_UNIQUE_FILENAME_SCRIPT,
+    "store_render_data": _STORE_RENDER_DATA_SCRIPT,
+    "enqueue_fair_share_job": _ENQUEUE_FAIR_SHARE_JOB_SCRIPT,
+    "pop_fair_share_job": _POP_FAIR_SHARE_JOB_SCRIPT,
+    "publish_render_event": _PUBLISH_RENDER_EVENT_SCRIPT,
+    "create_upload_session": _CREATE_UPLOAD_SESSION_SCRIPT,
+    "drop_render_cache_entry": _DROP_RENDER_CACHE_ENTRY_SCRIPT,
+}
+
 
 def with_redis_conn(func):
     @functools.wraps(func)
@@ -43,22 +210,6 @@ def get_client_instance():
     return RedisClient.get_client_instance()
 
 
-def get_file_hash(hip_file, buffer_size=16384):
-    """Hash the contents of a FileStorage object with a given buffer size."""
-    sha256 = hashlib.sha256()
-    hip_file.seek(0)
-
-    while True:
-        data = hip_file.read(buffer_size)
-        if not data:
-            break
-        sha256.update(data)
-
-    hip_file.seek(0)
-    hex_digest = sha256.hexdigest()
-    return hex_digest
-
-
 @with_redis_conn
 def has_generated_nanoid(redis_conn, file_uuid):
     stored_nanoid = redis_conn.hget("global:uuid_to_nanoid", file_uuid)
@@ -81,6 +232,12 @@ def get_hip_name_from_uuid(redis_conn, hip_filename):
     if original_filename is not None:
         return original_filename.decode('utf-8')
 
+@with_redis_conn
+def get_file_hash_from_uuid(redis_conn, hip_filename):
+    file_hash = redis_conn.hget(f"file_meta:{hip_filename}", "file_hash")
+    if file_hash is not None:
+        return file_hash.decode('utf-8')
+
 @with_redis_conn
 def get_filename_for_nanoid(redis_conn, nano_id):
     stored_filename = redis_conn.hget("global:nanoid_to_uuid", nano_id)
@@ -90,46 +247,41 @@ def get_filename_for_nanoid(redis_conn, nano_id):
 @with_redis_conn
 def add_shareable_mapping(redis_conn, file_nanoid, file_uuid):
     if not redis_conn.sismember("global:shareable_files", file_nanoid):
-        redis_conn.hset(f"global:nanoid_to_uuid", file_nanoid, file_uuid)
-        redis_conn.hset(f"global:uuid_to_nanoid", file_uuid, file_nanoid)
+        pipe = redis_conn.pipeline()
+        pipe.hset(f"global:nanoid_to_uuid", file_nanoid, file_uuid)
+        pipe.hset(f"global:uuid_to_nanoid", file_uuid, file_nanoid)
+        pipe.execute()
 
 
-@with_redis_conn
-def add_unique_filename(redis_conn, user_uuid, original_filename, file_uuid, hip_file):
-    """
+def add_unique_filename(user_uuid, original_filename, file_uuid, file_hash):
+    """Register an uploaded .hip for the user, unless its contents were seen before.
 
+    :param file_hash: SHA-256 hex digest of the upload, computed while it was stored.
+    :returns: Whether the file was unique.
+    :rtype: bool
     """
-    file_hash = get_file_hash(hip_file)
-
-    if not redis_conn.sismember("global:file_hashes", file_hash):
-        upload_time = datetime.datetime.utcnow()
+    upload_time = datetime.datetime.utcnow()
 
-        # Store the hash for set membership checks.
-        redis_conn.sadd("global:file_hashes", file_hash)
+    add_script = RedisClient.get_script("add_unique_filename")
+    added = add_script(keys=["global:file_hashes",
+                             f"user:{user_uuid}:hash_to_uuid",
+                             f"file_meta:{file_uuid}",
+                             f"user:{user_uuid}:filenames_set",
+                             f"user:{user_uuid}:filenames_list",
+                             f"storage:access:{cnst.StorageKinds.hip}"],
+                       args=[file_hash, original_filename, file_uuid, upload_time.isoformat(),
+                             user_uuid, time.time()])
 
-        # Store the hash as a key for reverse file uuid lookup.
-        redis_conn.hset(f"user:{user_uuid}:hash_to_uuid", file_hash, file_uuid)
-
-        # Store the original .hip file name against the generated file UUID.
-        redis_conn.hset(f"file_meta:{file_uuid}", "original_filename", original_filename)
-        redis_conn.hset(f"file_meta:{file_uuid}", "upload_time", upload_time.isoformat())
-
-        # Maintain separate set structure for user to test for uniqueness.
-        added = redis_conn.sadd(f"user:{user_uuid}:filenames_set", file_uuid)
-
-        # Add to list to ensure order is maintained.
-        if added == 1:
-            redis_conn.rpush(f"user:{user_uuid}:filenames_list", file_uuid)
-        return True, file_hash
-    else:
+    if not added:
         print("File already exists: {0}:{1}".format(original_filename, file_hash))
-        return False, file_hash
+    return bool(added)
 
 
 @with_redis_conn
 def retrieve_uuid_from_filename(redis_conn, user_uuid, file_hash):
     byte_file_hash = redis_conn.hget(f"user:{user_uuid}:hash_to_uuid", file_hash)
-    return byte_file_hash.decode("utf-8")
+    if byte_file_hash is not None:
+        return byte_file_hash.decode("utf-8")
 
 @with_redis_conn
 def retrieve_hip_uuid_from_filename(redis_conn, filename):
@@ -139,55 +291,85 @@ def retrieve_hip_uuid_from_filename(redis_conn, filename):
 
 @with_redis_conn
 def add_placeholder_mapping(redis_conn, filename):
-    redis_conn.set(f"filename_to_uuid:{filename}", "placeholder")
-    redis_conn.hset(f"file_meta:placeholder", "original_filename", "placeholder.hiplc")
-
+    pipe = redis_conn.pipeline()
+    pipe.set(f"filename_to_uuid:{filename}", "placeholder")
+    pipe.hset(f"file_meta:placeholder", "original_filename", "placeholder.hiplc")
+    pipe.execute()
 
-@with_redis_conn
-def store_render_data(redis_conn, render_type, hip_file_uuid, filename, node_path, frame_range):
-    redis_conn.hset(f"file_render_data:{hip_file_uuid}:{render_type}", node_path, filename)
 
-    # Store mapping of filename back to the hip file that generated it.
-    redis_conn.set(f"filename_to_uuid:{filename}", hip_file_uuid)
+def store_render_data(render_type, hip_file_uuid, filename, node_path, frame_range):
+    # Also stores the mapping of filename back to the hip file that generated it.
+    keys = [f"file_render_data:{hip_file_uuid}:{render_type}",
+            f"filename_to_uuid:{filename}",
+            f"render_refs:{filename}",
+            "storage:orphan_candidates"]
+    args = [node_path, filename, hip_file_uuid, "render_refs:", time.time()]
 
     # Store latest render time for GLB file exports.
     if render_type == cnst.BackgroundRenderType.glb_file:
         render_time = datetime.datetime.utcnow()
-        redis_conn.hset(f"file_render_data:{hip_file_uuid}:render_time", node_path, render_time.isoformat())
-        redis_conn.hset(f"file_render_data:{hip_file_uuid}:frame_range", node_path, frame_range)
+        keys += [f"file_render_data:{hip_file_uuid}:render_time",
+                 f"file_render_data:{hip_file_uuid}:frame_range"]
+        args += [render_time.isoformat(), frame_range]
+
+    store_script = RedisClient.get_script("store_render_data")
+    store_script(keys=keys, args=args)
 
 
 @with_redis_conn
-def get_user_uploaded_file_dicts(redis_conn, user_uuid):
+def get_user_uploaded_file_dicts(redis_conn, user_uuid, offset=0, limit=None):
+    """Retrieve a page of the user's uploads, newest first, with their render data.
+
+    The lookup takes two pipelined round-trips regardless of library size.
+
+    :returns: Tuple of the page of file dicts and the user's total upload count.
+    :rtype: tuple(list, int)
+    """
+    list_key = f"user:{user_uuid}:filenames_list"
+
+    # Uploads are appended, so index from the tail to page newest first.
+    stop = -(offset + limit) if limit is not None else 0
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.llen(list_key)
+    pipe.lrange(list_key, stop, -(offset + 1))
+    total, uploaded_files = pipe.execute()
+
+    file_uuids = [uploaded_file.decode("utf-8") for uploaded_file in reversed(uploaded_files)]
+    if not file_uuids:
+        return [], total
+
+    render_keys = [
+        cnst.BackgroundRenderType.glb_file,
+        cnst.BackgroundRenderType.thumbnail,
+        'render_time',
+        'frame_range'
+    ]
+
+    pipe = redis_conn.pipeline(transaction=False)
+    for file_uuid in file_uuids:
+        pipe.hmget(f"file_meta:{file_uuid}", "original_filename", "upload_time")
+        for key in render_keys:
+            pipe.hgetall(f"file_render_data:{file_uuid}:{key}")
+    results = iter(pipe.execute())
+
     file_info_list = []
-    uploaded_files = redis_conn.lrange(f"user:{user_uuid}:filenames_list", 0, -1)
-    if uploaded_files:
-        for uploaded_file in uploaded_files:
-            file_uuid = uploaded_file.decode("utf-8")
-            original_filename = redis_conn.hget(f"file_meta:{file_uuid}", "original_filename")
-            if original_filename is not None:
-                file_info_list.append({
-                    "original_filename": original_filename.decode("utf-8"),
-                    "file_uuid": file_uuid,
-                    "upload_date": get_file_upload_time(file_uuid),
-                })
-
-    if file_info_list:
-        for file_dict in file_info_list:
-            file_uuid = file_dict["file_uuid"]
-            render_keys = [
-                cnst.BackgroundRenderType.glb_file,
-                cnst.BackgroundRenderType.thumbnail,
-                'render_time',
-                'frame_range'
-            ]
-
-            for key in render_keys:
-                data = redis_conn.hgetall(f"file_render_data:{file_uuid}:{key}")
-                if data:
-                    file_dict[key] = decode_redis_hash(data)
-
-    return file_info_list
+    for file_uuid in file_uuids:
+        original_filename, upload_time = next(results)
+        render_data = [next(results) for _ in render_keys]
+        if original_filename is None:
+            continue
+
+        file_dict = {
+            "original_filename": original_filename.decode("utf-8"),
+            "file_uuid": file_uuid,
+            "upload_date": upload_time.decode("utf-8") if upload_time else "",
+        }
+        for key, data in zip(render_keys, render_data):
+            if data:
+                file_dict[key] = decode_redis_hash(data)
+        file_info_list.append(file_dict)
+
+    return file_info_list, total
 
 
 def decode_redis_hash(redis_hash):
@@ -203,6 +385,670 @@ def get_file_upload_time(redis_conn, file_uuid):
     return ""
 
 
+@with_redis_conn
+def get_cached_cookability(redis_conn, hip_hash, node_path):
+    cached_result = redis_conn.hget(f"cookable:{hip_hash}", node_path)
+    if cached_result is not None:
+        return tuple(json.loads(cached_result))
+
+
+@with_redis_conn
+def store_cookability(redis_conn, hip_hash, node_path, can_cook):
+    redis_conn.hset(f"cookable:{hip_hash}", node_path, json.dumps(list(can_cook)))
+
+
+@with_redis_conn
+def get_cached_bbox(redis_conn, hip_hash, node_path, frame):
+    cached_bbox = redis_conn.hget(f"bbox:{hip_hash}", f"{node_path}@{frame}")
+    if cached_bbox is not None:
+        bbox_min, bbox_max = json.loads(cached_bbox)
+        return tuple(bbox_min), tuple(bbox_max)
+
+
+@with_redis_conn
+def store_bbox(redis_conn, hip_hash, node_path, frame, bbox):
+    redis_conn.hset(f"bbox:{hip_hash}", f"{node_path}@{frame}",
+                    json.dumps([list(bbox[0]), list(bbox[1])]))
+
+
+@with_redis_conn
+def store_cook_stats(redis_conn, hip_key, node_stats):
+    """Store the latest profiled cook stats per node of the .hip and bump
+    its version, which invalidates cached node graphs.
+    """
+    pipe = redis_conn.pipeline()
+    pipe.hset(f"cook_stats:{hip_key}", mapping={node_path: json.dumps(node_entry)
+                                                for node_path, node_entry in node_stats.items()})
+    pipe.incr(f"cook_stats_version:{hip_key}")
+    pipe.execute()
+
+
+@with_redis_conn
+def get_cook_stats(redis_conn, hip_key):
+    """:returns: Dict of node path to its stored cook stats, for every
+        profiled node of the .hip.
+    """
+    return {node_path: json.loads(value)
+            for node_path, value in decode_redis_hash(redis_conn.hgetall(f"cook_stats:{hip_key}")).items()}
+
+
+@with_redis_conn
+def get_cook_stats_version(redis_conn, hip_key):
+    version = redis_conn.get(f"cook_stats_version:{hip_key}")
+    return int(version) if version is not None else 0
+
+
+def create_upload_session(upload_id, user_uuid, filename, total_size, max_sessions):
+    """:returns: Whether the session was created, False if `user_uuid`
+        already has `max_sessions` uploads open.
+    """
+    create_script = RedisClient.get_script("create_upload_session")
+    return bool(create_script(keys=[f"upload_session:{upload_id}", f"user:{user_uuid}:upload_sessions"],
+                              args=["upload_session:", max_sessions, upload_id,
+                                    cnst.UPLOAD_SESSION_TTL, user_uuid, filename, total_size]))
+
+
+@with_redis_conn
+def get_upload_session(redis_conn, upload_id):
+    session_data = decode_redis_hash(redis_conn.hgetall(f"upload_session:{upload_id}"))
+    if not session_data:
+        return None
+    session_data["total_size"] = int(session_data["total_size"])
+    session_data["received"] = int(session_data["received"])
+    return session_data
+
+
+@with_redis_conn
+def advance_upload_session(redis_conn, upload_id, received):
+    key = f"upload_session:{upload_id}"
+    pipe = redis_conn.pipeline()
+    pipe.hset(key, "received", received)
+    pipe.expire(key, cnst.UPLOAD_SESSION_TTL)
+    pipe.execute()
+
+
+@with_redis_conn
+def delete_upload_session(redis_conn, upload_id, user_uuid):
+    pipe = redis_conn.pipeline()
+    pipe.delete(f"upload_session:{upload_id}")
+    pipe.srem(f"user:{user_uuid}:upload_sessions", upload_id)
+    pipe.execute()
+
+
+def enqueue_fair_share_job(queue, user_key, job):
+    enqueue_script = RedisClient.get_script("enqueue_fair_share_job")
+    enqueue_script(keys=[f"fair_share:{queue}:users", f"fair_share:{queue}:jobs:{user_key}"],
+                   args=[user_key, json.dumps(job)])
+
+
+def pop_fair_share_job(queue, user_key=None, file_uuid=None):
+    """Pop the next job from the least served user of `queue`.
+
+    If `user_key` still has a job queued for `file_uuid`, that job is
+    popped instead and charged to `user_key` as usual.
+    """
+    pop_script = RedisClient.get_script("pop_fair_share_job")
+    args = [f"fair_share:{queue}:jobs:"]
+    if user_key is not None and file_uuid is not None:
+        args += [user_key, file_uuid]
+    job = pop_script(keys=[f"fair_share:{queue}:users"], args=args)
+    if job is not None:
+        return json.loads(job)
+
+
+@with_redis_conn
+def register_rop_shards(redis_conn, render_id, shard_frame_counts):
+    weights_key = f"rop_shards:{render_id}:weights"
+    pipe = redis_conn.pipeline()
+    pipe.hset(weights_key, mapping=dict(enumerate(shard_frame_counts)))
+    pipe.expire(weights_key, cnst.ROP_SHARD_DATA_TTL)
+    pipe.execute()
+
+
+@with_redis_conn
+def update_rop_shard_progress(redis_conn, render_id, shard_index, progress):
+    """Record a shard's progress and return the frame-weighted progress
+    of the whole sequence.
+    """
+    progress_key = f"rop_shards:{render_id}:progress"
+    pipe = redis_conn.pipeline()
+    pipe.hset(progress_key, shard_index, progress)
+    pipe.expire(progress_key, cnst.ROP_SHARD_DATA_TTL)
+    pipe.hgetall(progress_key)
+    pipe.hgetall(f"rop_shards:{render_id}:weights")
+    _, _, shard_progress, shard_weights = pipe.execute()
+
+    total_weight = sum(int(weight) for weight in shard_weights.values())
+    if not total_weight:
+        return progress
+
+    weighted_progress = sum(float(shard_progress.get(index, 0)) * int(weight)
+                            for index, weight in shard_weights.items())
+    return weighted_progress / total_weight
+
+
+@with_redis_conn
+def record_rop_shard_output(redis_conn, render_id, shard_index, render_path):
+    """Record a finished shard's output path, empty if it failed.
+
+    :returns: Every shard's output path in shard order once the last shard
+        has finished, None while others are outstanding. Only the shard
+        finishing last receives them.
+    """
+    outputs_key = f"rop_shards:{render_id}:outputs"
+    pipe = redis_conn.pipeline()
+    pipe.hset(outputs_key, shard_index, render_path or "")
+    pipe.expire(outputs_key, cnst.ROP_SHARD_DATA_TTL)
+    pipe.hgetall(outputs_key)
+    pipe.hlen(f"rop_shards:{render_id}:weights")
+    new_output, _, shard_outputs, shard_count = pipe.execute()
+    if not new_output or len(shard_outputs) != shard_count:
+        return None
+    return [shard_outputs[str(index).encode("utf-8")].decode("utf-8") for index in range(shard_count)]
+
+
+def publish_render_event(event, data, socket_id, history_user_uuid=None, history_file_uuid=None):
+    """Queue `event` for delivery to `socket_id`, recording it in the
+    user's replayable history of the file when both are given.
+
+    :returns: The event's history ID, or None if it isn't replayable.
+    """
+    keys = [cnst.RENDER_EVENT_STREAM]
+    if history_user_uuid is not None and history_file_uuid is not None:
+        keys.append(_render_event_history_key(history_user_uuid, history_file_uuid))
+
+    publish_script = RedisClient.get_script("publish_render_event")
+    event_id = publish_script(keys=keys,
+                              args=[event, json.dumps(data), socket_id or "",
+                                    cnst.RENDER_EVENT_STREAM_MAXLEN,
+                                    cnst.RENDER_EVENT_HISTORY_MAXLEN,
+                                    cnst.RENDER_EVENT_HISTORY_TTL])
+    if event_id:
+        return event_id.decode("utf-8")
+
+
+@with_redis_conn
+def ensure_render_event_group(redis_conn):
+    try:
+        redis_conn.xgroup_create(cnst.RENDER_EVENT_STREAM, cnst.RENDER_EVENT_GROUP,
+                                 id="0", mkstream=True)
+    except redis.ResponseError as exc:
+        # The group outlives every relay, only the first one creates it.
+        if "BUSYGROUP" not in str(exc):
+            raise
+
+
+@with_redis_conn
+def read_render_events(redis_conn, consumer, count=100, block_ms=cnst.RENDER_EVENT_BLOCK_MS):
+    response = redis_conn.xreadgroup(cnst.RENDER_EVENT_GROUP, consumer,
+                                     {cnst.RENDER_EVENT_STREAM: ">"},
+                                     count=count, block=block_ms)
+    if not response:
+        return []
+    return _decode_render_events(response[0][1])
+
+
+@with_redis_conn
+def claim_stale_render_events(redis_conn, consumer, count=100):
+    """Take over events a relay read but never acknowledged, e.g. because
+    its web worker died mid-delivery.
+    """
+    response = redis_conn.xautoclaim(cnst.RENDER_EVENT_STREAM, cnst.RENDER_EVENT_GROUP, consumer,
+                                     cnst.RENDER_EVENT_CLAIM_IDLE_MS, start_id="0-0", count=count)
+    return _decode_render_events(response[1])
+
+
+@with_redis_conn
+def ack_render_events(redis_conn, entry_ids):
+    if entry_ids:
+        redis_conn.xack(cnst.RENDER_EVENT_STREAM, cnst.RENDER_EVENT_GROUP, *entry_ids)
+
+
+@with_redis_conn
+def get_render_event_history(redis_conn, user_uuid, file_uuid, after_id):
+    """:returns: List of (event ID, event, data) recorded after `after_id`."""
+    entries = redis_conn.xrange(_render_event_history_key(user_uuid, file_uuid), min=f"({after_id}")
+    return [(entry_id, fields["event"], fields["data"])
+            for entry_id, fields in _decode_render_events(entries)]
+
+
+@with_redis_conn
+def get_render_event_tip(redis_conn, user_uuid, file_uuid):
+    """ID of the user's latest replayable event of the file, "0-0" if there is none."""
+    entries = redis_conn.xrevrange(_render_event_history_key(user_uuid, file_uuid), count=1)
+    return entries[0][0].decode("utf-8") if entries else "0-0"
+
+
+def _render_event_history_key(user_uuid, file_uuid):
+    # Kept per user, a .hip (e.g. the placeholder) can be rendered by many.
+    return f"render_events:user:{user_uuid}:file:{file_uuid}"
+
+
+def _decode_render_events(entries):
+    events = []
+    for entry_id, fields in entries:
+        # Entries trimmed while pending are claimed without their fields.
+        if not fields:
+            events.append((entry_id.decode("utf-8"), None))
+            continue
+        fields = decode_redis_hash(fields)
+        fields["data"] = json.loads(fields["data"])
+        events.append((entry_id.decode("utf-8"), fields))
+    return events
+
+
+@with_redis_conn
+def set_scene_affinity(redis_conn, file_uuid, hostname):
+    redis_conn.set(f"scene_affinity:{file_uuid}", hostname, ex=cnst.SCENE_AFFINITY_TTL)
+
+
+@with_redis_conn
+def get_scene_affinity(redis_conn, file_uuid):
+    hostname = redis_conn.get(f"scene_affinity:{file_uuid}")
+    if hostname is not None:
+        return hostname.decode("utf-8")
+
+
+@with_redis_conn
+def increment_scene_cache_metric(redis_conn, metric):
+    redis_conn.hincrby("global:scene_cache_metrics", metric, 1)
+
+
+@with_redis_conn
+def get_scene_cache_metrics(redis_conn):
+    return {key: int(value) for key, value in decode_redis_hash(
+        redis_conn.hgetall("global:scene_cache_metrics")).items()}
+
+
+@with_redis_conn
+def observe_histogram(redis_conn, name, labels, bucket, value):
+    """Count `value` into a single (non-cumulative) bucket of the metric.
+
+    Every process increments the same hash, so the histogram aggregates
+    across web and Celery workers.
+    """
+    key = f"metrics:histogram:{name}"
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.hincrby(key, f"{labels}|{bucket}", 1)
+    pipe.hincrby(key, f"{labels}|count", 1)
+    pipe.hincrbyfloat(key, f"{labels}|sum", value)
+    pipe.execute()
+
+
+@with_redis_conn
+def increment_counter(redis_conn, name, labels, amount=1):
+    redis_conn.hincrbyfloat(f"metrics:counter:{name}", labels, amount)
+
+
+@with_redis_conn
+def get_metric_samples(redis_conn, histogram_names, counter_names):
+    """:returns: Tuple of dicts mapping each metric name to its decoded hash."""
+    pipe = redis_conn.pipeline(transaction=False)
+    for name in histogram_names:
+        pipe.hgetall(f"metrics:histogram:{name}")
+    for name in counter_names:
+        pipe.hgetall(f"metrics:counter:{name}")
+    results = iter(pipe.execute())
+
+    histograms = {name: decode_redis_hash(next(results)) for name in histogram_names}
+    counters = {name: decode_redis_hash(next(results)) for name in counter_names}
+    return histograms, counters
+
+
+@with_redis_conn
+def get_queue_depths(redis_conn, queues):
+    """Pending fair-share jobs and Celery broker messages per queue.
+
+    Celery's redis transport keeps each queue as a list named after it,
+    which lives in this database as long as the broker does.
+
+    :returns: Dict of queue name to a (pending jobs, broker messages) tuple.
+    """
+    pipe = redis_conn.pipeline(transaction=False)
+    for queue in queues:
+        pipe.zrange(f"fair_share:{queue}:users", 0, -1)
+        pipe.llen(queue)
+    results = iter(pipe.execute())
+    queue_users = {queue: (next(results), next(results)) for queue in queues}
+
+    pipe = redis_conn.pipeline(transaction=False)
+    for queue, (users, _) in queue_users.items():
+        for user_key in users:
+            pipe.llen(f"fair_share:{queue}:jobs:{user_key.decode('utf-8')}")
+    job_counts = iter(pipe.execute())
+
+    return {queue: (sum(next(job_counts) for _ in users), broker_length)
+            for queue, (users, broker_length) in queue_users.items()}
+
+
+@with_redis_conn
+def append_trace_event(redis_conn, trace_id, event):
+    """Append `event` to the trace's stream. Entry IDs come from the redis
+    server clock, so events from different machines order consistently.
+
+    The first event of a trace also registers it in the recent history.
+    """
+    key = f"render_trace:{trace_id}"
+    pipe = redis_conn.pipeline()
+    pipe.xadd(key, event, maxlen=cnst.RENDER_TRACE_MAX_EVENTS, approximate=True)
+    pipe.expire(key, cnst.RENDER_TRACE_TTL)
+    if event.get("stage") == cnst.TraceStages.submitted:
+        pipe.lpush("render_traces:recent", trace_id)
+        pipe.ltrim("render_traces:recent", 0, cnst.RENDER_TRACE_HISTORY - 1)
+    pipe.execute()
+
+
+@with_redis_conn
+def get_trace_events(redis_conn, trace_ids):
+    """:returns: Dict of trace id to its list of (entry id, event) tuples."""
+    pipe = redis_conn.pipeline(transaction=False)
+    for trace_id in trace_ids:
+        pipe.xrange(f"render_trace:{trace_id}")
+    return {trace_id: [(entry_id.decode("utf-8"), decode_redis_hash(event))
+                       for entry_id, event in entries]
+            for trace_id, entries in zip(trace_ids, pipe.execute())}
+
+
+@with_redis_conn
+def get_recent_trace_ids(redis_conn, limit):
+    return [trace_id.decode("utf-8")
+            for trace_id in redis_conn.lrange("render_traces:recent", 0, limit - 1)]
+
+
+@with_redis_conn
+def touch_storage(redis_conn, kind, name, existing_only=False):
+    """Record an access of a stored .hip or ROP output for LRU eviction."""
+    redis_conn.zadd(f"storage:access:{kind}", {name: time.time()}, xx=existing_only)
+
+
+@with_redis_conn
+def touch_render_owner(redis_conn, filename):
+    hip_uuid = redis_conn.get(f"filename_to_uuid:{filename}")
+    if hip_uuid is not None:
+        redis_conn.zadd(f"storage:access:{cnst.StorageKinds.hip}",
+                        {hip_uuid.decode("utf-8"): time.time()}, xx=True)
+
+
+@with_redis_conn
+def get_storage_access(redis_conn, kind, names):
+    """:returns: Dict of name to its last access time, None if never recorded."""
+    pipe = redis_conn.pipeline(transaction=False)
+    for name in names:
+        pipe.zscore(f"storage:access:{kind}", name)
+    return dict(zip(names, pipe.execute()))
+
+
+@with_redis_conn
+def get_least_recent_storage(redis_conn, kind, count):
+    """:returns: List of (name, last access) of the `count` least recently used."""
+    return [(name.decode("utf-8"), score) for name, score in
+            redis_conn.zrange(f"storage:access:{kind}", 0, count - 1, withscores=True)]
+
+
+@with_redis_conn
+def get_render_references(redis_conn, filenames):
+    """:returns: Set of the filenames still referenced by a .hip or the render cache."""
+    pipe = redis_conn.pipeline(transaction=False)
+    for filename in filenames:
+        pipe.exists(f"render_refs:{filename}")
+        pipe.hexists("render_cache:files", filename)
+    results = iter(pipe.execute())
+    return {filename for filename in filenames if next(results) | next(results)}
+
+
+@with_redis_conn
+def get_orphan_candidates(redis_conn, before, count):
+    """Renders replaced by a re-render before `before`, oldest first."""
+    return [filename.decode("utf-8") for filename in
+            redis_conn.zrangebyscore("storage:orphan_candidates", "-inf", before, start=0, num=count)]
+
+
+@with_redis_conn
+def remove_orphan_candidates(redis_conn, filenames):
+    if filenames:
+        redis_conn.zrem("storage:orphan_candidates", *filenames)
+
+
+@with_redis_conn
+def get_hip_storage_info(redis_conn, file_uuids):
+    """:returns: Dict of .hip UUID to its owner, hash and referenced render
+        filenames, or None for uploads without metadata.
+    """
+    pipe = redis_conn.pipeline(transaction=False)
+    for file_uuid in file_uuids:
+        pipe.hmget(f"file_meta:{file_uuid}", "user_uuid", "file_hash")
+        pipe.hvals(f"file_render_data:{file_uuid}:{cnst.BackgroundRenderType.glb_file}")
+        pipe.hvals(f"file_render_data:{file_uuid}:{cnst.BackgroundRenderType.thumbnail}")
+    results = iter(pipe.execute())
+
+    hip_info = {}
+    for file_uuid in file_uuids:
+        (user_uuid, file_hash), glb_files, thumb_files = next(results), next(results), next(results)
+        if file_hash is None:
+            hip_info[file_uuid] = None
+            continue
+        hip_info[file_uuid] = {
+            "user_uuid": user_uuid.decode("utf-8") if user_uuid else None,
+            "file_hash": file_hash.decode("utf-8"),
+            "renders": sorted({filename.decode("utf-8") for filename in glb_files + thumb_files}),
+        }
+    return hip_info
+
+
+@with_redis_conn
+def store_hip_bytes(redis_conn, hip_bytes):
+    """Record the bytes each .hip accounts for, including its renders."""
+    if hip_bytes:
+        redis_conn.hset("storage:hip_bytes", mapping=hip_bytes)
+
+
+@with_redis_conn
+def seed_storage_access(redis_conn, kind, last_accesses):
+    """Set the access time of entries stored before accesses were tracked."""
+    if last_accesses:
+        redis_conn.zadd(f"storage:access:{kind}", last_accesses, nx=True)
+
+
+@with_redis_conn
+def get_user_storage(redis_conn, user_uuid):
+    """:returns: List of (.hip UUID, bytes, last access) of the user's uploads.
+        Uploads not swept yet account for 0 bytes.
+    """
+    file_uuids = [file_uuid.decode("utf-8")
+                  for file_uuid in redis_conn.smembers(f"user:{user_uuid}:filenames_set")]
+    if not file_uuids:
+        return []
+
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.hmget("storage:hip_bytes", file_uuids)
+    for file_uuid in file_uuids:
+        pipe.zscore(f"storage:access:{cnst.StorageKinds.hip}", file_uuid)
+    hip_bytes, *last_accesses = pipe.execute()
+    return [(file_uuid, int(size or 0), last_access or 0)
+            for file_uuid, size, last_access in zip(file_uuids, hip_bytes, last_accesses)]
+
+
+@with_redis_conn
+def delete_hip_records(redis_conn, file_uuid, hip_info):
+    """Remove an upload and its bookkeeping, dropping its render references.
+
+    :param hip_info: The upload's entry from `get_hip_storage_info`.
+    :returns: The hip's render filenames no longer referenced by anything.
+    """
+    pipe = redis_conn.pipeline()
+    pipe.delete(f"file_meta:{file_uuid}",
+                *[f"file_render_data:{file_uuid}:{key}" for key in
+                  (cnst.BackgroundRenderType.glb_file, cnst.BackgroundRenderType.thumbnail,
+                   "render_time", "frame_range")])
+    pipe.zrem(f"storage:access:{cnst.StorageKinds.hip}", file_uuid)
+    pipe.hdel("storage:hip_bytes", file_uuid)
+    if hip_info is None:
+        pipe.execute()
+        return []
+
+    user_uuid = hip_info["user_uuid"]
+    file_hash = hip_info["file_hash"]
+    renders = hip_info["renders"]
+
+    # Scene caches are keyed by contents, which only this upload has.
+    pipe.delete(f"cookable:{file_hash}",
+                f"bbox:{file_hash}",
+                f"cook_stats:{file_hash}",
+                f"cook_stats_version:{file_hash}")
+    if user_uuid is not None:
+        # Other users' histories of the file expire on their own.
+        pipe.delete(_render_event_history_key(user_uuid, file_uuid))
+        pipe.srem(f"user:{user_uuid}:filenames_set", file_uuid)
+        pipe.lrem(f"user:{user_uuid}:filenames_list", 0, file_uuid)
+        pipe.hdel(f"user:{user_uuid}:hash_to_uuid", file_hash)
+    # Lets the same contents be uploaded again.
+    pipe.srem("global:file_hashes", file_hash)
+    for filename in renders:
+        pipe.srem(f"render_refs:{filename}", file_uuid)
+    for filename in renders:
+        pipe.exists(f"render_refs:{filename}")
+        pipe.hexists("render_cache:files", filename)
+    results = iter(pipe.execute()[-2 * len(renders):] if renders else [])
+    return [filename for filename in renders if not (next(results) | next(results))]
+
+
+@with_redis_conn
+def delete_render_records(redis_conn, filenames):
+    """Remove the lookups and share links of deleted renders."""
+    if not filenames:
+        return
+
+    nano_ids = redis_conn.hmget("global:uuid_to_nanoid", filenames)
+    pipe = redis_conn.pipeline()
+    pipe.delete(*[f"filename_to_uuid:{filename}" for filename in filenames])
+    pipe.delete(*[f"render_refs:{filename}" for filename in filenames])
+    pipe.hdel("global:uuid_to_nanoid", *filenames)
+    shared_nano_ids = [nano_id for nano_id in nano_ids if nano_id is not None]
+    if shared_nano_ids:
+        pipe.hdel("global:nanoid_to_uuid", *shared_nano_ids)
+    pipe.execute()
+
+
+@with_redis_conn
+def delete_rop_records(redis_conn, render_ids):
+    if not render_ids:
+        return
+
+    pipe = redis_conn.pipeline()
+    pipe.zrem(f"storage:access:{cnst.StorageKinds.rop}", *render_ids)
+    for render_id in render_ids:
+        pipe.delete(f"file_render_data:{render_id}:{cnst.BackgroundRenderType.rop_render}",
+                    f"filename_to_uuid:{render_id}",
+                    f"render_refs:{render_id}")
+    pipe.execute()
+
+
+@with_redis_conn
+def get_active_upload_sessions(redis_conn, upload_ids):
+    pipe = redis_conn.pipeline(transaction=False)
+    for upload_id in upload_ids:
+        pipe.exists(f"upload_session:{upload_id}")
+    return {upload_id for upload_id, exists in zip(upload_ids, pipe.execute()) if exists}
+
+
+@with_redis_conn
+def next_storage_shard(redis_conn):
+    return (redis_conn.incr("storage_gc:shard_cursor") - 1) % cnst.STORAGE_GC_SHARDS
+
+
+@with_redis_conn
+def set_shard_bytes(redis_conn, shard, total_bytes):
+    redis_conn.hset("storage:shard_bytes", shard, total_bytes)
+
+
+@with_redis_conn
+def release_shard_bytes(redis_conn, freed_bytes):
+    """:param freed_bytes: Dict of shard to the bytes deleted from it."""
+    pipe = redis_conn.pipeline(transaction=False)
+    for shard, size in freed_bytes.items():
+        pipe.hincrby("storage:shard_bytes", shard, -size)
+    pipe.execute()
+
+
+@with_redis_conn
+def get_storage_bytes(redis_conn):
+    return sum(int(size) for size in redis_conn.hvals("storage:shard_bytes"))
+
+
+@with_redis_conn
+def acquire_storage_sweep_lock(redis_conn, timeout):
+    return bool(redis_conn.set("storage_gc:lock", 1, nx=True, ex=timeout))
+
+
+@with_redis_conn
+def release_storage_sweep_lock(redis_conn):
+    redis_conn.delete("storage_gc:lock")
+
+
+@with_redis_conn
+def scan_backfill_keys(redis_conn, name, pattern, count=cnst.STORAGE_GC_BATCH_SIZE):
+    """Resumable SCAN over `pattern`, continuing where the previous call of
+    the backfill `name` stopped.
+
+    :returns: Tuple of the batch of keys and whether the scan has finished.
+    """
+    state_key = f"storage_gc:backfill:{name}"
+    cursor = redis_conn.get(state_key)
+    if cursor == b"done":
+        return [], True
+
+    cursor, keys = redis_conn.scan(int(cursor or 0), match=pattern, count=count)
+    redis_conn.set(state_key, cursor if cursor else "done")
+    return [key.decode("utf-8") for key in keys], not cursor
+
+
+@with_redis_conn
+def is_backfill_finished(redis_conn, name):
+    return redis_conn.get(f"storage_gc:backfill:{name}") == b"done"
+
+
+@with_redis_conn
+def backfill_hip_owners(redis_conn, user_set_keys):
+    """Record the owner of uploads made before file_meta stored it."""
+    pipe = redis_conn.pipeline(transaction=False)
+    for key in user_set_keys:
+        pipe.smembers(key)
+    owned_files = [(key.split(":")[1], file_uuid.decode("utf-8"))
+                   for key, file_uuids in zip(user_set_keys, pipe.execute())
+                   for file_uuid in file_uuids]
+
+    pipe = redis_conn.pipeline(transaction=False)
+    for _, file_uuid in owned_files:
+        pipe.exists(f"file_meta:{file_uuid}")
+    exists = pipe.execute()
+
+    pipe = redis_conn.pipeline(transaction=False)
+    for (user_uuid, file_uuid), has_meta in zip(owned_files, exists):
+        if has_meta:
+            pipe.hsetnx(f"file_meta:{file_uuid}", "user_uuid", user_uuid)
+    pipe.execute()
+
+
+@with_redis_conn
+def backfill_render_refs(redis_conn, render_data_keys):
+    """Reference the renders stored before references were tracked."""
+    render_types = (cnst.BackgroundRenderType.glb_file, cnst.BackgroundRenderType.thumbnail)
+    # Keys are `file_render_data:<hip uuid>:<render type>`.
+    render_data_keys = [key for key in render_data_keys if key.rsplit(":", 1)[1] in render_types]
+
+    pipe = redis_conn.pipeline(transaction=False)
+    for key in render_data_keys:
+        pipe.hvals(key)
+    filenames = pipe.execute()
+
+    pipe = redis_conn.pipeline(transaction=False)
+    for key, key_filenames in zip(render_data_keys, filenames):
+        file_uuid = key.split(":")[1]
+        for filename in key_filenames:
+            pipe.sadd(f"render_refs:{filename.decode('utf-8')}", file_uuid)
+    pipe.execute()
+
+
 @with_redis_conn
 def _flush_redis_db(redis_conn):
     """Flush the Redis database for testing purposes."""
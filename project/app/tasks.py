@@ -1,7 +1,41 @@
-from celery import shared_task
+import uuid
+import functools
+
+from celery import shared_task, current_app, current_task
+
+
+def invalidate_scene_on_error(func):
+    """A task that raised may leave the resident scene half-modified,
+    force the next task on this worker to reload from disk.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            from app.api import scene_cache
+            scene_cache.invalidate()
+            raise
+
+    return wrapper
+
+
+def profile_cooks(func):
+    """Profile per-node cook times of the render described by the task's
+    first argument, when its export settings ask for it.
+    """
+    @functools.wraps(func)
+    def wrapper(render_data, *args, **kwargs):
+        from app.api import cook_profiler
+        with cook_profiler.profile_cooks(render_data):
+            return func(render_data, *args, **kwargs)
+
+    return wrapper
 
 
 @shared_task()
+@invalidate_scene_on_error
+@profile_cooks
 def run_thumbnail_task(render_data, hip_path, generate_for_rop=False):
     from app.api import background_render
     background_render.generate_thumbnail(render_data=render_data,
@@ -10,18 +44,108 @@ def run_thumbnail_task(render_data, hip_path, generate_for_rop=False):
 
 
 @shared_task()
+@invalidate_scene_on_error
+@profile_cooks
 def run_render_task(render_data, hip_path):
     from app.api import background_render
     background_render.render_glb(render_data=render_data, hip_path=hip_path)
 
 
 @shared_task()
+@invalidate_scene_on_error
+@profile_cooks
+def run_render_pipeline_task(render_data, hip_path):
+    from app.api import background_render
+    background_render.render_glb_with_thumbnail(render_data=render_data, hip_path=hip_path)
+
+
+@shared_task()
+@invalidate_scene_on_error
+@profile_cooks
 def execute_render_rop(render_data, hip_path, generate_thumbnail=False):
+    from app import redis_client, constants as cnst
     from app.api import background_render
     # Execute a single frame of the ROP as a .png for use with thumbnail.
     # Could be optimized with OpenImageIO, but can revisit that later.
     if generate_thumbnail:
         background_render.render_rop(render_data=render_data, hip_path=hip_path, force_png=True)
 
-    # Then actually fire off the full ROP with original file extension.
-    background_render.render_rop(render_data=render_data, hip_path=hip_path)
+    shards = background_render.split_frame_range(render_data["start"], render_data["end"],
+                                                 render_data["step"], cnst.ROP_SHARD_SIZE)
+    if len(shards) == 1:
+        # Then actually fire off the full ROP with original file extension.
+        background_render.render_rop(render_data=render_data, hip_path=hip_path)
+        return
+
+    # Fan long sequences out across workers, all shards write into the same
+    # render folder and a single completion is sent once every shard is done.
+    render_id = str(uuid.uuid4())
+    step = render_data["step"] or 1
+    redis_client.register_rop_shards(render_id, [int((end - start) / step) + 1 for start, end in shards])
+
+    # Shards take their turn in the submitting user's fair share like any
+    # other batch job, rather than jumping the queue.
+    user_key = render_data.get("user_uuid") or render_data["socket_id"]
+    for index, shard in enumerate(shards):
+        redis_client.enqueue_fair_share_job(cnst.CeleryQueues.batch, user_key, {
+            "task": render_rop_shard.name,
+            "file_uuid": render_data["file_uuid"],
+            "args": [render_data, hip_path, render_id, index, shard],
+            "kwargs": {}
+        })
+        dispatch_fair_share_job.apply_async((cnst.CeleryQueues.batch,), queue=cnst.CeleryQueues.batch)
+
+
+@shared_task()
+@invalidate_scene_on_error
+@profile_cooks
+def render_rop_shard(render_data, hip_path, render_id, shard_index, frame_range):
+    from app.api import background_render
+    record_dequeued(render_data, shard=shard_index)
+    render_path = None
+    try:
+        render_path = background_render.render_rop(render_data=render_data,
+                                                   hip_path=hip_path,
+                                                   render_id=render_id,
+                                                   frame_range=tuple(frame_range),
+                                                   shard_index=shard_index)
+    finally:
+        # Also record shards that raised, so the sequence still finishes.
+        background_render.complete_rop_shard(render_data, render_id, shard_index, render_path)
+
+
+@shared_task()
+def dispatch_fair_share_job(queue, user_key=None, file_uuid=None):
+    """Run the next job of `queue` in fair-share order.
+
+    One dispatch task is queued per submitted job, the job itself is only
+    chosen once a worker slot is free to run it. Dispatches routed to the
+    worker holding a .hip pass its `file_uuid` so they run that job rather
+    than whichever .hip the least served user queued next.
+    """
+    from app import redis_client
+    job = redis_client.pop_fair_share_job(queue, user_key=user_key, file_uuid=file_uuid)
+    if job is None:
+        return
+
+    # Render jobs carry their render data as the first argument.
+    if job["args"] and isinstance(job["args"][0], dict):
+        record_dequeued(job["args"][0], task=job["task"])
+
+    # Run in this task's request so the job sees the worker's hostname.
+    task = current_app.tasks[job["task"]]
+    task.run(*job["args"], **job["kwargs"])
+
+
+@shared_task()
+def sweep_storage():
+    from flask import current_app
+    from app.api import storage_gc
+    storage_gc.sweep(current_app.config["UPLOAD_FOLDER"])
+
+
+def record_dequeued(render_data, **fields):
+    from app import constants as cnst
+    from app.api import render_trace
+    render_trace.record(render_data.get("trace_id"), cnst.TraceStages.dequeued,
+                        worker=current_task.request.hostname, **fields)
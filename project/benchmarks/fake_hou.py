@@ -0,0 +1,228 @@
+"""Minimal stand-in for Houdini's `hou` module.
+
+Only the surface used by the benchmarked code paths is implemented. Scenes
+are built in memory with `build_network`, no .hip file is ever read.
+"""
+import os
+import random
+
+_nodes = {}
+
+
+class OperationFailed(Exception):
+    pass
+
+
+class NodeTypeCategory:
+    def __init__(self, name):
+        self._name = name
+
+    def name(self):
+        return self._name
+
+    def __repr__(self):
+        return "<NodeTypeCategory {0}>".format(self._name)
+
+
+_CATEGORIES = {name: NodeTypeCategory(name)
+               for name in ("Object", "Sop", "Driver", "Manager", "Director")}
+
+
+def objNodeTypeCategory():
+    return _CATEGORIES["Object"]
+
+
+def sopNodeTypeCategory():
+    return _CATEGORIES["Sop"]
+
+
+def ropNodeTypeCategory():
+    return _CATEGORIES["Driver"]
+
+
+def managerNodeTypeCategory():
+    return _CATEGORIES["Manager"]
+
+
+class NodeType:
+    def __init__(self, name, category, icon, is_manager=False):
+        self._name = name
+        self._category = category
+        self._icon = icon
+        self._is_manager = is_manager
+
+    def name(self):
+        return self._name
+
+    def category(self):
+        return self._category
+
+    def icon(self):
+        return self._icon
+
+    def isManager(self):
+        return self._is_manager
+
+    def nameWithCategory(self):
+        return "{0}/{1}".format(self._category.name(), self._name)
+
+
+class Color:
+    def __init__(self, rgb):
+        self._rgb = rgb
+
+    def rgb(self):
+        return self._rgb
+
+
+class Node:
+    def __init__(self, name, node_type, parent=None, child_category=None):
+        self._name = name
+        self._type = node_type
+        self._parent = parent
+        self._child_category = child_category
+        self._children = []
+        self._outputs = []
+        self._cached_user_data = {}
+        self._render_node = None
+        self._color = Color((0.8, 0.8, 0.8))
+
+        if parent is not None:
+            parent._children.append(self)
+        _nodes[self.path()] = self
+
+    def name(self):
+        return self._name
+
+    def path(self):
+        if self._parent is None:
+            return "/" + self._name if self._name else "/"
+        parent_path = self._parent.path().rstrip("/")
+        return "{0}/{1}".format(parent_path, self._name)
+
+    def type(self):
+        return self._type
+
+    def parent(self):
+        return self._parent
+
+    def children(self):
+        return tuple(self._children)
+
+    def childTypeCategory(self):
+        return self._child_category
+
+    def color(self):
+        return self._color
+
+    def outputs(self):
+        return tuple(self._outputs)
+
+    def setInput(self, index, node):
+        node._outputs.append(self)
+
+    def cachedUserDataDict(self):
+        return dict(self._cached_user_data)
+
+    def cachedUserData(self, name):
+        return self._cached_user_data.get(name)
+
+    def setCachedUserData(self, name, value):
+        self._cached_user_data[name] = value
+
+    def renderNode(self):
+        return self._render_node
+
+    def isBypassed(self):
+        return False
+
+    def parm(self, name):
+        return None
+
+
+class _HipFile:
+    def __init__(self):
+        self._path = "untitled.hip"
+
+    def path(self):
+        return self._path
+
+    def load(self, file_name, suppress_save_prompt=False, ignore_load_warnings=False):
+        self._path = file_name
+
+
+hipFile = _HipFile()
+
+
+class playbar:
+    @staticmethod
+    def playbackRange():
+        return 1.0, 240.0
+
+
+class updateMode:
+    AutoUpdate = "AutoUpdate"
+    OnMouseUp = "OnMouseUp"
+    Manual = "Manual"
+
+
+def setUpdateMode(mode):
+    pass
+
+
+class text:
+    @staticmethod
+    def expandString(value):
+        return os.path.expandvars(value)
+
+
+def node(path):
+    return _nodes.get(path)
+
+
+def frame():
+    return 1.0
+
+
+# Real-looking SOP icon names. Some resolve directly, some through the
+# IconMapping file and some only through the versioned node fallback.
+SOP_ICONS = ["SOP_box", "SOP_sphere", "SOP_transform", "SOP_merge", "SOP_null",
+             "SOP_attribwrangle", "SOP_polyextrude", "SOP_measure-2.0",
+             "SOP_polyreduce-2.0", "SOP_object_merge", "SOP_color", "SOP_switch"]
+
+
+def build_network(node_count, edge_count, seed=0):
+    """Create /obj, /out and /obj/<geo> holding `node_count` SOPs wired by
+    `edge_count` random edges (always from earlier to later nodes).
+
+    :returns: The SOP network node.
+    """
+    _nodes.clear()
+    rng = random.Random(seed)
+
+    root = Node("", NodeType("root", managerNodeTypeCategory(), "NETWORKS_root", True),
+                child_category=managerNodeTypeCategory())
+    obj = Node("obj", NodeType("obj", managerNodeTypeCategory(), "NETWORKS_obj", True),
+               parent=root, child_category=objNodeTypeCategory())
+    Node("out", NodeType("out", managerNodeTypeCategory(), "NETWORKS_rop", True),
+         parent=root, child_category=ropNodeTypeCategory())
+
+    geo = Node("geo1", NodeType("geo", objNodeTypeCategory(), "OBJ_geo"),
+               parent=obj, child_category=sopNodeTypeCategory())
+
+    sop_nodes = []
+    for index in range(node_count):
+        icon = rng.choice(SOP_ICONS)
+        type_name = icon.split("_", 1)[1].split("-")[0]
+        sop_type = NodeType(type_name, sopNodeTypeCategory(), icon)
+        sop_nodes.append(Node("{0}{1}".format(type_name, index), sop_type, parent=geo,
+                              child_category=sopNodeTypeCategory()))
+
+    if node_count > 1:
+        for _ in range(edge_count):
+            source, target = sorted(rng.sample(range(node_count), 2))
+            sop_nodes[target].setInput(0, sop_nodes[source])
+
+    if sop_nodes:
+        geo._render_node = sop_nodes[-1]
+    return geo
@@ -0,0 +1,126 @@
+import os
+import sys
+import json
+import zipfile
+import tempfile
+
+from benchmarks import fake_hou
+
+# Directly resolvable icons, one per folder entry in the synthetic icons.zip.
+_DIRECT_ICONS = ["SOP/box", "SOP/sphere", "SOP/transform", "SOP/merge", "SOP/attribwrangle",
+                 "SOP/polyextrude", "SOP/measure", "SOP/polyreduce_v2", "SOP/object_merge",
+                 "SOP/color", "SOP/switch", "COMMON/null", "OBJ/geo",
+                 "NETWORKS/root", "NETWORKS/obj", "NETWORKS/rop"]
+
+# (from, to) entries of the synthetic IconMapping file.
+_ICON_MAPPINGS = [("SOP_null", "COMMON_null"), ("OBJ_null", "COMMON_null")]
+
+# Filler entries so lookups run against an archive of realistic size.
+_FILLER_ICON_COUNT = 4000
+
+_SVG = b'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 16 16"><rect width="16" height="16"/></svg>'
+
+
+def install_fake_hou():
+    """Register the `hou` stub before any app module imports it."""
+    sys.modules["hou"] = fake_hou
+    return fake_hou
+
+
+def build_icon_zip(hfs_dir):
+    """Write a SideFX-like icons.zip under `hfs_dir` and point $HFS at it."""
+    icon_dir = os.path.join(hfs_dir, "houdini", "config", "Icons")
+    os.makedirs(icon_dir, exist_ok=True)
+    zip_path = os.path.join(icon_dir, "icons.zip")
+
+    with zipfile.ZipFile(zip_path, "w") as zip_file:
+        mapping_lines = ["# Synthetic IconMapping"]
+        mapping_lines += ["{0} := {1};".format(src, dst) for src, dst in _ICON_MAPPINGS]
+        zip_file.writestr("IconMapping", "\n".join(mapping_lines) + "\n")
+
+        for icon in _DIRECT_ICONS:
+            zip_file.writestr(icon + ".svg", _SVG)
+        for index in range(_FILLER_ICON_COUNT):
+            folder = ("SOP", "OBJ", "DOP", "VOP", "LOP")[index % 5]
+            zip_file.writestr("{0}/filler_{1:05d}.svg".format(folder, index), _SVG)
+
+    os.environ["HFS"] = hfs_dir
+    return zip_path
+
+
+def create_fake_redis(redis_url=None, flush=False):
+    """A fakeredis client, or a real client for `redis_url`.
+
+    Benchmarks write all over the database, so a real one must be empty and
+    not the default db 0 unless `flush` allows wiping it first.
+    """
+    if redis_url:
+        import redis
+        client = redis.Redis.from_url(redis_url)
+        db = client.connection_pool.connection_kwargs.get("db", 0)
+        if not flush and (db == 0 or client.dbsize()):
+            raise ValueError("Refusing to use redis db {0} of {1}, it is the default db or isn't "
+                             "empty. Pass --flush to wipe it first.".format(db, redis_url))
+        if flush:
+            client.flushdb()
+        return client
+
+    import fakeredis
+    return fakeredis.FakeRedis()
+
+
+def install_redis(client):
+    from app import redis_client
+    redis_client.RedisClient._client_instance = client
+    redis_client.RedisClient._scripts = {}
+
+
+def create_benchmark_app(redis_conn):
+    """Build the Flask app against `redis_conn` and in-memory brokers.
+
+    Celery publishes into kombu's memory transport (nothing consumes it)
+    and Socket.IO runs without a message queue.
+    """
+    from config import Config
+    from app import create_app
+
+    storage_dir = tempfile.mkdtemp(prefix="hou_benchmark_")
+
+    class BenchmarkConfig(Config):
+        TESTING = True
+        WTF_CSRF_ENABLED = False
+        SESSION_REDIS = redis_conn
+        UPLOAD_FOLDER = os.path.join(storage_dir, "hip_storage")
+        STATIC_FOLDER = os.path.join(storage_dir, "static")
+        SOCKETIO_MESSAGE_QUEUE = None
+        RENDER_EVENT_RELAY = False
+        SCENE_AFFINITY_ROUTING = True
+        CELERY = dict(Config.CELERY,
+                      broker_url="memory://",
+                      result_backend="cache+memory://")
+
+    return create_app(BenchmarkConfig)
+
+
+def load_perfmon_stats():
+    """Decoded `PerfMonProfile.stats()` of a small SOP network's cook."""
+    with open(os.path.join(os.path.dirname(__file__), "data", "perfmon_stats.json")) as stats_file:
+        return json.load(stats_file)
+
+
+def seed_uploads(user_uuid, upload_count, renders_per_upload=3):
+    """Register `upload_count` uploads with GLB and thumbnail renders."""
+    from app import redis_client, constants as cnst
+
+    for index in range(upload_count):
+        file_uuid = "{0:08d}-0000-0000-0000-000000000000".format(index)
+        file_hash = "{0:064x}".format(index)
+        redis_client.add_unique_filename(user_uuid, "scene_{0}.hip".format(index),
+                                         file_uuid, file_hash)
+        for render_index in range(renders_per_upload):
+            node_path = "/obj/geo{0}".format(render_index)
+            render_id = "{0}-{1}".format(file_uuid, render_index)
+            redis_client.store_render_data(cnst.BackgroundRenderType.glb_file, file_uuid,
+                                           render_id + ".glb", node_path, "1-240")
+            redis_client.store_render_data(cnst.BackgroundRenderType.thumbnail, file_uuid,
+                                           render_id + ".png", node_path, None)
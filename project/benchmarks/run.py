@@ -0,0 +1,342 @@
+"""Offline benchmarks for the web server's hot paths.
+
+Runs without Houdini or a redis server: `hou` is replaced by
+`benchmarks.fake_hou` and redis by fakeredis (or `--redis-url`).
+Results are written as JSON so they can be compared across commits.
+
+Usage, from the project directory:
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --only progress_filter --repeat 10
+    python -m benchmarks.run --only redis_round_trips --redis-url redis://localhost:6379/15
+
+A `--redis-url` db must be empty and not db 0, `--flush` wipes it first.
+"""
+import os
+import sys
+import json
+import time
+import datetime
+import itertools
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+from benchmarks import fixtures
+
+_BENCHMARKS = {}
+
+
+def benchmark(name):
+    def decorator(func):
+        _BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def time_calls(func, repeat, warmup=1):
+    for _ in range(warmup):
+        func()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return summarize(timings)
+
+
+def summarize(timings):
+    ordered = sorted(timings)
+    return {
+        "iterations": len(timings),
+        "mean_s": statistics.fmean(timings),
+        "median_s": statistics.median(timings),
+        "min_s": ordered[0],
+        "max_s": ordered[-1],
+        "p95_s": ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)],
+    }
+
+
+@benchmark("process_hip_for_node_structure")
+def bench_node_structure(context, args):
+    from app.api import hou_api
+
+    results = {}
+    for node_count in args.node_counts:
+        network = context.hou.build_network(node_count, node_count * 2, seed=node_count)
+        with context.app.test_request_context():
+            eager = time_calls(lambda: hou_api.process_hip_for_node_structure(network),
+                               args.repeat)
+            lazy = time_calls(lambda: hou_api.process_hip_for_node_structure(
+                network, lazy_cook=True), args.repeat)
+            paged = time_calls(lambda: hou_api.process_hip_for_node_structure(
+                network, limit=500, lazy_cook=True), args.repeat)
+        results[str(node_count)] = {"eager": eager, "lazy": lazy, "first_page_500": paged}
+    return results
+
+
+@benchmark("locate_and_store_icon")
+def bench_icon_lookup(context, args):
+    from app.api import hou_api, icon_index
+
+    icons = context.hou.SOP_ICONS * 100
+
+    def lookup_all():
+        for icon in icons:
+            hou_api.locate_and_store_icon("", icon, {"data": {}})
+
+    def cold_lookup():
+        icon_index.IconIndex._instance = None
+        lookup_all()
+
+    with context.app.test_request_context():
+        cold = time_calls(cold_lookup, args.repeat)
+        warm = time_calls(lookup_all, args.repeat)
+    return {"lookups": len(icons), "cold_index": cold, "warm_index": warm}
+
+
+@benchmark("progress_filter")
+def bench_progress_filter(context, args):
+    from app.api import progress_filter
+
+    line_count = args.progress_lines
+    payload = b"".join(b"[render] ALF_PROGRESS %d%%\nRendering tile %d\n" % (i % 101, i)
+                       for i in range(line_count))
+    emitted = []
+
+    def run_filter():
+        with open(os.devnull, "w") as stream:
+            stream_filter = progress_filter.ProgressFilter(
+                "benchmark_socket", "/obj/geo1", stream=stream,
+                emit_progress=lambda node_path, progress, socket_id: emitted.append(progress))
+            with stream_filter:
+                os.write(stream.fileno(), payload)
+        return stream_filter
+
+    timing = time_calls(run_filter, args.repeat, warmup=0)
+    stats = run_filter().stats()
+    timing["lines"] = line_count * 2
+    timing["lines_per_s"] = timing["lines"] / timing["median_s"]
+    timing["last_run"] = stats
+    return timing
+
+
+@benchmark("cook_profiler")
+def bench_cook_profiler(context, args):
+    from app.api import cook_profiler
+
+    stats = fixtures.load_perfmon_stats()
+    node_stats = cook_profiler.extract_node_stats(stats)
+
+    # Self times must add up to the root's inclusive time, no node counted twice.
+    root = stats["cookStats"]["objects"][0]
+    cook_ms = sum(node_entry["cook_ms"] for node_entry in node_stats.values())
+    if abs(cook_ms - root["stats"]["totalCookTime"]) > 1e-6:
+        raise RuntimeError("Profiled {0}ms of {1}ms cooked.".format(
+            cook_ms, root["stats"]["totalCookTime"]))
+
+    timing = time_calls(lambda: cook_profiler.extract_node_stats(stats), args.repeat)
+    timing["nodes"] = len(node_stats)
+    timing["cook_ms"] = cook_ms
+    return timing
+
+
+@benchmark("get_user_uploaded_file_dicts")
+def bench_stored_models(context, args):
+    from app import redis_client
+
+    user_uuid = "benchmark-user"
+    fixtures.seed_uploads(user_uuid, args.uploads)
+    return {
+        "uploads": args.uploads,
+        "first_page_50": time_calls(
+            lambda: redis_client.get_user_uploaded_file_dicts(user_uuid, 0, 50), args.repeat),
+        "all": time_calls(
+            lambda: redis_client.get_user_uploaded_file_dicts(user_uuid), args.repeat),
+    }
+
+
+@benchmark("redis_round_trips")
+def bench_redis_round_trips(context, args):
+    """Batched writes against the one-command-per-round-trip form they
+    replaced. Only meaningful against a real server, see `--redis-url`.
+    """
+    from app import redis_client, constants as cnst
+
+    redis_conn = redis_client.get_client_instance()
+    counter = itertools.count()
+
+    def add_uploads(add_func):
+        def run():
+            for _ in range(args.redis_writes):
+                index = next(counter)
+                add_func("benchmark-writer", "scene_{0}.hip".format(index),
+                         "upload-{0}".format(index), "{0:064x}".format(index))
+        return run
+
+    def store_renders(store_func):
+        def run():
+            for _ in range(args.redis_writes):
+                render_id = "render-{0}".format(next(counter))
+                store_func(cnst.BackgroundRenderType.glb_file, "benchmark-file",
+                           render_id + ".glb", "/obj/geo1", "1-240")
+        return run
+
+    def map_placeholders(map_func):
+        def run():
+            for _ in range(args.redis_writes):
+                map_func("placeholder-{0}.glb".format(next(counter)))
+        return run
+
+    def compare(sequential_func, batched_func):
+        sequential = time_calls(sequential_func, args.repeat)
+        batched = time_calls(batched_func, args.repeat)
+        return {"sequential": sequential, "batched": batched,
+                "speedup": sequential["median_s"] / batched["median_s"]}
+
+    return {
+        "writes_per_iteration": args.redis_writes,
+        "add_unique_filename": compare(
+            add_uploads(lambda *upload: _add_unique_filename_sequential(redis_conn, *upload)),
+            add_uploads(redis_client.add_unique_filename)),
+        "store_render_data": compare(
+            store_renders(lambda *render: _store_render_data_sequential(redis_conn, *render)),
+            store_renders(redis_client.store_render_data)),
+        "add_placeholder_mapping": compare(
+            map_placeholders(lambda filename: _add_placeholder_mapping_sequential(redis_conn, filename)),
+            map_placeholders(redis_client.add_placeholder_mapping)),
+    }
+
+
+def _add_unique_filename_sequential(redis_conn, user_uuid, original_filename, file_uuid, file_hash):
+    # The same writes as the add_unique_filename script, one round-trip each.
+    if redis_conn.sismember("global:file_hashes", file_hash):
+        return False
+    redis_conn.sadd("global:file_hashes", file_hash)
+    redis_conn.hset(f"user:{user_uuid}:hash_to_uuid", file_hash, file_uuid)
+    redis_conn.hset(f"file_meta:{file_uuid}", "original_filename", original_filename)
+    redis_conn.hset(f"file_meta:{file_uuid}", "upload_time", datetime.datetime.utcnow().isoformat())
+    redis_conn.hset(f"file_meta:{file_uuid}", "file_hash", file_hash)
+    redis_conn.hset(f"file_meta:{file_uuid}", "user_uuid", user_uuid)
+    if redis_conn.sadd(f"user:{user_uuid}:filenames_set", file_uuid):
+        redis_conn.rpush(f"user:{user_uuid}:filenames_list", file_uuid)
+    redis_conn.zadd("storage:access:hip", {file_uuid: time.time()})
+    return True
+
+
+def _store_render_data_sequential(redis_conn, render_type, hip_file_uuid, filename, node_path,
+                                  frame_range):
+    # The same writes as the store_render_data script, one round-trip each.
+    render_data_key = f"file_render_data:{hip_file_uuid}:{render_type}"
+    previous = redis_conn.hget(render_data_key, node_path)
+    redis_conn.hset(render_data_key, node_path, filename)
+    redis_conn.set(f"filename_to_uuid:{filename}", hip_file_uuid)
+    redis_conn.sadd(f"render_refs:{filename}", hip_file_uuid)
+    if previous is not None and previous.decode("utf-8") != filename:
+        redis_conn.srem(f"render_refs:{previous.decode('utf-8')}", hip_file_uuid)
+        redis_conn.zadd("storage:orphan_candidates", {previous: time.time()})
+    redis_conn.hset(f"file_render_data:{hip_file_uuid}:render_time", node_path,
+                    datetime.datetime.utcnow().isoformat())
+    redis_conn.hset(f"file_render_data:{hip_file_uuid}:frame_range", node_path, frame_range)
+
+
+def _add_placeholder_mapping_sequential(redis_conn, filename):
+    redis_conn.set(f"filename_to_uuid:{filename}", "placeholder")
+    redis_conn.hset("file_meta:placeholder", "original_filename", "placeholder.hiplc")
+
+
+@benchmark("receive_render_task")
+def bench_render_submission(context, args):
+    from app import socketio
+
+    network = context.hou.build_network(50, 100)
+    context.hou.hipFile.load("/tmp/benchmark.hip")
+    target = network.children()[-1].path()
+
+    client = socketio.test_client(context.app)
+    render_data = {"start": 1, "end": 1, "step": 1, "path": target,
+                   "file": "benchmark-file", "exportSettings": {}}
+
+    def submit():
+        response = client.emit("submit_render_task", render_data, callback=True)
+        if not response or not response.get("success"):
+            raise RuntimeError("Render submission failed: {0}".format(response))
+
+    timing = time_calls(submit, args.repeat)
+    client.disconnect()
+    return timing
+
+
+class BenchmarkContext:
+    def __init__(self, hou, app):
+        self.hou = hou
+        self.app = app
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"],
+                                       stderr=subprocess.DEVNULL).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--output", help="Write the JSON results to this file.")
+    parser.add_argument("--only", action="append", choices=sorted(_BENCHMARKS),
+                        help="Run only the named benchmark, may be repeated.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--node-counts", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--uploads", type=int, default=500)
+    parser.add_argument("--progress-lines", type=int, default=100000)
+    parser.add_argument("--redis-writes", type=int, default=200,
+                        help="Writes per timed iteration of redis_round_trips.")
+    parser.add_argument("--redis-url", help="Use a local redis-server instead of fakeredis.")
+    parser.add_argument("--flush", action="store_true",
+                        help="Flush the --redis-url db before running, required for db 0 or a "
+                             "non-empty db.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    hou = fixtures.install_fake_hou()
+    fixtures.build_icon_zip(tempfile.mkdtemp(prefix="hou_benchmark_hfs_"))
+
+    try:
+        redis_conn = fixtures.create_fake_redis(args.redis_url, flush=args.flush)
+    except ValueError as exc:
+        sys.exit(str(exc))
+    fixtures.install_redis(redis_conn)
+    app = fixtures.create_benchmark_app(redis_conn)
+    context = BenchmarkContext(hou, app)
+
+    results = {}
+    for name in args.only or sorted(_BENCHMARKS):
+        print("Running {0}...".format(name), file=sys.stderr)
+        results[name] = _BENCHMARKS[name](context, args)
+
+    report = {
+        "commit": get_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "redis": "redis-server" if args.redis_url else "fakeredis",
+        "results": results,
+    }
+
+    report_json = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(report_json)
+    else:
+        print(report_json)
+
+
+if __name__ == "__main__":
+    main()
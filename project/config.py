@@ -1,6 +1,6 @@
 import os
 from dotenv import load_dotenv
-from app import redis_client
+from app import redis_client, constants as cnst
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 load_dotenv(os.path.join(basedir, '.env'))
@@ -13,10 +13,24 @@ class Config(object):
     STATIC_FOLDER = os.path.join(BASE_DIR, 'static')
     USER_RENDER_DIR = os.path.join(STATIC_FOLDER, 'user_renders')
 
+    # Let nginx deliver downloads through internal locations (see nginx.conf).
+    USE_X_ACCEL_REDIRECT = True
+    RENDER_ARCHIVE_ACCEL_ROUTE = "/protected/render_archives/"
+    MODEL_ACCEL_ROUTE = "/protected/user_models/"
+    HIP_ACCEL_ROUTE = "/protected/hip_storage/"
+    PLACEHOLDER_ACCEL_ROUTE = "/protected/placeholder/"
+
     # Mounted volume between celery and houdini server.
     UPLOAD_FOLDER = "/root/hip_storage"
     ALLOWED_EXTENSIONS = {".hip", ".hiplc", ".hipnc"}
 
+    # Largest .hip accepted. Matches nginx's client_max_body_size, which
+    # chunked uploads would otherwise get around.
+    MAX_UPLOAD_SIZE = 500 * 1024 * 1024
+
+    # Resumable uploads a user can have open at once.
+    MAX_UPLOAD_SESSIONS = 4
+
     # Default .glb file to load upon loading site.
     PLACEHOLDER_DIR = "placeholder"
     PLACEHOLDER_FILE = "placeholder.glb"
@@ -32,7 +46,44 @@ class Config(object):
     SESSION_USE_SIGNER = True
     SESSION_REDIS = redis_client.get_client_instance()
 
+    # Relays emit Socket.IO events to every web worker through this queue (see event_relay).
+    SOCKETIO_MESSAGE_QUEUE = cnst.SOCKETIO_MESSAGE_QUEUE
+
+    # Deliver render events published by Celery from each web worker.
+    RENDER_EVENT_RELAY = True
+
+    # Embed node icons as data URIs instead of referencing /node_icon URLs.
+    INLINE_NODE_ICONS = False
+
+    # Serve identical submissions from previously rendered outputs.
+    RENDER_CACHE_ENABLED = True
+
+    # Route tasks to the worker that already has the target .hip loaded.
+    SCENE_AFFINITY_ROUTING = True
+
     CELERY = {
         "broker_url": 'redis://redis:6379/0',
-        "result_backend": 'redis://redis:6379/0'
+        "result_backend": 'redis://redis:6379/0',
+        # Gives each worker a dedicated queue used for scene affinity routing.
+        "worker_direct": True,
+        # Interactive previews and batch ROP renders are consumed separately
+        # so long sequences can't starve thumbnails (see Dockerfile.celery).
+        "task_default_queue": cnst.CeleryQueues.interactive,
+        "task_routes": {
+            "app.tasks.execute_render_rop": {"queue": cnst.CeleryQueues.batch},
+            "app.tasks.render_rop_shard": {"queue": cnst.CeleryQueues.batch},
+            # Keeps the reserved interactive slots free for previews.
+            "app.tasks.sweep_storage": {"queue": cnst.CeleryQueues.batch},
+        },
+        # Scheduled by `celery beat` (see Dockerfile.celery).
+        "beat_schedule": {
+            "sweep-storage": {
+                "task": "app.tasks.sweep_storage",
+                "schedule": cnst.STORAGE_GC_INTERVAL,
+                # Sweeps stuck behind long ROP renders are dropped, not piled up.
+                "options": {"expires": cnst.STORAGE_GC_INTERVAL},
+            },
+        },
+        # Only reserve one job at a time, renders are long running.
+        "worker_prefetch_multiplier": 1,
     }
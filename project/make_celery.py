@@ -1,4 +1,8 @@
 import os
+
+# Size the redis connection pool for a Celery worker rather than the web tier.
+os.environ.setdefault("REDIS_PROCESS_TYPE", "celery")
+
 from app import create_app
 
 # Ensure that the celery workers spawn, not fork!
@@ -9,6 +9,24 @@ export const DEFAULT_SKYBOXES = {
 export const DEFAULT_MODEL_ROUTE = '/static/user_models/';
 export const DEFAULT_THUMBNAIL_ROUTE = '/static/user_thumbnails/';
 
+// Suffix of the low-poly proxy LOD exported ahead of a full resolution model.
+export const PROXY_MODEL_SUFFIX = '_proxy.glb';
+
+// Number of nodes requested per /node_data page.
+export const NODE_DATA_PAGE_SIZE = 500;
+
+// Files above this size are uploaded in resumable chunks.
+export const CHUNKED_UPLOAD_THRESHOLD = 16 * 1024 * 1024;
+
+// Consecutive failed chunks tolerated before giving up on an upload.
+export const UPLOAD_MAX_RETRIES = 5;
+
+// Number of uploads requested per /get_stored_models page.
+export const STORED_MODELS_PAGE_SIZE = 50;
+
+// localStorage key of the last render event received per .hip, replayed from on reconnect.
+export const RENDER_EVENT_CURSORS_KEY = 'renderEventCursors';
+
 export const DEFAULT_CAMERA_OPTION = {
 	text: 'No cam',
 	value: 'defaultCamera',
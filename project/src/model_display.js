@@ -8,12 +8,14 @@ import {
 	DEFAULT_SKYBOXES,
 	DEFAULT_CAMERA_OPTION,
 	DEFAULT_MODEL_ROUTE,
+	PROXY_MODEL_SUFFIX,
 } from './constants';
 
 // Must specify the loader as suffix here.
 import '@babylonjs/loaders/glTF';
 
 let sceneManager, globalSettings;
+let displayedFileName = null;
 
 class SceneManager {
 	constructor() {
@@ -1057,9 +1059,14 @@ function generateShareableLink(fileName, placeholder) {
 		});
 }
 
+export function getDisplayedModel() {
+	return displayedFileName;
+}
+
 // Handle loading and clearing models.
 export function loadModel(fileName, frameRange, root_url = DEFAULT_MODEL_ROUTE) {
 	sceneManager.handleUnfreeze(true);
+	displayedFileName = fileName;
 
 	clearModels();
 	BABYLON.SceneLoader.ImportMeshAsync(null, root_url, fileName, sceneManager.scene)
@@ -1067,7 +1074,10 @@ export function loadModel(fileName, frameRange, root_url = DEFAULT_MODEL_ROUTE)
 			console.log('GLB Loaded Successfully!');
 
 			// Retrieve the nano id shareable string.
-			generateShareableLink(fileName, fileName === 'placeholder.glb');
+			// Proxies are replaced by their full model, which is the one worth sharing.
+			if (!fileName.endsWith(PROXY_MODEL_SUFFIX)) {
+				generateShareableLink(fileName, fileName === 'placeholder.glb');
+			}
 
 			// If we're loading from a non-standard location, ensure we update the state.
 			// This will ensure future visits to the display models page maintain the state.
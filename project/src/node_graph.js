@@ -1,11 +1,18 @@
 import { cytoscape, io } from './main';
 import { createThumbnail } from './stored_models.js';
-import { DEFAULT_THUMBNAIL_ROUTE } from './constants';
+import {
+	DEFAULT_THUMBNAIL_ROUTE,
+	NODE_DATA_PAGE_SIZE,
+	PROXY_MODEL_SUFFIX,
+	RENDER_EVENT_CURSORS_KEY,
+} from './constants';
 import { exportSettings } from './sidebar.js';
+import { loadModel, getDisplayedModel } from './model_display';
 
 let holdTimer = null;
 let isContextMenuListenerAdded = false;
 let globalFileUuid = null;
+let graphLoadId = 0;
 let poppers = {};
 const appState = {
 	activeNode: null,
@@ -236,8 +243,47 @@ function displayNodeContext(cy, nodeName, nodeData) {
 	handleRenderAllButton(nodeData);
 	handleGlobalCookingBar(nodeName);
 	generateContextButtons(cy, nodeName, nodeData.parent_icons);
-	cy.add(nodeData.elements);
+
+	const pendingEdges = [];
+	addGraphElements(cy, nodeData.elements, pendingEdges);
 	cy.layout({ name: 'dagre' }).run();
+	appendRemainingPages(cy, nodeName, nodeData.next_cursor, pendingEdges);
+}
+
+async function appendRemainingPages(cy, nodeName, cursor, pendingEdges) {
+	// Large contexts arrive in pages, each is shown as soon as it arrives.
+	const loadId = ++graphLoadId;
+	const fileUuid = globalFileUuid;
+	while (cursor !== null && cursor !== undefined) {
+		let page;
+		try {
+			page = await fetchNodeDataPage(fileUuid, nodeName, cursor);
+		} catch (error) {
+			console.error('Error fetching node data: ', error);
+			return;
+		}
+
+		// Stop once another context has been displayed.
+		if (loadId !== graphLoadId) {
+			return;
+		}
+		addGraphElements(cy, page.elements, pendingEdges);
+		cy.layout({ name: 'dagre' }).run();
+		cursor = page.next_cursor;
+	}
+}
+
+function addGraphElements(cy, elements, pendingEdges) {
+	// Edges can lead to a node of a later page, hold them back until it arrives.
+	const edges = pendingEdges.splice(0).concat(elements.filter((element) => element.data.source));
+	cy.add(elements.filter((element) => !element.data.source));
+	edges.forEach((edge) => {
+		if (cy.getElementById(edge.data.target).nonempty()) {
+			cy.add(edge);
+		} else {
+			pendingEdges.push(edge);
+		}
+	});
 }
 
 function handleGlobalCookingBar(nodeName) {
@@ -324,6 +370,10 @@ function setupPoppers(cy) {
 		if (appState.activeNode && appState.activeNode === node) {
 			const popperId = `${node.id()}_popper`;
 			const popperDiv = document.getElementById(popperId);
+			if (!popperDiv) {
+				// Still validating the node, the popper opens once it's done.
+				return;
+			}
 			if (popperDiv.hasAttribute('data-show')) {
 				hidePopper(popperDiv);
 			} else {
@@ -358,8 +408,16 @@ export function deletePoppers() {
 	}
 }
 
-function createPopperForNode(cy, node) {
+async function createPopperForNode(cy, node) {
 	const popperId = `${node.id()}_popper`;
+	if (!poppers[popperId]) {
+		await fetchNodeCookable(node);
+		// Another node was selected while this one was validated.
+		if (appState.activeNode !== node) {
+			return;
+		}
+	}
+
 	if (poppers[popperId]) {
 		poppers[popperId].setOptions((options) => ({
 			...options,
@@ -389,6 +447,27 @@ function createPopperForNode(cy, node) {
 	cy.on('pan zoom resize', update);
 }
 
+async function fetchNodeCookable(node) {
+	// The graph is loaded with `lazy_cook`, render geometry is validated per node on demand.
+	if (node.data('can_cook')) {
+		return;
+	}
+
+	try {
+		const response = await fetch(
+			`/node_cookable?uuid=${encodeURIComponent(globalFileUuid)}&path=${encodeURIComponent(node.data('path'))}`,
+		);
+		if (!response.ok) {
+			throw new Error(`HTTP error! status: ${response.status}`);
+		}
+		const result = await response.json();
+		node.data('can_cook', result.can_cook);
+	} catch (error) {
+		console.error('Error validating node: ', error);
+		node.data('can_cook', [false, 'Unable to validate this node.']);
+	}
+}
+
 function hidePopper(popperElement) {
 	popperElement.removeAttribute('data-show');
 	popperElement.style.pointerEvents = 'none';
@@ -571,7 +650,7 @@ function buildPopperDiv(node) {
 	const nodeCache = nodeGraphManager.getNodeStateCache(nodeContext);
 
 	const nodeName = node.data('id');
-	const nodeLastCooked = nodeCache?.lastCooked ?? node.data('cooktime');
+	const nodeLastCooked = nodeCache?.lastCooked;
 
 	const nodeStartFrame = nodeCache?.startFrame ?? nodeGraphManager.getDefaultStart();
 	const nodeEndFrame = nodeCache?.endFrame ?? nodeGraphManager.getDefaultEnd();
@@ -603,6 +682,14 @@ function buildPopperDiv(node) {
                         <div class="node-status-value" id="node-last-cooked" data-node-path="${nodeContext}">
                         </div>
                     </div>
+                    <div id="node-cook-time">
+                        <div class="node-status-label">
+                            Cook Time:
+                        </div>
+                        <div class="node-status-value">
+                            ${formatCookStats(node.data('cook_stats'))}
+                        </div>
+                    </div>
                 </div>
                 <div id="frame-input-container">
                     <label for="start-frame">Start/End</label>
@@ -698,6 +785,62 @@ function registerEventListeners() {
 	appState.socket.on('node_thumb_finish_channel', handleThumbFinish);
 	appState.socket.on('node_render_finish_channel', handleRenderFinish);
 	appState.socket.on('render_rop_finish_channel', handleRopFinish);
+	appState.socket.on('render_rop_fail_channel', handleRopFailed);
+	// Fired on every (re)connection, completions missed meanwhile are replayed.
+	appState.socket.on('connect', resyncRenderEvents);
+}
+
+function loadEventCursors() {
+	return JSON.parse(localStorage.getItem(RENDER_EVENT_CURSORS_KEY)) || {};
+}
+
+function saveEventCursors(cursors) {
+	localStorage.setItem(RENDER_EVENT_CURSORS_KEY, JSON.stringify(cursors));
+}
+
+// Event IDs are redis stream IDs, `<milliseconds>-<sequence>`.
+function compareEventIds(a, b) {
+	const [aTime, aSeq] = a.split('-').map(Number);
+	const [bTime, bSeq] = b.split('-').map(Number);
+	return aTime - bTime || aSeq - bSeq;
+}
+
+// Move the file's cursor forward, returns false if the ID isn't newer.
+function advanceEventCursor(fileUuid, eventId) {
+	const cursors = loadEventCursors();
+	if (cursors[fileUuid] && compareEventIds(eventId, cursors[fileUuid]) <= 0) {
+		return false;
+	}
+	cursors[fileUuid] = eventId;
+	saveEventCursors(cursors);
+	return true;
+}
+
+// Filters out completions delivered both live and by a resync.
+function isNewRenderEvent(data) {
+	if (!data.eventId || !data.eventFile) {
+		return true;
+	}
+	return advanceEventCursor(data.eventFile, data.eventId);
+}
+
+function resyncRenderEvents() {
+	const cursors = loadEventCursors();
+	const fileUuid = nodeGraphManager.getLatestUUID();
+	if (fileUuid && !(fileUuid in cursors)) {
+		cursors[fileUuid] = null;
+	}
+
+	const entries = Object.entries(cursors).map(([file, lastEventId]) => ({ file, lastEventId }));
+	if (!entries.length) {
+		return;
+	}
+
+	appState.socket.emit('resync_render_events', { cursors: entries }, (response) => {
+		Object.entries(response.cursors).forEach(([file, eventId]) => {
+			advanceEventCursor(file, eventId);
+		});
+	});
 }
 
 function handleRenderUpdate(data) {
@@ -714,6 +857,10 @@ function handleThumbUpdate(data) {
 }
 
 function handleThumbFinish(data) {
+	if (!isNewRenderEvent(data)) {
+		return;
+	}
+	acknowledgeRenderDelivery(data, 'thumb');
 	const route = data.staticRoute || DEFAULT_THUMBNAIL_ROUTE;
 	const thumbUrl = route + data.fileName;
 	nodeGraphManager.updateNodeStateCache(data.nodePath, 'thumbnail', thumbUrl);
@@ -724,8 +871,10 @@ function handleThumbFinish(data) {
 		thumbnail.style.display = 'block';
 	}
 
-	// Update the Stored Models Page
-	updateStoredModelEntry(data);
+	// Update the Stored Models Page once the final thumbnail arrives.
+	if (data.lod !== 'proxy') {
+		updateStoredModelEntry(data);
+	}
 }
 
 function updateStoredModelEntry(data) {
@@ -747,12 +896,50 @@ function updateStoredModelEntry(data) {
 }
 
 function handleRenderFinish(data) {
+	if (!isNewRenderEvent(data)) {
+		return;
+	}
+	acknowledgeRenderDelivery(data, 'glb');
 	nodeGraphManager.addRender(data.fileName, data.nodePath, data.frameRange);
+	if (data.lod === 'proxy') {
+		// Show the proxy straight away if the model display is open.
+		if (isModelDisplayActive()) {
+			loadModel(data.fileName, data.frameRange);
+		}
+		return;
+	}
+
 	nodeGraphManager.updateNodeStateCache(data.nodePath, 'has_cooked', true);
 	handlePostRender(data.nodePath);
+
+	// Swap a displayed proxy for the full resolution model.
+	const proxyFileName = data.fileName.replace(/\.glb$/, PROXY_MODEL_SUFFIX);
+	if (getDisplayedModel() === proxyFileName) {
+		loadModel(data.fileName, data.frameRange);
+	}
+}
+
+// Completes the render's trace timeline on the server.
+function acknowledgeRenderDelivery(data, renderType) {
+	if (data.traceId) {
+		appState.socket.emit('render_trace_ack', {
+			traceId: data.traceId,
+			renderType: renderType,
+			lod: data.lod,
+		});
+	}
+}
+
+function isModelDisplayActive() {
+	const displayModel = document.getElementById('display-model');
+	return displayModel !== null && displayModel.classList.contains('active');
 }
 
 function handleRopFinish(data) {
+	if (!isNewRenderEvent(data)) {
+		return;
+	}
+	acknowledgeRenderDelivery(data, 'rop');
 	// Trigger a download of the zipped files in the directory.
 	if (!data.fileName) {
 		console.error('No valid filename returned on ROP finish!');
@@ -775,6 +962,19 @@ function handleRopFinish(data) {
 		.catch((err) => console.error('Error downloading the zip file:', err));
 }
 
+function handleRopFailed(data) {
+	if (!isNewRenderEvent(data)) {
+		return;
+	}
+	console.error(`Render of ${data.nodePath} failed, not every frame was rendered.`);
+
+	// The sequence won't complete, don't leave the progress bar hanging.
+	const bar = document.querySelector(`#cooking-bar[data-node-path="${data.nodePath}"]`);
+	if (bar) {
+		bar.style.width = '0%';
+	}
+}
+
 function startRenderTask(node) {
 	const startFrameInput = document.getElementById('start-frame');
 	const endFrameInput = document.getElementById('end-frame');
@@ -819,6 +1019,17 @@ function submitRenderTask(start, end, nodePath) {
 				// TODO Display successful submission
 				console.log(response.message);
 
+				// Start tracking the file so its completions survive a reconnect.
+				const fileUuid = nodeGraphManager.getLatestUUID();
+				if (fileUuid && response.eventCursor && !(fileUuid in loadEventCursors())) {
+					advanceEventCursor(fileUuid, response.eventCursor);
+				}
+
+				// Cached renders already delivered their thumbnail.
+				if (response.cached) {
+					return;
+				}
+
 				// Hide the thumbnail (if it exists)
 				const thumbnail = document.querySelector(
 					`#node-thumbnail[data-node-path="${nodePath}"]`,
@@ -879,6 +1090,20 @@ function getCurrentFormattedTime() {
 	return `${hours}:${minutes}:${seconds} ${amPm}`;
 }
 
+// Profiled cook stats are totals over the render's frame range.
+function formatCookStats(cookStats) {
+	if (!cookStats) {
+		return 'Not profiled';
+	}
+
+	const cookTime =
+		cookStats.cook_ms >= 1000
+			? `${(cookStats.cook_ms / 1000).toFixed(2)} s`
+			: `${cookStats.cook_ms.toFixed(1)} ms`;
+	const memory = cookStats.memory ? `, ${(cookStats.memory / 1024 ** 2).toFixed(1)} MB` : '';
+	return `${cookTime} (${cookStats.cooks} cooks${memory})`;
+}
+
 function handlePostRender(nodePath) {
 	// Update the Last Cooked to include time data.
 	const last_cooked = document.querySelector(`.node-status-value[data-node-path="${nodePath}"]`);
@@ -899,11 +1124,8 @@ async function updateGraph(cy, nodeName, file_uuid = globalFileUuid, store_view_
 
 	try {
 		globalFileUuid = file_uuid;
-		const response = await fetch(`/node_data?uuid=${file_uuid}&name=${nodeName}`);
-
-		if (!response.ok) {
-			throw new Error(`HTTP error! status: ${response.status}`);
-		}
+		// Only the first page, the rest are appended once it's displayed.
+		const nodeData = await fetchNodeDataPage(file_uuid, nodeName, 0);
 
 		if (store_view_state) {
 			const oldContext = nodeGraphManager.getLatestContext();
@@ -911,8 +1133,19 @@ async function updateGraph(cy, nodeName, file_uuid = globalFileUuid, store_view_
 		}
 
 		nodeGraphManager.updateContext(nodeName);
-		return await response.json();
+		return nodeData;
 	} catch (error) {
 		console.error('Error fetching node data: ', error);
 	}
 }
+
+async function fetchNodeDataPage(file_uuid, nodeName, cursor) {
+	// Cookability is left to `fetchNodeCookable`, cooking every node would delay the page.
+	const response = await fetch(
+		`/node_data?uuid=${file_uuid}&name=${nodeName}&limit=${NODE_DATA_PAGE_SIZE}&lazy_cook=true&cursor=${cursor}`,
+	);
+	if (!response.ok) {
+		throw new Error(`HTTP error! status: ${response.status}`);
+	}
+	return response.json();
+}
@@ -1,6 +1,7 @@
 import * as modelDisplay from './model_display';
 import { nodeGraphManager, initNodeGraph, deletePoppers } from './node_graph';
 import { handleStoredModels, handleStoredModelsToggle } from './stored_models';
+import { CHUNKED_UPLOAD_THRESHOLD, UPLOAD_MAX_RETRIES } from './constants';
 
 import Swal from 'sweetalert2';
 
@@ -11,6 +12,9 @@ class globalExportSettings {
 			exportCameras: true,
 			exportLights: true,
 			customAttribs: true,
+			optimizeGlb: false,
+			proxyLod: true,
+			profileCook: false,
 		};
 		this.loadParams();
 	}
@@ -29,7 +33,8 @@ class globalExportSettings {
 	loadParams() {
 		const savedSettings = JSON.parse(localStorage.getItem('exportSettings'));
 		if (savedSettings) {
-			this.exportParams = savedSettings;
+			// Keep defaults for settings added since the user last saved.
+			this.exportParams = { ...this.exportParams, ...savedSettings };
 		}
 	}
 }
@@ -126,18 +131,24 @@ async function connectHIP() {
 	uploadForm.addEventListener('submit', async function (e) {
 		e.preventDefault();
 		let formData = new FormData(this);
+		const hipFile = formData.get('hipfile');
 
 		try {
-			const response = await fetch('hip_upload', {
-				method: 'POST',
-				body: formData,
-			});
-
-			if (!response.ok) {
-				throw new Error('Upload failed...');
+			let data;
+			if (hipFile instanceof File && hipFile.size > CHUNKED_UPLOAD_THRESHOLD) {
+				data = await uploadHipInChunks(hipFile);
+			} else {
+				const response = await fetch('hip_upload', {
+					method: 'POST',
+					body: formData,
+				});
+
+				if (!response.ok) {
+					throw new Error('Upload failed...');
+				}
+				data = await response.json();
 			}
 
-			const data = await response.json();
 			nodeGraphManager.setFileUUID(data.uuid);
 			await fetch_node_graph(data.uuid);
 		} catch (error) {
@@ -146,6 +157,67 @@ async function connectHIP() {
 	});
 }
 
+// Send large .hip files as a resumable sequence of chunks.
+async function uploadHipInChunks(hipFile) {
+	// Every request of the upload changes state, so each carries the csrfToken.
+	const csrfToken = document.querySelector('meta[name="csrf-token"]').getAttribute('content');
+	const sessionResponse = await fetch('hip_upload/sessions', {
+		method: 'POST',
+		headers: {
+			'Content-Type': 'application/json',
+			'X-CSRFToken': csrfToken,
+		},
+		body: JSON.stringify({ filename: hipFile.name, size: hipFile.size }),
+	});
+	if (!sessionResponse.ok) {
+		const { message } = await sessionResponse.json().catch(() => ({}));
+		throw new Error(message || 'Upload failed...');
+	}
+
+	const { uploadId, chunkSize } = await sessionResponse.json();
+	const statusMessage = document.querySelector('.status-message');
+	let offset = 0;
+	let retries = 0;
+
+	while (true) {
+		const chunk = hipFile.slice(offset, offset + chunkSize);
+		let response;
+		try {
+			response = await fetch(`hip_upload/sessions/${uploadId}?offset=${offset}`, {
+				method: 'PUT',
+				headers: {
+					'Content-Type': 'application/octet-stream',
+					'X-CSRFToken': csrfToken,
+				},
+				body: chunk,
+			});
+		} catch (error) {
+			response = null;
+		}
+
+		if (response && response.ok) {
+			const data = await response.json();
+			if (data.uuid) {
+				return data;
+			}
+			offset = data.offset;
+			retries = 0;
+			statusMessage.innerText = `Uploading... ${Math.floor((offset / hipFile.size) * 100)}%`;
+			continue;
+		}
+
+		// Resume from wherever the server says the upload got to.
+		if (++retries > UPLOAD_MAX_RETRIES) {
+			throw new Error('Upload failed...');
+		}
+		const resumeResponse = await fetch(`hip_upload/sessions/${uploadId}`);
+		if (!resumeResponse.ok) {
+			throw new Error('Upload failed...');
+		}
+		offset = (await resumeResponse.json()).offset;
+	}
+}
+
 export function hideRenderCanvas() {
 	var canvas = document.getElementById('renderCanvas');
 	if (canvas) {
@@ -483,6 +555,9 @@ function displayGlobalSettings() {
 	const exportMaterials = exportSettings.exportParams.exportMaterials;
 	const exportCameras = exportSettings.exportParams.exportCameras;
 	const exportLights = exportSettings.exportParams.exportLights;
+	const optimizeGlb = exportSettings.exportParams.optimizeGlb;
+	const proxyLod = exportSettings.exportParams.proxyLod;
+	const profileCook = exportSettings.exportParams.profileCook;
 
 	Swal.fire({
 		title: 'Global Settings',
@@ -508,6 +583,21 @@ function displayGlobalSettings() {
 						<input id="exportLights" type="checkbox" ${exportLights ? 'checked' : ''}> Export Lights
 					</label>
 				</div>
+				<div>
+					<label>
+						<input id="optimizeGlb" type="checkbox" ${optimizeGlb ? 'checked' : ''}> Optimize GLB (Weld, Quantize, Strip)
+					</label>
+				</div>
+				<div>
+					<label>
+						<input id="proxyLod" type="checkbox" ${proxyLod ? 'checked' : ''}> Preview Low-Poly Proxy First
+					</label>
+				</div>
+				<div>
+					<label>
+						<input id="profileCook" type="checkbox" ${profileCook ? 'checked' : ''}> Profile Node Cook Times
+					</label>
+				</div>
 			</div>
     	`,
 		animation: false,
@@ -1,6 +1,6 @@
 import { onNodeGraphExit, hideRenderCanvas, handleDisplayModel } from './sidebar';
 import { nodeGraphManager } from './node_graph';
-import { DEFAULT_THUMBNAIL_ROUTE } from './constants';
+import { DEFAULT_THUMBNAIL_ROUTE, STORED_MODELS_PAGE_SIZE } from './constants';
 
 function initializeStoredModels(storedModels) {
 	const defaultWidth = '256px';
@@ -75,21 +75,30 @@ export async function handleStoredModels() {
 		console.debug('The user UUID is:', userUuid);
 
 		try {
-			const response = await fetch(
-				`get_stored_models?userUuid=${encodeURIComponent(userUuid)}`,
-			);
+			// Uploads are paged newest first, append each page as it arrives.
+			let offset = 0;
+			let total = 0;
+			do {
+				const response = await fetch(
+					`get_stored_models?userUuid=${encodeURIComponent(userUuid)}` +
+						`&offset=${offset}&limit=${STORED_MODELS_PAGE_SIZE}`,
+				);
+
+				if (!response.ok) {
+					throw new Error(`Failed to load the node graph, status: ${response.status}`);
+				}
+				const data = await response.json();
 
-			if (!response.ok) {
-				throw new Error(`Failed to load the node graph, status: ${response.status}`);
-			}
-			const data = await response.json();
+				if (data.model_data) {
+					populateFiles(data.model_data, offset > 0);
+				} else if (offset === 0) {
+					console.error(data.message);
+					handleEmptyModelData();
+				}
 
-			if (data.model_data) {
-				populateFiles(data.model_data);
-			} else {
-				console.error(data.message);
-				handleEmptyModelData();
-			}
+				total = data.total;
+				offset += STORED_MODELS_PAGE_SIZE;
+			} while (offset < total);
 		} catch (error) {
 			console.error('Error fetching stored models:', error.message);
 		}
@@ -103,14 +112,16 @@ function handleEmptyModelData() {
 	console.log('No valid renders found for user.');
 }
 
-function populateFiles(files) {
+function populateFiles(files, append = false) {
 	if (!Array.isArray(files)) {
 		console.error('Invalid input: expected an array, got', typeof files);
 		return;
 	}
 
 	const container = document.getElementById('models-container');
-	container.innerHTML = '';
+	if (!append) {
+		container.innerHTML = '';
+	}
 
 	files.forEach((file) => {
 		if (!file.glb) {